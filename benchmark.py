@@ -0,0 +1,241 @@
+""" Benchmarks of the telemetry reception pipeline
+
+Use `python benchmark.py decode` to split and decode a telemetry log the way it is
+received from the serial link, in chunks of 2048 bytes. The lines are split either
+by copying them (as bytearray.split() does) or as views of the received chunks. The
+time, the number of memory blocks allocated to hold the lines and their total size
+are displayed for both. The views keep the chunks alive and are slower to create, and
+the Gateway hands the frames to threads that outlive the chunks: the serial link is
+split into copies (see utils.framing)
+
+Use `python benchmark.py receive` to push a stream of several megabytes (the log
+repeated, 8 MB by default, see `--size`) through the receive path, read 2048 bytes at
+a time. The former path (bytearray.extend() then split()) and the framer fed with the
+read bytes, as SerialWrapper.readlines() does, are compared. The time and the peak of
+memory allocated during the reception are displayed for both
+
+Use `python benchmark.py replay` to replay the log in FILE mode with a simulated clock
+(see utils.clock): the reads are the same as in real time, 100 ms apart, but the whole
+flight is replayed without waiting. The decoded values are checked to be identical to
+the ones of the whole log decoded at once
+
+The log file can be given as a second argument. The default file is
+./data/2019-12-04T11-15-39_Telemetry.log
+
+"""
+
+import io
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.clock import SimulatedClock
+from utils.sensors import Sigmundr
+from utils.serialwrapper import SerialWrapper
+from utils.framing import LineFramer, split_lines
+
+
+CHUNK_SIZE = 2048  # Maximum number of bytes read from the serial link at once
+STREAM_SIZE = 8  # Default size of the stream pushed through the receive path, in MB
+
+
+def split_copy(chunks):
+    """ Split the chunks into lines copied by bytearray.split() """
+    frames = []
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        r = buffer.split(b'\r\n')
+        buffer = r[-1]
+        frames.extend(r[:-1])
+    return frames
+
+
+def split_view(chunks):
+    """ Split the chunks into lines as views of the chunks, see split_lines() """
+    frames = []
+    buffer = b''
+    for chunk in chunks:
+        buffer = buffer + chunk if buffer else chunk
+        lines, rest = split_lines(buffer)
+        buffer = buffer[rest:]
+        frames.extend(lines)
+    return frames
+
+
+def measure(split, chunks):
+    """ Split and decode the chunks
+
+    Returns
+    -------
+    duration : float
+        time to split and decode the chunks in seconds, without tracing
+    blocks : int
+        number of memory blocks allocated by the splitting and still in use
+    size : int
+        size of these memory blocks in bytes
+
+    """
+    sensors = Sigmundr(capacity=None)
+    start = time.perf_counter()
+    frames = split(chunks)
+    sensors.update_sensors_batch(frames)
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    frames = split(chunks)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = snapshot.statistics('filename')
+    blocks = sum(stat.count for stat in stats)
+    size = sum(stat.size for stat in stats)
+
+    return duration, blocks, size
+
+
+def benchmark_decode(filepath):
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    chunks = [data[i:i+CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+    print("{} : {} bytes in {} chunks".format(filepath, len(data), len(chunks)))
+    for name, split in [("copy", split_copy), ("view", split_view)]:
+        duration, blocks, size = measure(split, chunks)
+        print("{:>5} : {:7.1f} ms, {:6} blocks allocated, {:8} bytes".format(
+            name, duration*1000, blocks, size))
+
+
+def receive_copy(stream, framer):
+    """ Receive the stream like the former SerialWrapper.readlines() """
+    count = 0
+    buffer = bytearray()
+    data = stream.read(CHUNK_SIZE)
+    while data:
+        buffer.extend(data)
+        r = buffer.split(b'\r\n')
+        buffer = r[-1]
+        count += len(r) - 1
+        data = stream.read(CHUNK_SIZE)
+    return count
+
+
+def receive_feed(stream, framer):
+    """ Receive the stream like SerialWrapper.readlines(), with a framer fed with the
+    read bytes """
+    count = 0
+    data = stream.read(CHUNK_SIZE)
+    while data:
+        count += len(framer.feed(data))
+        data = stream.read(CHUNK_SIZE)
+    return count
+
+
+def measure_receive(receive, data):
+    """ Push the stream through a receive path
+
+    Returns
+    -------
+    duration : float
+        time to receive the stream in seconds, without tracing
+    count : int
+        number of frames received
+    peak : int
+        peak of the memory allocated during the reception in bytes
+
+    """
+    def run():
+        # The frames are not validated, to compare the receive paths only
+        return receive(io.BytesIO(data), LineFramer())
+
+    start = time.perf_counter()
+    count = run()
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, count, peak
+
+
+def benchmark_receive(filepath, size):
+    with open(filepath, 'rb') as file:
+        data = file.read()
+    data = data*max(1, size*2**20//len(data))
+
+    print("{} repeated : {:.1f} MB".format(filepath, len(data)/2**20))
+    for name, receive in [("copy", receive_copy), ("feed", receive_feed)]:
+        duration, count, peak = measure_receive(receive, data)
+        print("{:>5} : {:7.1f} ms, {:7.1f} MB/s, {} frames, {:8} bytes peak".format(
+            name, duration*1000, len(data)/2**20/duration, count, peak))
+
+
+def decoded_values(vehicle):
+    """ Return {(sensor, column): values} of all the samples of a vehicle """
+    values = {}
+    for name, sensor in vars(vehicle).items():
+        if hasattr(sensor, 'raw_data'):
+            for column in sensor.raw_data.keys():
+                if column != 'Raw':
+                    values[(name, column)] = np.asarray(sensor.raw_data[column])
+
+    return values
+
+
+def benchmark_replay(filepath):
+    clock = SimulatedClock()
+    replayed = Sigmundr(capacity=None)
+    serial = SerialWrapper(115200, "Replay", filepath=filepath, sensors=Sigmundr(), clock=clock)
+    if not serial.open_link():
+        return
+
+    start = time.perf_counter()
+    reads = 0
+    while not serial.failed:
+        replayed.update_sensors_batch(serial.readlines())
+        reads += 1
+    duration = time.perf_counter() - start
+
+    # The whole log decoded at once
+    expected = Sigmundr(capacity=None)
+    expected.update_sensors_batch(serial.log.frames(0, len(serial.log)))
+
+    replayed_values = decoded_values(replayed)
+    expected_values = decoded_values(expected)
+    # Missing values are NaN in both
+    identical = replayed_values.keys() == expected_values.keys() and all(
+        np.array_equal(replayed_values[key], values, equal_nan=values.dtype.kind == 'f')
+        for key, values in expected_values.items())
+
+    print("{} : {} frames, {:.1f} s of flight".format(filepath, len(serial.log), serial.replay.duration))
+    print("replay : {:7.1f} ms, {} reads, simulated clock at {:.1f} s, {}".format(
+        duration*1000, reads, clock.monotonic(), "identical" if identical else "DIFFERENT"))
+
+
+if __name__ == "__main__":
+
+    if not len(sys.argv) >= 2 or sys.argv[1] not in ("decode", "receive", "replay"):
+        print("Error : run the script with 'decode', 'receive' or 'replay' as argument")
+
+    else:
+        args = sys.argv[2:]
+        size = STREAM_SIZE
+        if "--size" in args:
+            i = args.index("--size")
+            size = int(args[i + 1])
+            del args[i:i + 2]
+
+        if args:
+            filepath = args[0]
+        else:
+            filepath = "./data/2019-12-04T11-15-39_Telemetry.log"
+
+        if sys.argv[1] == "decode":
+            benchmark_decode(filepath)
+        elif sys.argv[1] == "receive":
+            benchmark_receive(filepath, size)
+        else:
+            benchmark_replay(filepath)
@@ -0,0 +1,70 @@
+""" Convert the legacy telemetry logs into session logs
+
+The legacy logs (frames separated by b'\r\n') are converted into session logs (see
+utils.sessionlog), saved next to them with the extension .slog. The frames are
+found with the frame formats of the vehicle that sent them, chosen from the name of
+the Gateway at the end of the file name (eg. 2019-12-04T11-15-39_Telemetry.log):
+    - Telemetry : Sigmundr, the receive times are taken from its clock
+    - LPS : Launchpad Controller, whose frames have no time stamp
+
+Use `python convert_logs.py` to convert the logs of ./data, or give the paths to the
+logs to convert as arguments. The logs already converted are skipped
+
+The legacy logs can be block compressed (.log.zblk, see utils.blockfile). Use
+`--compress=zlib` (or gzip, lzma) to compress the session logs (.slog.zblk)
+
+"""
+
+import glob
+import os
+import sys
+
+from utils.blockfile import CODECS, SUFFIX as COMPRESSED_SUFFIX
+from utils.sensors import LaunchpadControl, Sigmundr
+from utils.sessionlog import SUFFIX, convert_log
+
+
+VEHICLES = {
+    "Telemetry": Sigmundr,
+    "LPS": LaunchpadControl,
+}
+
+
+def convert(path, compression=None):
+    root = path
+    if root.endswith(COMPRESSED_SUFFIX):
+        root = root[:-len(COMPRESSED_SUFFIX)]
+    root, _ = os.path.splitext(root)
+    destination = root + SUFFIX
+    if compression is not None:
+        destination += COMPRESSED_SUFFIX
+    if os.path.exists(destination):
+        print("{} : already converted".format(path))
+        return
+
+    name = root.rsplit("_", 1)[-1]
+    if name not in VEHICLES:
+        print("{} : unknown Gateway '{}', the log is not converted".format(path, name))
+        return
+
+    destination, count = convert_log(path, destination, VEHICLES[name]().frames, name, compression)
+    print("{} : {} frames converted into {}".format(path, count, destination))
+
+
+if __name__ == "__main__":
+
+    compression = None
+    paths = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--compress="):
+            compression = arg.split("=", 1)[1]
+            if compression not in CODECS:
+                print("Unknown compression '{}', use one of {}".format(compression, ", ".join(CODECS)))
+                sys.exit(1)
+        else:
+            paths.append(arg)
+    if not paths:
+        paths = sorted(glob.glob("./data/*.log") + glob.glob("./data/*.log" + COMPRESSED_SUFFIX))
+
+    for path in paths:
+        convert(path, compression)
@@ -4,9 +4,14 @@ from tkinter import E, N, S, W
 
 from gui import (GPSWidget, LiveTimeGraphAcc, LiveTimeGraphAirSpeed,
                  LiveTimeGraphAltitude, LiveTimeGraphGyro, LaunchpadWidget,
-                 RocketStatus, TelemetryWidget)
-from utils import (DummySerialWrapper, Gateway, LaunchpadControl,
-                   SerialWrapper, Sigmundr)
+                 RocketStatus, TelemetryWidget, deliver_on_tk)
+from utils import (DummySerialWrapper, Gateway, LaunchpadControl, LineFramer,
+                   SerialWrapper, Sigmundr, TelemetryBus, start_event_loop)
+from utils.replay import FASTEST
+
+
+# Devices on which the Gateways were found last time
+DEVICE_CACHE = "./data/devices.json"
 
 
 class MainApplication(tk.Frame):
@@ -68,11 +73,16 @@ class MainApplication(tk.Frame):
 
 
 if __name__ == "__main__":
+    rocket_sensors = Sigmundr()
+    # Frames cut by a b'\r\n' in their payload are joined back
+    framer = LineFramer(is_valid=rocket_sensors.frames.is_valid, max_length=rocket_sensors.frames.max_length)
+
     # Get the first argument given
     if len(sys.argv) >= 2:
         if sys.argv[1] == "rfd":
             # Use this with a RFD900 modem
-            serial_telemetry = SerialWrapper(115200, "Telemetry", rfd900=True)
+            serial_telemetry = SerialWrapper(115200, "Telemetry", rfd900=True, framer=framer, event_driven=True,
+                                             device_cache=DEVICE_CACHE)
         elif sys.argv[1] == "dummy":
             # Use this to simulate a telemetry data flow
             serial_telemetry = DummySerialWrapper('Dummy')
@@ -82,24 +92,44 @@ if __name__ == "__main__":
                 filepath = sys.argv[2]
             else:
                 filepath = "./data/2019-12-04T11-15-39_Telemetry.log"
+            # Replay speed, eg. 10 or max
+            replay_rate = 1.
+            if len(sys.argv) >= 4:
+                replay_rate = FASTEST if sys.argv[3] == "max" else float(sys.argv[3])
+            # Only the frame formats are used, the file is indexed without decoding it
             dummy_sensors = Sigmundr()
-            serial_telemetry = SerialWrapper(115200, "Telemetry", filepath=filepath, sensors=dummy_sensors)
+            serial_telemetry = SerialWrapper(115200, "Telemetry", filepath=filepath, sensors=dummy_sensors,
+                                             replay_rate=replay_rate)
 
         else:
-            serial_telemetry = SerialWrapper(115200, "Telemetry", rfd900=True)
+            serial_telemetry = SerialWrapper(115200, "Telemetry", rfd900=True, framer=framer, event_driven=True,
+                                             device_cache=DEVICE_CACHE)
     else:
-        serial_telemetry = SerialWrapper(115200, "Telemetry", rfd900=True)
+        serial_telemetry = SerialWrapper(115200, "Telemetry", rfd900=True, framer=framer, event_driven=True,
+                                         device_cache=DEVICE_CACHE)
 
-    rocket_sensors = Sigmundr()
+    # Both Gateways are read in the same event loop, in a background thread
+    loop = start_event_loop()
+
+    # The widgets are updated from the bus when the sensors change
+    bus = TelemetryBus()
 
-    telemetry = Gateway(serial_telemetry, rocket_sensors, "./data")
+    # The frames are saved in session logs, with their receive time
+    # The dummy link has no file descriptor, it is read in a thread
+    if isinstance(serial_telemetry, DummySerialWrapper):
+        telemetry = Gateway(serial_telemetry, rocket_sensors, "./data", session_log=True, bus=bus)
+    else:
+        telemetry = Gateway(serial_telemetry, rocket_sensors, "./data", loop=loop, session_log=True,
+                            bus=bus)
 
-    serial_lps = SerialWrapper(115200, "LPS", bonjour="LAUNCHPADCONTROLLER")
+    serial_lps = SerialWrapper(115200, "LPS", bonjour="LAUNCHPADCONTROLLER", event_driven=True,
+                               device_cache=DEVICE_CACHE)
     lps_sensors = LaunchpadControl()
-    lps = Gateway(serial_lps, lps_sensors, "./data")
+    lps = Gateway(serial_lps, lps_sensors, "./data", loop=loop, session_log=True, bus=bus)
 
     root = tk.Tk()
     root.title("Sigmundr Dashboard")
+    deliver_on_tk(root, bus)
 
     MainApplication(root, telemetry, lps).pack(
         side="top", fill="both", expand=True)
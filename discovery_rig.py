@@ -0,0 +1,220 @@
+""" Test rig for the search of the Gateways among the serial devices
+
+Emulates serial devices on pseudo terminals (Linux and macOS only) and checks that
+SerialWrapper finds the right one, in RFD900 and BONJOUR modes:
+    - a RFD900 modem, that answers "OK" to "+++" after the guard time
+    - a Launchpad Gateway, that answers "LAUNCHPADCONTROLLER" to "&gB0"
+    - silent devices, that never answer
+    - a noisy device, that keeps sending random bytes
+
+The emulated devices replace the ones listed by pyserial. All the devices are probed
+at the same time, so a search takes about the time needed to probe one device. The
+cancellation of a search is checked too
+
+The device cache is then checked: once found, the Gateways are found again on the
+same device without probing the others, even after being moved to another port
+
+Use `python discovery_rig.py`, the script exits with a non zero code if a check fails
+
+"""
+
+import os
+import pty
+import random
+import select
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+import serial.tools.list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+from utils.serialwrapper import SerialWrapper
+
+
+BONJOUR = "LAUNCHPADCONTROLLER"
+NB_SILENT_DEVICES = 3
+
+
+class EmulatedDevice:
+    """ Serial device emulated on a pseudo terminal
+
+    Parameters
+    ----------
+    answers : dict
+        {command: answer} bytes to send when a command is received
+    delay : float
+        time to wait before answering in seconds
+    noisy : bool
+        True to send random bytes continuously
+
+    Attributes
+    ----------
+    port : str
+        port to open to talk to the device
+    serial_number : str
+        serial number of the emulated USB device
+
+    """
+
+    count = 0
+
+    def __init__(self, answers=None, delay=0., noisy=False):
+        EmulatedDevice.count += 1
+        self.serial_number = "RIG{:05}".format(EmulatedDevice.count)
+        self.answers = answers or {}
+        self.delay = delay
+        self.noisy = noisy
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        # The slave stays open so that the master can be read before the port is opened
+        self.slave = slave
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        received = b''
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if self.noisy:
+                os.write(self.master, bytes(random.getrandbits(8) for _ in range(16)))
+            if not readable:
+                continue
+
+            try:
+                received += os.read(self.master, 1024)
+            except OSError:
+                continue
+
+            for command, answer in self.answers.items():
+                if command in received:
+                    received = b''
+                    time.sleep(self.delay)
+                    os.write(self.master, answer)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def list_devices(devices):
+    """ Return ListPortInfo objects describing the emulated devices, as pyserial does """
+    ports = []
+    for device in devices:
+        info = ListPortInfo(device.port)
+        info.description = "USB Serial (emulated)"
+        # FTDI FT231X, as used by the RFD900 cables
+        info.vid = 0x0403
+        info.pid = 0x6015
+        info.serial_number = device.serial_number
+        ports.append(info)
+
+    return ports
+
+
+def check(name, condition, details=""):
+    print("{} : {} {}".format("PASS" if condition else "FAIL", name, details))
+
+    return condition
+
+
+def search(mode, cancel_after=None, device_cache=""):
+    """ Search for a Gateway, cancel the search after `cancel_after` seconds if given
+
+    Returns
+    -------
+    port : str
+        port of the Gateway found, None if it was not found
+    duration : float
+        duration of the search in seconds
+
+    """
+    if mode == "RFD900":
+        wrapper = SerialWrapper(57600, "Rig RFD900", rfd900=True, device_cache=device_cache)
+    else:
+        wrapper = SerialWrapper(57600, "Rig BONJOUR", bonjour=BONJOUR, device_cache=device_cache)
+
+    if cancel_after is not None:
+        threading.Timer(cancel_after, wrapper.cancel_discovery).start()
+
+    start = time.monotonic()
+    success = wrapper.open_link()
+    duration = time.monotonic() - start
+
+    port = wrapper.ser.port if success else None
+    wrapper.close_serial()
+
+    return port, duration
+
+
+if __name__ == "__main__":
+
+    if not hasattr(os, 'openpty'):
+        print("Error : pseudo terminals are not available on this system")
+        sys.exit(1)
+
+    rfd900 = EmulatedDevice({b'+++': b'OK\r\n'}, delay=0.2)
+    gateway = EmulatedDevice({b'&gB0': BONJOUR.encode('utf-8') + b'\r\n'})
+    others = [EmulatedDevice() for _ in range(NB_SILENT_DEVICES)] + [EmulatedDevice(noisy=True)]
+    devices = others[:2] + [rfd900] + others[2:] + [gateway]
+
+    serial.tools.list_ports.comports = lambda: list_devices(devices)
+
+    results = []
+
+    port, duration = search("RFD900")
+    results.append(check("RFD900 found", port == rfd900.port, "({:.1f} s)".format(duration)))
+    # Probing a device takes at least 1 s of guard time before "+++"
+    results.append(check("RFD900 devices probed in parallel", duration < 2.5))
+
+    port, duration = search("BONJOUR")
+    results.append(check("BONJOUR Gateway found", port == gateway.port, "({:.1f} s)".format(duration)))
+    results.append(check("BONJOUR devices probed in parallel", duration < 1.5))
+
+    # Without the Gateway, the search is stopped by the cancellation
+    serial.tools.list_ports.comports = lambda: list_devices(others)
+    port, duration = search("BONJOUR", cancel_after=0.3)
+    results.append(check("Search cancelled", port is None and duration < 1, "({:.1f} s)".format(duration)))
+
+    device_cache = os.path.join(tempfile.mkdtemp(), "devices.json")
+    serial.tools.list_ports.comports = lambda: list_devices(devices)
+
+    for mode, device in [("RFD900", rfd900), ("BONJOUR", gateway)]:
+        search(mode, device_cache=device_cache)
+        port, duration = search(mode, device_cache=device_cache)
+        results.append(check("{} found from the cache".format(mode), port == device.port and duration < 0.5,
+                             "({:.1f} s)".format(duration)))
+
+    # The Gateway is plugged on another port
+    moved = EmulatedDevice(gateway.answers)
+    moved.serial_number = gateway.serial_number
+    devices.remove(gateway)
+    gateway.stop()
+    devices.append(moved)
+    port, duration = search("BONJOUR", device_cache=device_cache)
+    results.append(check("Moved device found from the cache", port == moved.port and duration < 0.5,
+                         "({:.1f} s)".format(duration)))
+
+    # The cached device does not answer anymore, all the devices are probed
+    moved.answers = {}
+    spare = EmulatedDevice({b'&gB0': BONJOUR.encode('utf-8') + b'\r\n'})
+    devices.append(spare)
+    port, duration = search("BONJOUR", device_cache=device_cache)
+    results.append(check("Cache miss falls back to the search", port == spare.port,
+                         "({:.1f} s)".format(duration)))
+
+    for device in devices:
+        device.stop()
+
+    if all(results):
+        print("All checks passed")
+    else:
+        sys.exit(1)
@@ -4,9 +4,14 @@ import tkinter as tk
 from tkinter import E, N, S, W
 
 import matplotlib.animation as animation
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 
+from utils.bus import latest_values
+from utils.gateway import LINK_END, LINK_FAILED, LINK_FOUND, LINK_SEARCHING
+from utils.replay import FASTEST
+
 
 # ########################### #
 #   General purpose widgets   #
@@ -15,11 +20,119 @@ from matplotlib.figure import Figure
 
 BD=0
 
+DELIVERY_PERIOD = 50  # Time between two deliveries of the telemetry bus in ms
+
+
+def first_index(time, t_min):
+    """ Return the index of the last sample recorded before `t_min`
+
+    `time` must be sorted, as the 'Seconds_since_start' of the sensors are
+
+    """
+    return max(0, int(np.searchsorted(time, t_min)) - 1)
+
+
+def deliver_on_tk(widget, bus, period=DELIVERY_PERIOD):
+    """ Deliver the telemetry published on `bus` to the widgets, in the Tk thread
+
+    The widgets subscribed with subscribe() are called once per period at most, with
+    the latest values, and only if they changed. Called once per bus by the GUI
+
+    """
+    def deliver():
+        bus.deliver()
+        widget.after(period, deliver)
+
+    deliver()
+
+
+def subscribe(gateway, callback, sensor, field=None):
+    """ Call callback(value) in the Tk thread when a sensor of the Gateway changes
+
+    Parameters
+    ----------
+    gateway : Gateway instance
+        Gateway publishing on a bus, see utils.bus and deliver_on_tk()
+    callback : callable
+        called at once with the current value, then with the latest value each time
+        it changes
+    sensor : str
+        name of the sensor, eg. "status"
+    field : str, optional
+        name of the field, `callback` is then called with the value of the field.
+        Otherwise it is called with {field: value} of the sensor
+
+    """
+    names = (sensor,) if field is None else (sensor, field)
+    gateway.bus.subscribe(gateway.topic(*names), callback, deferred=True)
+
+    values = latest_values(getattr(gateway.sensors, sensor))
+    if field is None:
+        callback(values)
+    elif field in values:
+        callback(values[field])
+
+
+class TelemetryEvents:
+    """ Event source of a matplotlib animation, stepped when sensors of the Gateway change
+
+    Replaces the timer of animation.FuncAnimation: the graph is redrawn once after each
+    delivery of the bus that changed one of the sensors, see subscribe(), and not when
+    no data arrives
+
+    Parameters
+    ----------
+    widget : TKinter widget
+        widget of the graph, the redraws are scheduled on its Tk loop
+    gateway : Gateway instance
+        Gateway publishing the sensors on a bus
+    sensors : str
+        names of the sensors drawn by the graph, eg. "imu2"
+
+    """
+
+    def __init__(self, widget, gateway, *sensors):
+        self.widget = widget
+        self.callbacks = []
+        self.running = False
+        self.scheduled = False
+        for sensor in sensors:
+            subscribe(gateway, self._on_change, sensor)
+
+    def add_callback(self, func, *args, **kwargs):
+        self.callbacks.append((func, args, kwargs))
+
+    def remove_callback(self, func, *args, **kwargs):
+        self.callbacks = [c for c in self.callbacks if c != (func, args, kwargs)]
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def _on_change(self, values):
+        # The sensors delivered at once are drawn together
+        if self.running and not self.scheduled:
+            self.scheduled = True
+            self.widget.after_idle(self._step)
+
+    def _step(self):
+        self.scheduled = False
+        if not self.running:
+            return
+        for func, args, kwargs in list(self.callbacks):
+            # Same as a matplotlib timer, a callback returning False is removed
+            if func(*args, **kwargs) == 0:
+                self.remove_callback(func, *args, **kwargs)
+
+
 class GatewayStatus(tk.Frame):
     """ TKinter frame to monitor the status of the Serial link
 
-    Reading from the Serial link is started in a separate thread with Threading and
-    stopped on the destruction of this frame
+    Reading from the Serial link is started in the background and stopped on the
+    destruction of this frame. The search for the device can be cancelled while it
+    runs, the GUI is not blocked
 
     Parameters
     ----------
@@ -81,8 +194,12 @@ class GatewayStatus(tk.Frame):
         """ Update the error displayed
 
         """
-        failed = self.gateway.serial.failed
-        if failed:
+        state = self.gateway.link_state
+        if state == LINK_SEARCHING:
+            self.error_var.set("Status : Searching for the device...")
+        elif state == LINK_END:
+            self.error_var.set("Status : End of file")
+        elif state == LINK_FAILED or self.gateway.serial.failed:
             message = self.gateway.serial.error
             self.error_var.set("Status : {}".format(message))
         else:
@@ -94,7 +211,11 @@ class GatewayStatus(tk.Frame):
         """ Set the behaviour of the button to open or close the Serial link
 
         """
-        if self.gateway.serial.get_status():
+        state = self.gateway.link_state
+        if state == LINK_SEARCHING:
+            self.read_button.config(command=self.gateway.stop_read)
+            self.button_var.set("Cancel")
+        elif state == LINK_FOUND or self.gateway.serial.get_status():
             self.read_button.config(command=self.gateway.stop_read)
             self.button_var.set("Close link")
         else:
@@ -105,6 +226,89 @@ class GatewayStatus(tk.Frame):
         self.parent.after(100, self.__update_button)
 
 
+class ReplayControl(tk.Frame):
+    """ TKinter frame to control the replay of a file, see utils.replay
+
+    The replay can be paused, sped up or slowed down, and moved to another time of the
+    file with the slider
+
+    Parameters
+    ----------
+    parent : TKinter Frame
+        parent frame
+    gateway : Gateway instance
+        Gateway reading a file
+    """
+
+    rates = {"0.25x": 0.25, "0.5x": 0.5, "1x": 1., "2x": 2., "5x": 5., "10x": 10., "100x": 100.,
+             "Max": FASTEST}
+
+    def __init__(self, parent, gateway, *args, **kwargs):
+        tk.Frame.__init__(self, parent, *args, **kwargs)
+        self.parent = parent
+        self.gateway = gateway
+        self.is_seeking = False
+
+        self.pause_var = tk.StringVar()
+        self.pause_var.set("Pause")
+        tk.Button(self, textvariable=self.pause_var, command=self._pause).grid(row=0, column=0)
+
+        self.rate_var = tk.StringVar()
+        self.rate_var.set("1x")
+        tk.OptionMenu(self, self.rate_var, *self.rates.keys(), command=self._set_rate).grid(
+            row=0, column=1)
+
+        self.time_var = tk.StringVar()
+        tk.Label(self, textvariable=self.time_var).grid(row=0, column=2, sticky=W)
+
+        self.position = tk.Scale(self, orient=tk.HORIZONTAL, showvalue=False, length=250,
+                                 resolution=0.1)
+        self.position.grid(row=1, column=0, columnspan=3, sticky=W+E)
+        # The replay is moved once the slider is released
+        self.position.bind("<ButtonPress-1>", self._start_seek)
+        self.position.bind("<ButtonRelease-1>", self._seek)
+
+        self._update_position()
+
+    def _pause(self):
+        replay = self.gateway.serial.replay
+        if replay is None:
+            return
+        if replay.paused:
+            replay.resume()
+            self.pause_var.set("Pause")
+        else:
+            replay.pause()
+            self.pause_var.set("Resume")
+
+    def _set_rate(self, label):
+        replay = self.gateway.serial.replay
+        if replay is not None:
+            replay.set_rate(self.rates[label])
+        else:
+            # Used when the file is opened
+            self.gateway.serial.replay_rate = self.rates[label]
+
+    def _start_seek(self, event):
+        self.is_seeking = True
+
+    def _seek(self, event):
+        self.is_seeking = False
+        replay = self.gateway.serial.replay
+        if replay is not None:
+            replay.seek(self.position.get())
+
+    def _update_position(self):
+        replay = self.gateway.serial.replay
+        if replay is not None and not self.is_seeking:
+            position = min(replay.position, replay.duration)
+            self.position.config(to=replay.duration)
+            self.position.set(position)
+            self.time_var.set("{:.1f} / {:.1f} s".format(position, replay.duration))
+        # Call this function again after 100 ms
+        self.parent.after(100, self._update_position)
+
+
 class BoolFieldIndicator(tk.Frame):
     """ TKinter frame that holds a TKinter square of color and a label
 
@@ -114,8 +318,10 @@ class BoolFieldIndicator(tk.Frame):
     ----------
     parent : TKinter Frame
         parent frame
-    sensor : attribute of a Sensors instance
-        sensor to display status from
+    gateway : Gateway instance
+        Gateway publishing the sensor
+    sensor : str
+        name of the sensor to display status from
     field : str
         dictionary key of the field to check
     text : str
@@ -123,9 +329,10 @@ class BoolFieldIndicator(tk.Frame):
 
     """
 
-    def __init__(self, parent, sensor, field, text, *args, **kwargs):
+    def __init__(self, parent, gateway, sensor, field, text, *args, **kwargs):
         tk.Frame.__init__(self, parent, *args, **kwargs)
         self.parent = parent
+        self.gateway = gateway
         self.sensor = sensor
         self.field = field
         self.text = text
@@ -138,21 +345,19 @@ class BoolFieldIndicator(tk.Frame):
         self.label = tk.Label(self, text=self.text)
         self.label.grid(row=0, column=2, padx=5, sticky=W+E)
 
-        self.__update_button()
+        subscribe(self.gateway, self.__update_button, self.sensor, self.field)
 
-    def __update_button(self):
+    def __update_button(self, value):
         """ Set the style of the button depending on the status of sensor.
 
         """
-        if self.sensor.data[self.field] is None:
+        if value is None:
             self.btn.config(bg='grey')
         else:
-            if self.sensor.data[self.field]:
+            if value:
                 self.btn.config(bg='red')
             else:
                 self.btn.config(bg='green')
-        # Call this function again after 100 ms
-        self.parent.after(100, self.__update_button)
 
 
 class GeneralData(tk.Frame):
@@ -255,6 +460,11 @@ class TelemetryWidget(tk.Frame):
             self.TimeInterval, text="Freeze", command=self._freeze)
         self.button_freeze.grid(row=0, column=3)
 
+        # Recorded flights can be replayed faster than real time
+        if getattr(self.gateway.serial, 'mode', None) == "FILE":
+            self.replay_control = ReplayControl(self, self.gateway)
+            self.replay_control.grid(row=4, column=1, sticky=W, padx=10, pady=(0, 8))
+
     def _set_reference(self):
         self.sensors.set_reference()
 
@@ -292,15 +502,15 @@ class ErrorState(tk.Frame):
         self.title.grid(row=0, column=0, columnspan=2, sticky=W+E)
 
         self.loop = BoolFieldIndicator(
-            self, self.sensors.errmsg, "ERR_LOOP_TIME", "loop time")
+            self, self.gateway, "errmsg", "ERR_LOOP_TIME", "loop time")
         self.sd_write = BoolFieldIndicator(
-            self, self.sensors.errmsg, "ERR_WRITE_SD", "write SD")
+            self, self.gateway, "errmsg", "ERR_WRITE_SD", "write SD")
         self.sd_sync = BoolFieldIndicator(
-            self, self.sensors.errmsg, "ERR_SYNC_SD", "sync SD")
+            self, self.gateway, "errmsg", "ERR_SYNC_SD", "sync SD")
         self.tm_send = BoolFieldIndicator(
-            self, self.sensors.errmsg, "ERR_SEND_TM", "send TM")
+            self, self.gateway, "errmsg", "ERR_SEND_TM", "send TM")
         self.imu_read = BoolFieldIndicator(
-            self, self.sensors.errmsg, "ERR_READ_IMU", "read imu")
+            self, self.gateway, "errmsg", "ERR_READ_IMU", "read imu")
 
         self.loop.grid(
             row=1, column=0, sticky=W+E)
@@ -330,19 +540,16 @@ class BatteryIndicator(tk.Frame):
         # self.battery2 = tk.Label(self, textvar=self.battery2_txt)
         # self.battery2.grid(row=1, column=0, sticky=W)
 
-        self._update_label()
+        subscribe(self.gateway, self._update_label, "batteries")
 
-    def _update_label(self):
-        voltage_battery1 = self.gateway.sensors.batteries.data['Battery1']
+    def _update_label(self, batteries):
+        voltage_battery1 = batteries['Battery1']
         txt1 = "Battery: {:05.2f}V".format(voltage_battery1)
         self.battery1_txt.set(txt1)
-        # voltage_battery2 = self.gateway.sensors.batteries.data['Battery2']
+        # voltage_battery2 = batteries['Battery2']
         # txt2 = "Battery 2 : {:3.2f}V".format(voltage_battery2)
         # self.battery2_txt.set(txt2)
 
-        # Call this function again after 100 ms
-        self.parent.after(100, self._update_label)
-
 
 class TimeIndicator(tk.Frame):
     def __init__(self, parent, gateway, *args, **kwargs):
@@ -358,10 +565,9 @@ class TimeIndicator(tk.Frame):
         # self.timer = tk.Label(self, textvar=self.timer_txt)
         # self.timer.grid(row=1, column=0)
 
-        self._update_time()
+        subscribe(self.gateway, self._update_time, "rtc")
 
-    def _update_time(self):
-        rtc_time = self.gateway.sensors.rtc.data
+    def _update_time(self, rtc_time):
         txt = "{}:{:02d}:{:02d}.{:02d}".format(
             rtc_time['Hour'], rtc_time['Minute'], rtc_time['Second'], int(rtc_time['Microsecond']/1e4))
         self.rtc_txt.set(txt)
@@ -369,8 +575,6 @@ class TimeIndicator(tk.Frame):
         # timer_time = self.gateway.sensors.timer.data['Timer']
         # txt = "{:7.3f}".format(timer_time)
         # self.timer_txt.set(txt)
-        
-        self.parent.after(100, self._update_time)
 
 
 class ParachuteIndicator(tk.Frame):
@@ -399,38 +603,36 @@ class ParachuteIndicator(tk.Frame):
         self.parachute_trig = tk.Label(self, textvar=self.parachute_trig_txt)
         self.parachute_trig.grid(row=4, column=0, sticky=W)
 
-        self._update_parachute()
+        subscribe(self.gateway, self._update_parachute, "status")
     
-    def _update_parachute(self):
-        if self.status.data['STATUS_1'] & 1 << 3:
+    def _update_parachute(self, status):
+        if status['STATUS_1'] & 1 << 3:
             self.parachute_ign_txt.set('Igniting : yes')
             self.parachute_ign.config(bg='green')
         else:
             self.parachute_ign_txt.set('Igniting : no')
             self.parachute_ign.config(bg='grey')
 
-        if self.status.data['STATUS_1'] & 1 << 4:
+        if status['STATUS_1'] & 1 << 4:
             self.parachute_arduino_arm_txt.set('Arduino arming : yes')
             self.parachute_arduino_arm.config(bg='green')
         else:
             self.parachute_arduino_arm_txt.set('Arduino arming : no')
             self.parachute_arduino_arm.config(bg='grey')
 
-        if self.status.data['STATUS_2'] & 1 << 2:
+        if status['STATUS_2'] & 1 << 2:
             self.parachute_arm_txt.set('Arming : yes')
             self.parachute_arm.config(bg='green')
         else:
             self.parachute_arm_txt.set('Arming : no')
             self.parachute_arm.config(bg='grey')
 
-        if self.status.data['STATUS_2'] & 1 << 7:
+        if status['STATUS_2'] & 1 << 7:
             self.parachute_trig_txt.set('Trigger : yes')
             self.parachute_trig.config(bg='green')
         else:
             self.parachute_trig_txt.set('Trigger : no')
             self.parachute_trig.config(bg='grey')
-        
-        self.parent.after(100, self._update_parachute)
 
 
 class FlightStatus(tk.Frame):
@@ -451,24 +653,22 @@ class FlightStatus(tk.Frame):
         self.apogee = tk.Label(self, textvar=self.apogee_txt)
         self.apogee.grid(row=2, column=0, sticky=W)
 
-        self._update_flight()
+        subscribe(self.gateway, self._update_flight, "status")
     
-    def _update_flight(self):
-        if self.status.data['STATUS_1'] & 1 << 1:
+    def _update_flight(self, status):
+        if status['STATUS_1'] & 1 << 1:
             self.liftoff_txt.set('Liftoff : yes')
             self.liftoff.config(bg='green')
         else:
             self.liftoff_txt.set('Liftoff : no')
             self.liftoff.config(bg='grey')
 
-        if self.status.data['STATUS_1'] & 1 << 2:
+        if status['STATUS_1'] & 1 << 2:
             self.apogee_txt.set('Apogee : yes')
             self.apogee.config(bg='green')
         else:
             self.apogee_txt.set('Apogee : no')
             self.apogee.config(bg='grey')
-        
-        self.parent.after(100, self._update_flight)
 
 
 class RocketStatus(tk.Frame):
@@ -536,8 +736,10 @@ class LiveTimeGraphAirSpeed(tk.Frame):
         self.canvas.draw()
         self.canvas.get_tk_widget().grid(row=1, column=1)
 
-        ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, interval=10,
-                                      repeat=False, init_func=self._init_figure)
+        # The graph is redrawn when the bus delivers new data, see TelemetryEvents
+        events = TelemetryEvents(self, self.gateway, "pitot")
+        self.ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, repeat=False,
+                                           init_func=self._init_figure, event_source=events)
 
     def _init_figure(self):
         """ Set the initial values and settings of the figure
@@ -548,8 +750,8 @@ class LiveTimeGraphAirSpeed(tk.Frame):
         self.ax.set_title("Pitot pressure (hPa)", y=1.1)
         self.canvas.draw()
         self.last_update = 0
-        del self.time[:]
-        del self.data[:]
+        self.time = []
+        self.data = []
         self.line.set_data(self.time, self.data)
         return self.line,
 
@@ -579,13 +781,14 @@ class LiveTimeGraphAirSpeed(tk.Frame):
         len_t = len(self.time)
         len_data = len(self.data)
 
+        index = 0
         if len_t == len_data:
             if len_t > 0:
                 max_time = self.time[-1]
                 min_time = self.time[0]
 
                 if max_time - min_time > self.sensors.time_interval:
-                    index = [i for i, e in enumerate(self.time) if max_time - e > self.sensors.time_interval][-1]
+                    index = first_index(self.time, max_time - self.sensors.time_interval)
                 else:
                     index = 0
 
@@ -596,7 +799,7 @@ class LiveTimeGraphAirSpeed(tk.Frame):
                     self.ax.set_xlim(new_tmin, new_tmax + (new_tmax-new_tmin)*0.1)
                     self.canvas.draw()
 
-            self.line.set_data(self.time, self.data)
+            self.line.set_data(self.time[index:].copy(), self.data[index:].copy())
 
         return self.line,
 
@@ -647,8 +850,10 @@ class LiveTimeGraphAcc(tk.Frame):
         self.canvas.draw()
         self.canvas.get_tk_widget().grid(row=1, column=1)
 
-        ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, interval=10,
-                                      repeat=False, init_func=self._init_figure)
+        # The graph is redrawn when the bus delivers new data, see TelemetryEvents
+        events = TelemetryEvents(self, self.gateway, "imu2")
+        self.ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, repeat=False,
+                                           init_func=self._init_figure, event_source=events)
 
     def _init_figure(self):
         """ Set the initial values and settings of the figure
@@ -659,10 +864,10 @@ class LiveTimeGraphAcc(tk.Frame):
         self.ax.set_title("Accelerometer (g)", y=1.1)
         self.canvas.draw()
         self.last_update = 0
-        del self.time[:]
-        del self.x_data[:]
-        del self.y_data[:]
-        del self.z_data[:]
+        self.time = []
+        self.x_data = []
+        self.y_data = []
+        self.z_data = []
         self.x_value.set_data(self.time, self.x_data)
         self.y_value.set_data(self.time, self.y_data)
         self.z_value.set_data(self.time, self.z_data)
@@ -698,13 +903,14 @@ class LiveTimeGraphAcc(tk.Frame):
         len_acc_y = len(self.y_data)
         len_acc_z = len(self.z_data)
 
+        index = 0
         if len_t == len_acc_x and len_t == len_acc_y and len_t == len_acc_z:
             if len_t > 0:
                 max_time = self.time[-1]
                 min_time = self.time[0]
 
                 if max_time - min_time > self.sensors.time_interval:
-                    index = [i for i, e in enumerate(self.time) if max_time - e > self.sensors.time_interval][-1]
+                    index = first_index(self.time, max_time - self.sensors.time_interval)
                     
                 else:
                     index = 0
@@ -716,9 +922,10 @@ class LiveTimeGraphAcc(tk.Frame):
                     self.ax.set_xlim(new_tmin, new_tmax + (new_tmax-new_tmin)*0.1)
                     self.canvas.draw()
 
-            self.x_value.set_data(self.time, self.x_data)
-            self.y_value.set_data(self.time, self.y_data)
-            self.z_value.set_data(self.time, self.z_data)
+            time = self.time[index:].copy()
+            self.x_value.set_data(time, self.x_data[index:].copy())
+            self.y_value.set_data(time, self.y_data[index:].copy())
+            self.z_value.set_data(time, self.z_data[index:].copy())
 
         return self.x_value, self.y_value, self.z_value,
 
@@ -769,8 +976,10 @@ class LiveTimeGraphGyro(tk.Frame):
         self.canvas.draw()
         self.canvas.get_tk_widget().grid(row=1, column=1)
 
-        ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, interval=10,
-                                      repeat=False, init_func=self._init_figure)
+        # The graph is redrawn when the bus delivers new data, see TelemetryEvents
+        events = TelemetryEvents(self, self.gateway, "imu2")
+        self.ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, repeat=False,
+                                           init_func=self._init_figure, event_source=events)
 
     def _init_figure(self):
         """ Set the initial values and settings of the figure
@@ -781,10 +990,10 @@ class LiveTimeGraphGyro(tk.Frame):
         self.ax.set_title("Gyrometer (dps)", y=1.1)
         self.canvas.draw()
         self.last_update = 0
-        del self.time[:]
-        del self.x_data[:]
-        del self.y_data[:]
-        del self.z_data[:]
+        self.time = []
+        self.x_data = []
+        self.y_data = []
+        self.z_data = []
         self.x_value.set_data(self.time, self.x_data)
         self.y_value.set_data(self.time, self.y_data)
         self.z_value.set_data(self.time, self.z_data)
@@ -820,13 +1029,14 @@ class LiveTimeGraphGyro(tk.Frame):
         len_gyro_y = len(self.y_data)
         len_gyro_z = len(self.z_data)
 
+        index = 0
         if len_t == len_gyro_x and len_t == len_gyro_y and len_t == len_gyro_z:
             if len_t > 0:
                 max_time = self.time[-1]
                 min_time = self.time[0]
 
                 if max_time - min_time > self.sensors.time_interval:
-                    index = [i for i, e in enumerate(self.time) if max_time - e > self.sensors.time_interval][-1]
+                    index = first_index(self.time, max_time - self.sensors.time_interval)
                     
                 else:
                     index = 0
@@ -838,9 +1048,10 @@ class LiveTimeGraphGyro(tk.Frame):
                     self.ax.set_xlim(new_tmin, new_tmax + (new_tmax-new_tmin)*0.1)
                     self.canvas.draw()
 
-            self.x_value.set_data(self.time, self.x_data)
-            self.y_value.set_data(self.time, self.y_data)
-            self.z_value.set_data(self.time, self.z_data)
+            time = self.time[index:].copy()
+            self.x_value.set_data(time, self.x_data[index:].copy())
+            self.y_value.set_data(time, self.y_data[index:].copy())
+            self.z_value.set_data(time, self.z_data[index:].copy())
 
         return self.x_value, self.y_value, self.z_value,
 
@@ -885,8 +1096,10 @@ class LiveTimeGraphAltitude(tk.Frame):
         self.canvas.draw()
         self.canvas.get_tk_widget().grid(row=1, column=1)
 
-        ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, interval=10,
-                                      repeat=False, init_func=self._init_figure)
+        # The graph is redrawn when the bus delivers new data, see TelemetryEvents
+        events = TelemetryEvents(self, self.gateway, "bmp2", "bmp3")
+        self.ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, repeat=False,
+                                           init_func=self._init_figure, event_source=events)
 
     def _init_figure(self):
         """ Set the initial values and settings of the figure
@@ -897,9 +1110,9 @@ class LiveTimeGraphAltitude(tk.Frame):
         self.ax.set_title("Static pressure (hPa)", y=1.1)
         self.canvas.draw()
         self.last_update = 0
-        del self.time[:]
-        del self.bmp1_data[:]
-        del self.bmp2_data[:]
+        self.time = []
+        self.bmp1_data = []
+        self.bmp2_data = []
         self.altitude1.set_data(self.time, self.bmp1_data)
         self.altitude2.set_data(self.time, self.bmp2_data)
         return self.altitude1, self.altitude2,
@@ -932,13 +1145,14 @@ class LiveTimeGraphAltitude(tk.Frame):
         len_bmp2 = len(self.x_data)
         len_bmp3 = len(self.y_data)
 
+        index = 0
         if len_t == len_bmp2 and len_t == len_bmp3:
             if len_t > 0:
                 max_time = self.time[-1]
                 min_time = self.time[0]
 
                 if max_time - min_time > self.sensors.time_interval:
-                    index = [i for i, e in enumerate(self.time) if max_time - e > self.sensors.time_interval][-1]
+                    index = first_index(self.time, max_time - self.sensors.time_interval)
                     
                 else:
                     index = 0
@@ -950,8 +1164,9 @@ class LiveTimeGraphAltitude(tk.Frame):
                     self.ax.set_xlim(new_tmin, new_tmax + (new_tmax-new_tmin)*0.1)
                     self.canvas.draw()
 
-            self.altitude1.set_data(self.time, self.x_data)
-            self.altitude2.set_data(self.time, self.y_data)
+            time = self.time[index:].copy()
+            self.altitude1.set_data(time, self.x_data[index:].copy())
+            self.altitude2.set_data(time, self.y_data[index:].copy())
 
         return self.altitude1, self.altitude2,
 
@@ -1008,38 +1223,36 @@ class GPSValues(tk.Frame):
         self.bearing_label = tk.Label(self, textvar=self.bearing_txt)
         self.bearing_label.grid(row=6, column=1, sticky=W, pady=(3, 0))
 
-        self._update_values()
+        subscribe(self.gateway, self._update_values, "gps")
 
-    def _update_values(self):
-        latitude = self.gps.data['Latitude'][-1]
+    def _update_values(self, gps):
+        latitude = gps['Latitude']
         txt_lat = "{:7.5f}".format(latitude)
         self.latitude_txt.set(txt_lat)
 
-        longitude = self.gps.data['Longitude'][-1]
+        longitude = gps['Longitude']
         txt_long = "{:6.5f}".format(longitude)
         self.longitude_txt.set(txt_long)
 
-        altitude = self.gps.data['Altitude'][-1]
+        altitude = gps['Altitude']
         txt_alt = "{:3.1f} MAMSL".format(altitude)
         self.altitude_txt.set(txt_alt)
 
-        heading = self.gps.data['Heading'][-1]
+        heading = gps['Heading']
         txt_head = "{:3.1f}°".format(heading)
         self.heading_txt.set(txt_head)
 
-        speed = self.gps.data['Ground_Speed'][-1]
+        speed = gps['Ground_Speed']
         txt_speed = "{:5.3f} kph".format(speed)
         self.speed_txt.set(txt_speed)
 
-        distance = self.gps.data['Distance'][-1]
+        distance = gps['Distance']
         txt_distance = "{:3.1f} m".format(distance)
         self.distance_txt.set(txt_distance)
 
-        bearing = self.gps.data['Bearing'][-1]
+        bearing = gps['Bearing']
         txt_bearing = "{:3.1f}°".format(bearing)
         self.bearing_txt.set(txt_bearing)
-    
-        self.parent.after(100, self._update_values)
 
 
 class GPSStatus(tk.Frame):
@@ -1087,10 +1300,10 @@ class GPSStatus(tk.Frame):
 
         self.default_bg = self.validity.cget('background')
 
-        self._update_status()
+        subscribe(self.gateway, self._update_status, "gps")
     
-    def _update_status(self):
-        validity = self.gps.data['Fix_Validity'][-1]
+    def _update_status(self, gps):
+        validity = gps['Fix_Validity']
         if validity:
             txt_validity = "DATA VALID"
             self.validity_label.config(bg="green")
@@ -1099,7 +1312,7 @@ class GPSStatus(tk.Frame):
             self.validity_label.config(bg="red")
         self.validity_txt.set(txt_validity)
 
-        quality = self.gps.data['Fix_Quality'][-1]
+        quality = gps['Fix_Quality']
         if quality == 0:
             txt_quality = "Invalid"
             self.quality_label.config(bg="red")
@@ -1111,7 +1324,7 @@ class GPSStatus(tk.Frame):
             self.quality_label.config(bg='green')
         self.quality_txt.set(txt_quality)
 
-        status = self.gps.data['Fix_Status'][-1]
+        status = gps['Fix_Status']
         if status == 1:
             txt_status = "no fix"
             self.status_label.config(bg='red')
@@ -1126,20 +1339,18 @@ class GPSStatus(tk.Frame):
             self.quality_label.config(bg=self.default_bg)
         self.status_txt.set(txt_status)
 
-        pdop = self.gps.data['pDOP'][-1]
+        pdop = gps['pDOP']
         pdop_txt = "{:4.2f}".format(pdop)
         self.pdop_txt.set(pdop_txt)
 
-        hdop = self.gps.data['hDOP'][-1]
+        hdop = gps['hDOP']
         hdop_txt = "{:4.2f}".format(hdop)
         self.hdop_txt.set(hdop_txt)
 
-        vdop = self.gps.data['vDOP'][-1]
+        vdop = gps['vDOP']
         vdop_txt = "{:4.2f}".format(vdop)
         self.vdop_txt.set(vdop_txt)
 
-        self.parent.after(100, self._update_status)
-
 
 class GPSGraph(tk.Frame):
     def __init__(self, parent, gateway, *args, **kwargs):
@@ -1162,8 +1373,10 @@ class GPSGraph(tk.Frame):
         self.canvas.draw()
         self.canvas.get_tk_widget().grid(row=1, column=1)
 
-        ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, interval=10,
-                                      repeat=False, init_func=self._init_figure)
+        # The graph is redrawn when the bus delivers new data, see TelemetryEvents
+        events = TelemetryEvents(self, self.gateway, "gps")
+        self.ani = animation.FuncAnimation(self.fig, self._update_data, blit=True, repeat=False,
+                                           init_func=self._init_figure, event_source=events)
 
     def _init_figure(self):
         """ Set the initial values and settings of the figure
@@ -1178,8 +1391,8 @@ class GPSGraph(tk.Frame):
         self.ax.set_title("Position from launch pad", y=1.1)
         self.ax.grid(True)
         self.canvas.draw()
-        del self.bearing[:]
-        del self.distance[:]
+        self.bearing = []
+        self.distance = []
         self.line.set_data(self.bearing, self.distance)
         return self.line,
 
@@ -1206,22 +1419,16 @@ class GPSGraph(tk.Frame):
         bearing_tmp = self.gps.data['Bearing_rad'][:]
         distance_tmp = self.gps.data['Distance'][:]
 
-        len_b = len(self.bearing)
-        len_d = len(self.distance)
-
-        self.bearing = []
-        self.distance = []
+        len_b = len(bearing_tmp)
+        len_d = len(distance_tmp)
 
         if len_b == len_d:
-            for i, e in enumerate(bearing_tmp):
-                bearing = bearing_tmp[i]
-                distance = distance_tmp[i]
-                if str(bearing) != 'nan' and str(distance) != 'nan' and distance < 10000.:
-                    self.bearing.append(bearing)
-                    self.distance.append(distance)
-
-            if self.distance:
-                if max(self.distance) > 0.8*rmax:
+            valid = ~np.isnan(bearing_tmp) & ~np.isnan(distance_tmp) & (distance_tmp < 10000.)
+            self.bearing = bearing_tmp[valid]
+            self.distance = distance_tmp[valid]
+
+            if len(self.distance):
+                if self.distance.max() > 0.8*rmax:
                     rmax = rmax + self.rmax_init
                     if rmax < 5000:
                         self.ax.set_rlim(rmin, rmax)
@@ -1309,17 +1516,35 @@ class Outputs(tk.Frame):
         self.button_output3.grid(row=2, column=3, columnspan=3, sticky=E)
         self.button_output4.grid(row=3, column=3, columnspan=3, sticky=E)
 
+        self.is_ready = self.gateway.serial.is_ready
+        subscribe(self.gateway, self._update_status, "status")
+        self.parent.after(100, self._watch_link)
+
+    def _update_status(self, status):
+        self.status_values = status
         self._update_buttons()
         self._update_state()
 
+    def _watch_link(self):
+        """ Update the buttons when the link becomes ready or is lost
+
+        """
+        is_ready = self.gateway.serial.is_ready
+        if is_ready != self.is_ready:
+            self.is_ready = is_ready
+            self._update_buttons()
+            self._update_state()
+        # The state of the link is not published on the bus
+        self.parent.after(100, self._watch_link)
+
     def _update_buttons(self):
         """ Set the buttons inactive when the gateway is not ready
 
         """
-        is_output1_en = self.status.data['IS_OUTPUT1_EN']
-        is_output2_en = self.status.data['IS_OUTPUT2_EN']
-        is_output3_en = self.status.data['IS_OUTPUT3_EN']
-        is_output4_en = self.status.data['IS_OUTPUT4_EN']
+        is_output1_en = self.status_values['IS_OUTPUT1_EN']
+        is_output2_en = self.status_values['IS_OUTPUT2_EN']
+        is_output3_en = self.status_values['IS_OUTPUT3_EN']
+        is_output4_en = self.status_values['IS_OUTPUT4_EN']
 
         # Update text and commands for buttons
         if not is_output1_en:
@@ -1348,7 +1573,7 @@ class Outputs(tk.Frame):
             self.button_output4.config(command=lambda: self.gateway.send_command(bytes([0x26, 0x63, 0x64, 0x00])))
         
         # Enable the relevant buttons
-        if self.gateway.serial.is_ready:
+        if self.is_ready:
             self.button_output1.config(state=tk.NORMAL)
             self.button_output2.config(state=tk.NORMAL)
             self.button_output3.config(state=tk.NORMAL)
@@ -1360,34 +1585,29 @@ class Outputs(tk.Frame):
             self.button_output3.config(state=tk.DISABLED)
             self.button_output4.config(state=tk.DISABLED)
 
-        # Call this function again after 100 ms
-        self.parent.after(100, self._update_buttons)
-
     def _update_state(self):
-        if self.gateway.serial.is_ready:
+        if self.is_ready:
 
-            if self.gateway.sensors.status.data['IS_OUTPUT1_EN']:
+            if self.status_values['IS_OUTPUT1_EN']:
                 self.output1.config(bg='yellow green')
             else:
                 self.output1.config(bg=self.default_bg)
 
-            if self.gateway.sensors.status.data['IS_OUTPUT2_EN']:
+            if self.status_values['IS_OUTPUT2_EN']:
                 self.output2.config(bg='yellow green')
             else:
                 self.output2.config(bg=self.default_bg)
 
-            if self.gateway.sensors.status.data['IS_OUTPUT3_EN']:
+            if self.status_values['IS_OUTPUT3_EN']:
                 self.output3.config(bg='yellow green')
             else:
                 self.output3.config(bg=self.default_bg)
 
-            if self.gateway.sensors.status.data['IS_OUTPUT4_EN']:
+            if self.status_values['IS_OUTPUT4_EN']:
                 self.output4.config(bg='yellow green')
             else:
                 self.output4.config(bg=self.default_bg)
 
-        self.parent.after(100, self._update_state)
-
 
 class LaunchpadState(tk.Frame):
     def __init__(self, parent, gateway, *args, **kwargs):
@@ -1435,20 +1655,41 @@ class LaunchpadState(tk.Frame):
 
         self.battery2_value.grid(row=0, column=0)
 
+        self.is_ready = self.gateway.serial.is_ready
+        self.rssi_values = latest_values(self.gateway.sensors.rssi)
+        self.battery_values = latest_values(self.gateway.sensors.battery)
         self._ping_launchpad()
+        subscribe(self.gateway, self._update_rssi, "rssi")
+        subscribe(self.gateway, self._update_battery, "battery")
+        self.parent.after(100, self._watch_link)
+
+    def _update_rssi(self, rssi):
+        self.rssi_values = rssi
+        self._update_state()
+
+    def _update_battery(self, battery):
+        self.battery_values = battery
         self._update_state()
 
+    def _watch_link(self):
+        is_ready = self.gateway.serial.is_ready
+        if is_ready != self.is_ready:
+            self.is_ready = is_ready
+            self._update_state()
+        # The state of the link is not published on the bus
+        self.parent.after(100, self._watch_link)
+
     def _update_state(self):
-        if self.gateway.serial.is_ready:
-            remote_rssi = self.gateway.sensors.rssi.data['REMOTE_RSSI']
+        if self.is_ready:
+            remote_rssi = self.rssi_values['REMOTE_RSSI']
             self.remote_rssi_value_txt.set(str(remote_rssi))
-            local_rssi = self.gateway.sensors.rssi.data['LOCAL_RSSI']
+            local_rssi = self.rssi_values['LOCAL_RSSI']
             self.local_rssi_value_txt.set(str(local_rssi))
 
-            battery1 = self.gateway.sensors.battery.data['BAT1_VOLTAGE']
+            battery1 = self.battery_values['BAT1_VOLTAGE']
             self.battery1_value_txt.set("Battery 1: {:0.2f}V".format(battery1))
 
-            battery2 = self.gateway.sensors.battery.data['BAT2_VOLTAGE']
+            battery2 = self.battery_values['BAT2_VOLTAGE']
             self.battery2_value_txt.set("Battery 2: {:0.2f}V".format(battery2))
 
         else:
@@ -1457,8 +1698,6 @@ class LaunchpadState(tk.Frame):
             self.battery1_value_txt.set("Battery 1:     - V")
             self.battery2_value_txt.set("Battery 2:     - V")
 
-        self.parent.after(100, self._update_state)
-
     def _ping_launchpad(self):
         # Unused command, just to get a reply from the controller
         self.gateway.send_command(bytes([0x26, 0x63, 0xFF, 0xFF]))
@@ -1502,21 +1741,22 @@ class Servos(tk.Frame):
         self.servo3_txt.grid(row=3, column=0, sticky=W+E+S)
         self.servo3_scale.grid(row=3, column=1, sticky=W+E)
 
-        self._read_servo_values()
+        subscribe(self.gateway, self._read_servo_values, "status")
 
-    def _read_servo_values(self):
+    def _read_servo_values(self, status):
+        self.status_values = status
         if not self._do_not_update:
-            self.servo1_angle.set(self.gateway.sensors.status.data['SERVO1_ANGLE'])
-            self.servo2_angle.set(self.gateway.sensors.status.data['SERVO2_ANGLE'])
-            self.servo3_angle.set(self.gateway.sensors.status.data['SERVO3_ANGLE'])
-
-        self.parent.after(200, self._read_servo_values)
+            self.servo1_angle.set(status['SERVO1_ANGLE'])
+            self.servo2_angle.set(status['SERVO2_ANGLE'])
+            self.servo3_angle.set(status['SERVO3_ANGLE'])
 
     def _block_servo_update(self, env=None):
         self._do_not_update = True
     
     def _allow_servo_update(self):
         self._do_not_update = False
+        # The angles may not have changed since the slider was moved
+        self._read_servo_values(self.status_values)
 
     def _update_servo1(self, env=None):
         angle = self.servo1_angle.get()
@@ -9,8 +9,8 @@ This GUI can:
 import tkinter as tk
 from tkinter import E, N, S, W
 
-from gui import LaunchpadWidget
-from utils import Gateway, LaunchpadControl, SerialWrapper
+from gui import LaunchpadWidget, deliver_on_tk
+from utils import Gateway, LaunchpadControl, SerialWrapper, TelemetryBus, start_event_loop
 
 
 class MainApplication(tk.Frame):
@@ -33,14 +33,17 @@ class MainApplication(tk.Frame):
 
 
 if __name__ == "__main__":
-    serial = SerialWrapper(115200, "LC", bonjour="LAUNCHPADCONTROLLER")
+    serial = SerialWrapper(115200, "LC", bonjour="LAUNCHPADCONTROLLER", event_driven=True,
+                           device_cache="./data/devices.json")
 
     sensors = LaunchpadControl()
 
-    lps = Gateway(serial, sensors, "./data")
+    bus = TelemetryBus()
+    lps = Gateway(serial, sensors, "./data", loop=start_event_loop(), session_log=True, bus=bus)
 
     root = tk.Tk()
     root.title("Launchpad Control")
+    deliver_on_tk(root, bus)
 
     MainApplication(root, lps).pack(side="top", fill="both", expand=True)
 
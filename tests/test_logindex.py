@@ -0,0 +1,167 @@
+""" Tests of the index of the logs (see utils.logindex) against the LineFramer
+
+The logs are generated: their frames hold false separators (alone, adjacent or at their
+ends) next to lines of garbage. The index and the framer must find the same frames
+
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from utils.framing import LineFramer
+from utils.logindex import INDEX_SUFFIX, LogIndex
+from utils.sensors import Sigmundr
+
+
+def generated_frame(rng, separators=()):
+    """ Return a frame of Sigmundr of 96 bytes, with false separators at the given positions """
+    frame = bytearray(rng.integers(0, 256, 96, dtype=np.uint8).tobytes().replace(b'\r\n', b'\0\0'))
+    frame[0] = 0x01
+    for position in separators:
+        frame[position:position + 2] = b'\r\n'
+
+    return bytes(frame)
+
+
+def generated_log(rng, count=300):
+    """ Return the lines of a log whose frames are cut by false separators, next to garbage """
+    lines = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            size = rng.integers(0, 20)
+            lines.append(rng.integers(0, 256, size, dtype=np.uint8).tobytes().replace(b'\r\n', b'..'))
+            continue
+        separators = []
+        if rng.random() < 0.3:
+            separators = sorted(rng.choice(np.arange(1, 93), rng.integers(1, 3), replace=False).tolist())
+            if rng.random() < 0.3:
+                # Adjacent false separators leave an empty line between the pieces
+                separators = [separators[0], separators[0] + 2]
+        lines.append(generated_frame(rng, separators))
+
+    return lines
+
+
+def write_log(path, lines):
+    data = b'\r\n'.join(lines) + b'\r\n'
+    with open(path, 'wb') as file:
+        file.write(data)
+
+    return data
+
+
+def indexed_spans(log):
+    return list(zip(log.offsets.tolist(), (log.offsets + log.lengths).tolist()))
+
+
+rng = np.random.default_rng(0)
+CASES = {
+    "adjacent separators": [generated_frame(rng), generated_frame(rng, (20, 22)), generated_frame(rng)],
+    "separator at the end": [generated_frame(rng), generated_frame(rng, (94,)), generated_frame(rng)],
+    "cut frame next to garbage": [generated_frame(rng), b'garbage', generated_frame(rng, (30,)), b'xx',
+                                  generated_frame(rng)],
+}
+for seed in range(60):
+    CASES["seed {}".format(seed)] = generated_log(np.random.default_rng(seed))
+
+
+@pytest.fixture
+def registry():
+    return Sigmundr().frames
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_index_matches_framer(tmp_path, registry, name):
+    path = str(tmp_path / "generated.log")
+    data = write_log(path, CASES[name])
+
+    framer = LineFramer(is_valid=registry.is_valid, max_length=registry.max_length)
+    spans, _ = framer.extract_spans(data)
+    log = LogIndex(path, registry, sidecar=False)
+    try:
+        assert indexed_spans(log) == spans
+        assert [bytes(frame) for frame in log.frames(0, len(log))] == [data[a:b] for a, b in spans]
+    finally:
+        log.close()
+
+
+def test_sidecar_is_loaded(tmp_path, registry, monkeypatch):
+    path = str(tmp_path / "generated.log")
+    write_log(path, CASES["seed 0"])
+    log = LogIndex(path, registry)
+    expected = indexed_spans(log), log.times.tolist()
+    log.close()
+    assert os.path.exists(path + INDEX_SUFFIX)
+
+    def scan(self):
+        raise AssertionError("The log is scanned again")
+    monkeypatch.setattr(LogIndex, "_LogIndex__scan", scan)
+
+    log = LogIndex(path, registry)
+    try:
+        assert (indexed_spans(log), log.times.tolist()) == expected
+    finally:
+        log.close()
+
+
+def test_sidecar_of_appended_log_is_rebuilt(tmp_path, registry):
+    path = str(tmp_path / "generated.log")
+    write_log(path, CASES["seed 1"])
+    LogIndex(path, registry).close()
+
+    data = write_log(path, CASES["seed 1"] + CASES["seed 2"])
+    framer = LineFramer(is_valid=registry.is_valid, max_length=registry.max_length)
+    spans, _ = framer.extract_spans(data)
+
+    log = LogIndex(path, registry)
+    try:
+        assert indexed_spans(log) == spans
+    finally:
+        log.close()
+
+    # The new index is saved
+    log = LogIndex(path, registry)
+    try:
+        assert indexed_spans(log) == spans
+    finally:
+        log.close()
+
+
+def test_sidecar_of_rewritten_log_is_rebuilt(tmp_path, registry):
+    path = str(tmp_path / "generated.log")
+    write_log(path, CASES["seed 3"])
+    LogIndex(path, registry).close()
+    stat = os.stat(path)
+
+    # Same size, other frames and a later modification time
+    lines = CASES["seed 4"][:len(CASES["seed 3"])]
+    data = b'\r\n'.join(lines) + b'\r\n'
+    data = (data + b'\0'*stat.st_size)[:stat.st_size - 2] + b'\r\n'
+    with open(path, 'wb') as file:
+        file.write(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    framer = LineFramer(is_valid=registry.is_valid, max_length=registry.max_length)
+    spans, _ = framer.extract_spans(data)
+    log = LogIndex(path, registry)
+    try:
+        assert indexed_spans(log) == spans
+    finally:
+        log.close()
+
+
+def test_corrupted_sidecar_is_rebuilt(tmp_path, registry):
+    path = str(tmp_path / "generated.log")
+    data = write_log(path, CASES["seed 5"])
+    with open(path + INDEX_SUFFIX, 'wb') as file:
+        file.write(b'not an index')
+
+    framer = LineFramer(is_valid=registry.is_valid, max_length=registry.max_length)
+    spans, _ = framer.extract_spans(data)
+    log = LogIndex(path, registry)
+    try:
+        assert indexed_spans(log) == spans
+    finally:
+        log.close()
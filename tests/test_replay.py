@@ -0,0 +1,166 @@
+""" Tests of the replay scheduler (see utils.replay) on a simulated clock
+
+The frames of the log are received every half second, the clock is advanced by the tests
+so the frames due are known exactly
+
+"""
+
+import numpy as np
+import pytest
+
+from utils.clock import SimulatedClock
+from utils.replay import FASTEST, MAX_RATE, MIN_RATE, ReplayScheduler
+
+
+def scheduler(count=100, rate=1., batch_size=1000):
+    """ Return a replay of `count` frames received every 0.5 s, its clock and its rewinds """
+    clock = SimulatedClock()
+    rewinds = []
+    replay = ReplayScheduler(np.arange(count)*0.5, rate=rate, batch_size=batch_size, clock=clock,
+                             on_rewind=lambda: rewinds.append(replay.index))
+
+    return replay, clock, rewinds
+
+
+def test_frames_follow_the_clock():
+    replay, clock, _ = scheduler()
+    assert replay.due() == (0, 1)
+    assert replay.due() == (1, 1)
+
+    clock.advance(1.)
+    assert replay.due() == (1, 3)
+    clock.advance(0.4)
+    assert replay.due() == (3, 3)
+    clock.advance(0.1)
+    assert replay.due() == (3, 4)
+
+
+def test_backward_seek_rewinds_before_the_frames_are_due():
+    replay, clock, rewinds = scheduler()
+    clock.advance(10.)
+    assert replay.due() == (0, 21)
+
+    replay.seek(2.)
+    assert rewinds == []
+    assert replay.due() == (4, 5)
+    # Called once the index moved back to the frames replayed again
+    assert rewinds == [5]
+
+    clock.advance(1.)
+    assert replay.due() == (5, 7)
+    assert rewinds == [5]
+
+
+def test_forward_seek_does_not_rewind():
+    replay, clock, rewinds = scheduler()
+    clock.advance(1.)
+    assert replay.due() == (0, 3)
+
+    replay.seek(20.)
+    assert replay.due() == (40, 41)
+    assert rewinds == []
+
+
+def test_seek_is_limited_to_the_log():
+    replay, _, rewinds = scheduler()
+    replay.seek(1000.)
+    assert replay.due() == (99, 100)
+    assert replay.finished
+
+    replay.seek(-5.)
+    assert replay.due() == (0, 1)
+    assert rewinds == [1]
+
+
+def test_pause_and_resume():
+    replay, clock, _ = scheduler()
+    clock.advance(1.)
+    assert replay.due() == (0, 3)
+
+    replay.pause()
+    assert replay.throttled
+    clock.advance(10.)
+    assert replay.due() == (3, 3)
+    assert replay.position == 1.
+
+    # The replay continues from where it was paused
+    replay.resume()
+    assert replay.due() == (3, 3)
+    clock.advance(0.5)
+    assert replay.due() == (3, 4)
+    assert replay.position == 1.5
+
+
+def test_seek_while_paused():
+    replay, clock, rewinds = scheduler()
+    clock.advance(5.)
+    assert replay.due() == (0, 11)
+
+    replay.pause()
+    replay.seek(1.)
+    assert replay.due() == (2, 2)
+    assert rewinds == [2]
+
+    replay.resume()
+    clock.advance(0.5)
+    assert replay.due() == (2, 4)
+
+
+@pytest.mark.parametrize('rate, elapsed, stop', [
+    (MIN_RATE, 2., 2),   # 0.5 s of replay
+    (MIN_RATE, 3.9, 2),
+    (MAX_RATE, 0.1, 21),  # 10 s of replay
+    (MAX_RATE, 0.5, 100),
+])
+def test_rate_at_the_bounds(rate, elapsed, stop):
+    replay, clock, _ = scheduler(rate=rate)
+    clock.advance(elapsed)
+    assert replay.due() == (0, stop)
+    assert replay.throttled
+
+
+def test_rate_change_keeps_the_position():
+    replay, clock, _ = scheduler()
+    clock.advance(2.)
+    assert replay.due() == (0, 5)
+
+    replay.set_rate(MAX_RATE)
+    assert replay.position == 2.
+    clock.advance(0.1)
+    assert replay.due() == (5, 25)
+
+    replay.set_rate(MIN_RATE)
+    clock.advance(2.)
+    assert replay.due() == (25, 26)
+
+
+def test_fastest_rate_replays_in_batches():
+    replay, clock, _ = scheduler(count=250, rate=FASTEST, batch_size=100)
+    assert not replay.throttled
+    assert replay.due() == (0, 100)
+    assert replay.due() == (100, 200)
+    assert replay.position == 99.5
+    assert replay.due() == (200, 250)
+
+    assert replay.finished
+    assert replay.throttled
+    assert replay.due() == (250, 250)
+    assert clock.monotonic() == 0.
+
+
+def test_fastest_rate_after_a_backward_seek():
+    replay, _, rewinds = scheduler(count=250, rate=FASTEST, batch_size=100)
+    assert replay.due() == (0, 100)
+
+    replay.seek(10.)
+    assert replay.due() == (20, 120)
+    assert rewinds == [120]
+
+
+@pytest.mark.parametrize('rate', [0., MIN_RATE/2, MAX_RATE*2, -FASTEST])
+def test_rate_out_of_bounds(rate):
+    replay, _, _ = scheduler()
+    with pytest.raises(ValueError):
+        replay.set_rate(rate)
+
+    assert replay.rate == 1.
@@ -1,4 +1,14 @@
+from utils.aioserial import AsyncSerial, start_event_loop
+from utils.blockfile import CompressedFile, CompressedWriter, open_log
+from utils.bus import TelemetryBus
+from utils.clock import SYSTEM_CLOCK, SimulatedClock, SystemClock
 from utils.dummyserialwrapper import DummySerialWrapper
+from utils.framing import CobsFramer, LineFramer
 from utils.gateway import Gateway
+from utils.logindex import LogIndex
+from utils.logwriter import LogWriter
+from utils.pipeline import Stage
+from utils.replay import ReplayScheduler
 from utils.sensors import LaunchpadControl, Sigmundr
 from utils.serialwrapper import SerialWrapper
+from utils.sessionlog import SessionFormat, SessionLog
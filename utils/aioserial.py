@@ -0,0 +1,214 @@
+""" asyncio transport for the serial link
+
+An AsyncSerial registers the file descriptor of the port of a SerialWrapper in an
+asyncio event loop with loop.add_reader(). The received bytes are read and framed by
+the SerialWrapper when the port becomes readable, without any thread: only the bytes
+already received are read, the loop is never blocked. Several Gateways can then read
+in the same event loop, see Gateway. Their sinks (log writer, decoding, see
+utils.pipeline) still run in threads of their own
+
+The SerialWrapper keeps finding and opening the port, and can still be used with its
+blocking API when no event loop is running
+
+The serial link must be a POSIX serial port, or a file (see SerialWrapper). Files are
+replayed by reading the frames every 100 ms, or without waiting when they are replayed
+as fast as possible
+
+"""
+
+import asyncio
+import os
+import threading
+
+
+FILE_PERIOD = 0.1  # Delay between two reads of the frames of a file in seconds
+
+
+def start_event_loop():
+    """ Run a new event loop in a background thread
+
+    Used by the GUIs, whose main thread runs the Tk loop
+
+    Returns
+    -------
+    loop : asyncio event loop
+        running loop. Coroutines are submitted with asyncio.run_coroutine_threadsafe()
+
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    return loop
+
+
+class AsyncSerial:
+    """ Read and write data through a serial connection in an asyncio event loop
+
+    All the methods must be called from the event loop
+
+    Parameters
+    ----------
+    serial : SerialWrapper instance
+        serial link, opened by open()
+
+    Attributes
+    ----------
+    is_open : bool
+        True once open() succeeded, until close() is called or the link fails
+
+    Examples
+    --------
+    >>> link = AsyncSerial(SerialWrapper(115200, "Telemetry", rfd900=True))
+    >>> if await link.open():
+    ...     frames = await link.readframes()
+    ...     await link.write(b'&gB0')
+    ...     link.close()
+
+    """
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.is_open = False
+
+        self.loop = None
+        self.fd = None
+        self.frames = []
+        self.received = None
+        self.writable = None
+        self.closed = False
+
+    async def open(self):
+        """ Open the link, the search for the device runs in the default executor
+
+        Returns
+        -------
+        bool
+            True if the link is opened
+
+        """
+        self.loop = asyncio.get_running_loop()
+        self.received = asyncio.Event()
+        if self.closed:
+            return False
+
+        success = await self.loop.run_in_executor(None, self.serial.open_link)
+
+        if self.closed:
+            # close() was called during the search
+            self.serial.close_serial()
+            return False
+        if not success:
+            return False
+
+        if self.serial.mode != "FILE":
+            self.fd = self.serial.ser.fileno()
+            self.loop.add_reader(self.fd, self.__on_readable)
+        self.is_open = True
+
+        return True
+
+    def close(self):
+        """ Close the link, the pending readframes() return
+
+        The link cannot be opened again once closed
+
+        """
+        self.closed = True
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.loop.remove_writer(self.fd)
+            self.fd = None
+        if self.is_open:
+            self.serial.close_serial()
+            self.is_open = False
+        if self.received is not None:
+            self.received.set()
+        if self.writable is not None and not self.writable.done():
+            self.writable.set_result(None)
+
+    def __on_readable(self):
+        """ Read the received frames, called by the event loop when the port is readable """
+        if self.fd is None:
+            return
+
+        frames = self.serial.readlines(wait=False)
+        if self.serial.failed:
+            self.close()
+            return
+
+        if frames:
+            self.frames.extend(frames)
+            self.received.set()
+
+        # The wake ups are spaced by wakeup_period, the bytes received meanwhile are read at once
+        self.loop.remove_reader(self.fd)
+        self.loop.call_later(self.serial.wakeup_period, self.__resume_reading)
+
+    def __resume_reading(self):
+        if self.fd is not None:
+            self.loop.add_reader(self.fd, self.__on_readable)
+
+    async def readframes(self):
+        """ Wait for the next received frames
+
+        Returns
+        -------
+        frames : [bytes, ]
+            frames received since the last call, in their order of arrival. Empty if the
+            link is closed or failed
+
+        """
+        if self.serial.mode == "FILE":
+            while self.is_open and not self.frames:
+                await self.serial.clock.sleep_async(FILE_PERIOD if self.serial.replay.throttled else 0)
+                self.frames.extend(self.serial.readlines(wait=False))
+                if self.serial.failed:
+                    self.close()
+        else:
+            while self.is_open and not self.frames:
+                self.received.clear()
+                await self.received.wait()
+
+        frames = self.frames
+        self.frames = []
+
+        return frames
+
+    async def write(self, data, encode=False):
+        """ Send data via serial link, waiting for the port to accept it
+
+        Parameters
+        ----------
+        data : str or bytes-like object
+            data to send
+        encode : bool
+            True to encode the string `data` using utf-8
+
+        """
+        if self.serial.failed or self.fd is None:
+            return
+
+        if encode:
+            data = data.encode('utf-8')
+
+        # The port is opened in non blocking mode
+        view = memoryview(data)
+        while view and self.fd is not None:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                pass
+            if view:
+                await self.__writable()
+
+    async def __writable(self):
+        """ Wait for the port to accept data again """
+        self.writable = writable = self.loop.create_future()
+        self.loop.add_writer(self.fd, lambda: writable.done() or writable.set_result(None))
+        try:
+            await writable
+        finally:
+            self.writable = None
+            if self.fd is not None:
+                self.loop.remove_writer(self.fd)
@@ -0,0 +1,275 @@
+""" Block compressed log files
+
+A compressed log is a sequence of blocks, each compressed on its own with zlib, gzip
+or lzma:
+
+    block : magic (4 bytes), codec (uint8), compressed size (uint32),
+            uncompressed size (uint32), compressed data
+
+The content of the log (lines or session log, see utils.logwriter) is the
+concatenation of the uncompressed blocks. A block is written each time the
+LogWriter writes its buffer, so that a block never holds a frame partially. Blocks can
+be appended to an existing file, and a crash loses the last block at most
+
+Any part of the log is read by decompressing the blocks that hold it only: the
+positions of the blocks are found by walking their headers, one per block (about one
+per MB of log), without decompressing them
+
+MappedFile reads the uncompressed logs with the same interface, see open_log()
+
+"""
+
+import bisect
+import gzip
+import lzma
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+
+BLOCK_MAGIC = b'SGZB'
+BLOCK_HEADER = struct.Struct('<4sBII')  # Magic, codec, compressed size, uncompressed size
+SUFFIX = ".zblk"
+BLOCK_SIZE = 2**20  # Uncompressed bytes of a block, written by the offline tools
+
+# {name: (codec id, compress, decompress)}
+CODECS = {
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "gzip": (2, gzip.compress, gzip.decompress),
+    "lzma": (3, lzma.compress, lzma.decompress),
+}
+DECOMPRESS = {codec: decompress for codec, _, decompress in CODECS.values()}
+
+CACHE_SIZE = 8  # Uncompressed blocks kept in memory by a reader
+
+
+def is_compressed(path):
+    """ Return True if the file at `path` is a block compressed log """
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(BLOCK_MAGIC)) == BLOCK_MAGIC
+    except OSError:
+        return False
+
+
+class CompressedWriter:
+    """ File object writing compressed blocks, see utils.logwriter
+
+    The data written is gathered until flush() is called, then compressed into one
+    block
+
+    Parameters
+    ----------
+    file : file object
+        opened for writing in binary mode, closed by close()
+    compression : str
+        "zlib", "gzip" or "lzma"
+
+    """
+
+    def __init__(self, file, compression):
+        if compression not in CODECS:
+            raise ValueError("Unknown compression : {}".format(compression))
+
+        self.file = file
+        self.name = file.name
+        self.codec, self.compress, _ = CODECS[compression]
+        self.pending = bytearray()
+        self.bytes_in = 0   # Uncompressed bytes written
+        self.bytes_out = 0  # Compressed bytes written, headers included
+
+    def write(self, data):
+        self.pending += data
+
+        return len(data)
+
+    def flush(self):
+        """ Compress the data written since the last call into a block """
+        if self.pending:
+            data = self.compress(bytes(self.pending))
+            header = BLOCK_HEADER.pack(BLOCK_MAGIC, self.codec, len(data), len(self.pending))
+            self.file.write(header)
+            self.file.write(data)
+            self.bytes_in += len(self.pending)
+            self.bytes_out += len(header) + len(data)
+            self.pending.clear()
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MappedFile:
+    """ Uncompressed log read through a memory map
+
+    Parameters
+    ----------
+    filepath : path-like object
+
+    Attributes
+    ----------
+    size : int
+        size of the log in bytes
+    dropped : int
+        always 0, see CompressedFile
+
+    """
+
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.dropped = 0
+        # Files of 0 bytes cannot be mapped
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = b''
+        self.view = memoryview(self.map)
+
+    def read(self, offset, size):
+        """ Return `size` bytes from `offset`, as a view of the map """
+        return self.view[offset:offset + size]
+
+    def chunks(self):
+        """ Yield (offset, data) for the whole log, in one chunk: the map itself """
+        yield 0, self.map
+
+    def close(self):
+        """ Release the map, the views returned before must not be used anymore """
+        self.view.release()
+        if isinstance(self.map, mmap.mmap):
+            try:
+                self.map.close()
+            except BufferError:
+                # Views are still referenced, the map is released with them
+                pass
+        self.file.close()
+
+
+class CompressedFile:
+    """ Block compressed log, read with random access
+
+    The blocks read last are kept in memory, a sequential read decompresses each
+    block once
+
+    Parameters
+    ----------
+    filepath : path-like object
+
+    Attributes
+    ----------
+    size : int
+        size of the uncompressed log in bytes
+    offsets : [int, ]
+        position of each block in the uncompressed log, followed by `size`
+    dropped : int
+        bytes of an incomplete block at the end of the file (eg. after a crash)
+
+    """
+
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.positions = []  # Position of the data of each block in the file
+        self.codecs = []
+        self.compressed_sizes = []
+        self.offsets = [0]
+        self.cache = OrderedDict()
+
+        file_size = os.fstat(self.file.fileno()).st_size
+        position = 0
+        while position + BLOCK_HEADER.size <= file_size:
+            self.file.seek(position)
+            magic, codec, compressed_size, size = BLOCK_HEADER.unpack(self.file.read(BLOCK_HEADER.size))
+            if magic != BLOCK_MAGIC or codec not in DECOMPRESS:
+                break
+            position += BLOCK_HEADER.size
+            if position + compressed_size > file_size:
+                position -= BLOCK_HEADER.size
+                break
+            self.positions.append(position)
+            self.codecs.append(codec)
+            self.compressed_sizes.append(compressed_size)
+            self.offsets.append(self.offsets[-1] + size)
+            position += compressed_size
+
+        self.size = self.offsets[-1]
+        self.dropped = file_size - position
+
+    def __len__(self):
+        """ Number of blocks """
+        return len(self.positions)
+
+    def block(self, index):
+        """ Return the uncompressed block `index` """
+        data = self.cache.get(index)
+        if data is not None:
+            self.cache.move_to_end(index)
+            return data
+
+        self.file.seek(self.positions[index])
+        data = DECOMPRESS[self.codecs[index]](self.file.read(self.compressed_sizes[index]))
+        self.cache[index] = data
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+        return data
+
+    def read(self, offset, size):
+        """ Return `size` bytes from `offset`, decompressing the blocks that hold them """
+        offset = max(0, min(offset, self.size))
+        stop = min(offset + size, self.size)
+        # Block holding `offset`, found by bisection
+        index = bisect.bisect_right(self.offsets, offset) - 1
+        if index >= len(self.positions):
+            return memoryview(b'')
+
+        start = offset - self.offsets[index]
+        if stop <= self.offsets[index + 1]:
+            # In one block, as written by LogWriter
+            return memoryview(self.block(index))[start:stop - self.offsets[index]]
+
+        parts = []
+        while offset < stop:
+            data = self.block(index)
+            end = min(stop, self.offsets[index + 1])
+            parts.append(data[offset - self.offsets[index]:end - self.offsets[index]])
+            offset = end
+            index += 1
+
+        return memoryview(b''.join(parts))
+
+    def chunks(self):
+        """ Yield (offset, data) for each uncompressed block (bytes), in order """
+        for index in range(len(self)):
+            yield self.offsets[index], self.block(index)
+
+    def close(self):
+        self.cache.clear()
+        self.file.close()
+
+
+def open_log(filepath):
+    """ Open a log, compressed or not
+
+    Returns
+    -------
+    data : MappedFile or CompressedFile instance
+        see their read() and chunks() methods
+
+    """
+    if is_compressed(filepath):
+        return CompressedFile(filepath)
+
+    return MappedFile(filepath)
@@ -0,0 +1,174 @@
+""" In-process publish/subscribe of the telemetry
+
+A Gateway publishes on a TelemetryBus what it receives, from the thread decoding its
+frames (see utils.pipeline). The topics are named after the Gateway:
+    - <gateway>/frames : (frames, receive time in ns) for each batch of frames decoded
+    - <gateway>/<sensor> : {field: latest value} of a sensor, when a value changed
+    - <gateway>/<sensor>/<field> : latest value of a field, when it changed
+eg. "Telemetry/status/STATUS_1". A subscription to "<prefix>/*" receives all the
+topics starting with the prefix
+
+The subscribers are called in the thread of the publisher, eg. to save, check or send
+the frames elsewhere. They must return quickly. Deferred subscribers are called by
+deliver() instead, from the thread that calls it (eg. the Tk loop, see
+gui.widgets.deliver_on_tk): only the latest value of each topic is kept in between,
+a display then only redraws what changed, once per delivery
+
+"""
+
+import threading
+
+
+def same_value(a, b):
+    """ Return True if two values of a field are equal, NaN included """
+    try:
+        return bool(a is b or a == b or (a != a and b != b))
+    except ValueError:
+        # Arrays have no truth value
+        return False
+
+
+def latest_values(sensor):
+    """ Return {field: latest value} of a sensor, from its `data` """
+    data = sensor.data
+    if hasattr(data, 'columns'):
+        # History of the samples
+        if not len(data):
+            return {}
+        return {field: data[field][-1] for field in data.columns}
+
+    return dict(data)
+
+
+class TelemetryBus:
+    """ Deliver the telemetry published by the Gateways to the subscribers of its topics
+
+    Examples
+    --------
+    >>> bus = TelemetryBus()
+    >>> telemetry = Gateway(serial, sensors, "./data", bus=bus)
+    >>> bus.subscribe("Telemetry/frames", exporter)          # Called in the decoding thread
+    >>> bus.subscribe("Telemetry/status", show, deferred=True)
+    >>> bus.deliver()                                        # Calls show(values) if they changed
+
+    """
+
+    def __init__(self):
+        self.subscribers = {}  # {topic: [callback, ]}
+        self.deferred = {}     # {topic: [callback, ]}
+        self.pending = {}      # {topic: latest value}, for the deferred subscribers
+        self.lock = threading.Lock()
+
+    def subscribe(self, topic, callback, deferred=False):
+        """ Call callback(value) with the values published on `topic`
+
+        Parameters
+        ----------
+        topic : str
+            name of the topic, or "<prefix>/*" for all the topics starting with the
+            prefix
+        callback : callable
+        deferred : bool, optional
+            True to call `callback` from deliver() with the latest value only, False to
+            call it in the thread of the publisher with every value
+
+        """
+        subscribers = self.deferred if deferred else self.subscribers
+        with self.lock:
+            subscribers[topic] = subscribers.get(topic, []) + [callback]
+
+    def unsubscribe(self, topic, callback):
+        with self.lock:
+            for subscribers in (self.subscribers, self.deferred):
+                callbacks = [c for c in subscribers.get(topic, []) if c != callback]
+                if callbacks:
+                    subscribers[topic] = callbacks
+                else:
+                    subscribers.pop(topic, None)
+
+    def __matching(self, subscribers, topic):
+        """ Return the callbacks subscribed to `topic`, wildcards included """
+        callbacks = list(subscribers.get(topic, []))
+        for pattern, pattern_callbacks in subscribers.items():
+            if pattern.endswith("/*") and topic.startswith(pattern[:-1]):
+                callbacks.extend(pattern_callbacks)
+
+        return callbacks
+
+    def has_subscribers(self, topic):
+        """ Return True if a value published on `topic` would be delivered """
+        with self.lock:
+            return bool(self.__matching(self.subscribers, topic) or
+                        self.__matching(self.deferred, topic))
+
+    def publish(self, topic, value):
+        """ Publish a value, the subscribers that are not deferred are called at once """
+        with self.lock:
+            callbacks = self.__matching(self.subscribers, topic)
+            if self.__matching(self.deferred, topic):
+                # Coalesced with the values not delivered yet
+                self.pending[topic] = value
+
+        for callback in callbacks:
+            callback(value)
+
+    def deliver(self):
+        """ Call the deferred subscribers with the latest values published since the last
+        call, returns the number of topics delivered """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            calls = [(callback, value) for topic, value in pending.items()
+                     for callback in self.__matching(self.deferred, topic)]
+
+        for callback, value in calls:
+            callback(value)
+
+        return len(pending)
+
+
+class SensorPublisher:
+    """ Publish the frames decoded by a Gateway, and the values of its sensors that changed
+
+    Parameters
+    ----------
+    bus : TelemetryBus instance
+    name : str
+        name of the Gateway, prefix of the topics
+    frames : FrameRegistry instance
+        frames of the vehicle, see utils.frames
+
+    """
+
+    def __init__(self, bus, name, frames):
+        self.bus = bus
+        self.name = name
+        self.sensors = frames.sensors
+        self.last = {}  # {sensor name: {field: value published last}}
+        # The decoding thread and a reset of the Gateway publish the sensors
+        self.lock = threading.Lock()
+
+    def topic(self, *names):
+        """ Return the topic of a sensor or a field, eg. topic("status", "STATUS_1") """
+        return "/".join((self.name,) + names)
+
+    def publish(self, frames, received):
+        """ Publish a batch of frames once decoded, then the values that changed """
+        self.bus.publish(self.topic("frames"), (frames, received))
+        self.publish_sensors()
+
+    def publish_sensors(self, force=False):
+        """ Publish the values of the sensors that changed, or all of them if `force` """
+        publish = self.bus.publish
+        with self.lock:
+            for sensor_name, sensor in self.sensors.items():
+                values = latest_values(sensor)
+                last = self.last.get(sensor_name, {})
+                changed = [field for field, value in values.items()
+                           if force or field not in last or not same_value(value, last[field])]
+                if not changed:
+                    continue
+                self.last[sensor_name] = values
+                publish(self.topic(sensor_name), values)
+                for field in changed:
+                    publish(self.topic(sensor_name, field), values[field])
@@ -0,0 +1,95 @@
+""" Clocks timing the replays, the simulated Gateways and the received frames
+
+The classes that depend on the time take a clock instead of calling time.sleep(),
+time.monotonic() or datetime.datetime.now() themselves. They use the computer's clock
+by default (SYSTEM_CLOCK)
+
+A SimulatedClock only moves forward when it is told to, or when something sleeps on
+it: sleeping returns at once. A recorded flight is then replayed as fast as the frames
+can be decoded, with the same reads, in the same order, as in real time, eg.
+
+>>> clock = SimulatedClock()
+>>> sensors = Sigmundr()
+>>> serial = SerialWrapper(115200, "Telemetry", filepath=filepath, sensors=sensors, clock=clock)
+>>> serial.open_link()
+>>> while not serial.failed:
+...     sensors.update_sensors_batch(serial.readlines())  # Each read moves the clock by 100 ms
+
+"""
+
+import asyncio
+import datetime
+import threading
+import time
+
+
+class SystemClock:
+    """ The computer's clock """
+
+    def monotonic(self):
+        """ Return the time in seconds, to measure durations, see time.monotonic() """
+        return time.monotonic()
+
+    def monotonic_ns(self):
+        """ Return monotonic() as an integer number of nanoseconds """
+        return time.monotonic_ns()
+
+    def now(self):
+        """ Return the current date and time, see datetime.datetime.now() """
+        return datetime.datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        """ Sleep in an asyncio event loop """
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock:
+    """ Clock that only moves forward when advanced, or when something sleeps on it
+
+    Parameters
+    ----------
+    start : datetime.datetime, optional
+        date and time at which the clock starts, the same for every run by default
+
+    Examples
+    --------
+    >>> clock = SimulatedClock()
+    >>> clock.sleep(0.1)     # Returns at once
+    >>> clock.monotonic()    # 0.1
+    >>> clock.advance(60)
+    >>> clock.now()          # datetime.datetime(2000, 1, 1, 0, 1, 0, 100000)
+
+    """
+
+    def __init__(self, start=datetime.datetime(2000, 1, 1)):
+        self.start = start
+        self.elapsed = 0.
+        self.lock = threading.Lock()
+
+    def monotonic(self):
+        return self.elapsed
+
+    def monotonic_ns(self):
+        return int(round(self.elapsed*10**9))
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.elapsed)
+
+    def advance(self, seconds):
+        """ Move the clock forward by `seconds` """
+        with self.lock:
+            self.elapsed += max(0., seconds)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    async def sleep_async(self, seconds):
+        self.advance(seconds)
+        # The other tasks of the event loop still run in between
+        await asyncio.sleep(0)
+
+
+SYSTEM_CLOCK = SystemClock()
@@ -0,0 +1,472 @@
+""" Compiled decoders for the sensors' frames
+
+The 'fields' specification of each sensor (see GenericSensor) is compiled once into
+precomputed struct.Struct objects. A whole frame is then decoded with one `unpack_from`
+call per byte order instead of one slice, one `int.from_bytes` and five dict lookups
+per field
+
+Many frames of the same length can also be decoded at once with a NumPy structured
+dtype derived from the same specification. The conversion functions are then applied
+once per field on whole arrays
+
+Fields of type 'bitfield' are flags packed in a word shared with other fields. The word
+is unpacked once and split into all its flags in one step
+
+"""
+
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+
+
+# struct format characters for the supported fields
+# Keys are ('type', 'size', 'signed') as written in the fields specification
+FORMATS = {
+    ('int', 1, False): 'B',
+    ('int', 1, True): 'b',
+    ('int', 2, False): 'H',
+    ('int', 2, True): 'h',
+    ('int', 4, False): 'I',
+    ('int', 4, True): 'i',
+    ('int', 8, False): 'Q',
+    ('int', 8, True): 'q',
+    ('float', 4, False): 'f',
+    ('float', 4, True): 'f',
+    ('float', 8, False): 'd',
+    ('float', 8, True): 'd',
+}
+
+BYTE_ORDERS = {'big': '>', 'little': '<'}
+
+# NumPy type codes matching the struct format characters
+DTYPES = {
+    'B': 'u1',
+    'b': 'i1',
+    'H': 'u2',
+    'h': 'i2',
+    'I': 'u4',
+    'i': 'i4',
+    'Q': 'u8',
+    'q': 'i8',
+    'f': 'f4',
+    'd': 'f8',
+}
+
+
+def field_format(spec):
+    """ Return the struct format character and the byte order prefix of a field
+
+    Parameters
+    ----------
+    spec: dict
+        specification of the field (see GenericSensor)
+
+    Returns
+    -------
+    fmt: str
+        struct format character
+    order: str or None
+        struct byte order prefix. None for single byte fields as their byte order
+        does not matter
+
+    """
+    if spec['type'] == 'bitfield':
+        # Flags are read from the unsigned word that contains them
+        key = ('int', spec['size'], False)
+    else:
+        key = (spec['type'], spec['size'], spec['signed'])
+    if key not in FORMATS:
+        raise ValueError("Unsupported field type : {}".format(key))
+
+    if spec['size'] == 1:
+        order = None
+    else:
+        order = BYTE_ORDERS[spec['byte_order']]
+
+    return FORMATS[key], order
+
+
+def field_bits(spec):
+    """ Return the position and the mask of a 'bitfield' field
+
+    Parameters
+    ----------
+    spec: dict
+        specification of the field (see GenericSensor)
+
+    Returns
+    -------
+    shift: int
+        position of the lowest bit of the field in the word
+    mask: int
+        mask of the field once shifted
+
+    """
+    shift = spec['bit']
+    mask = (1 << spec.get('nb_bits', 1)) - 1
+    if shift + spec.get('nb_bits', 1) > 8*spec['size']:
+        raise ValueError("Bitfield outside of its {} byte word : {}".format(spec['size'], spec))
+
+    return shift, mask
+
+
+def bitfield_splitter(bits):
+    """ Return a function that splits a word into flags
+
+    The flags of the values already seen are cached, as status words only take a few
+    distinct values
+
+    Parameters
+    ----------
+    bits: list
+        (shift, mask) of each flag, see field_bits()
+
+    Returns
+    -------
+    split: function
+        split(word) returns a tuple with the value of each flag
+
+    """
+    cache = {}
+
+    def split(word):
+        try:
+            return cache[word]
+        except KeyError:
+            flags = tuple([(word >> shift) & mask for shift, mask in bits])
+            if len(cache) < 4096:
+                cache[word] = flags
+            return flags
+
+    return split
+
+
+class FrameDecoder:
+    """ Decode the fields of several sensors from a frame in one step
+
+    The fields of all the sensors are gathered into as few struct.Struct objects as
+    possible: one per byte order used in the frame. Fields that read the same bytes
+    the same way (eg. flags stored in the same byte) are only unpacked once
+
+    Parameters
+    ----------
+    sensors: list
+        GenericSensor instances to decode. Their position in the frame is given by
+        their 'start_position', 'sample_size' and 'nb_samples' attributes. The fields
+        listed in their 'lazy_fields' attribute are not decoded by decode_batch()
+
+    Attributes
+    ----------
+    size: int
+        minimum length of the frames that can be decoded
+
+    Examples
+    --------
+    >>> decoder = FrameDecoder([Timer(8), Batteries(12)])
+    >>> [timer_samples, batteries_samples] = decoder.decode(frame)
+    >>> [(battery1, battery2)] = batteries_samples
+
+    >>> [timer_columns, batteries_columns] = decoder.decode_batch(frames)
+    >>> battery1 = batteries_columns['Battery1'] # One value per frame and per sample
+
+    """
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+
+        # Every distinct (offset, format, byte order) gets a slot. Each field reads a
+        # source: its slot and, for bitfields, the index of its flag in the slot's word
+        slots = {}
+        bits = {}
+        layout = []
+        for sensor in sensors:
+            sensor_layout = []
+            for i in range(sensor.nb_samples):
+                offset = sensor.start_position + i*sensor.sample_size
+                sample_layout = []
+                for spec in sensor.fields.values():
+                    fmt, order = field_format(spec)
+                    key = (offset + spec['start'], fmt, order)
+                    if key not in slots:
+                        slots[key] = len(slots)
+                    slot = slots[key]
+                    if spec['type'] == 'bitfield':
+                        flags = bits.setdefault(slot, [])
+                        flag = field_bits(spec)
+                        if flag not in flags:
+                            flags.append(flag)
+                        source = (slot, flags.index(flag))
+                    else:
+                        source = (slot, None)
+                    sample_layout.append((source, spec.get('conversion_function')))
+                sensor_layout.append(sample_layout)
+            layout.append(sensor_layout)
+
+        self.structs, positions = self._compile(slots)
+        self.size = max([s.size for s in self.structs], default=0)
+
+        # The flags of each word are appended to the concatenated output of the
+        # structs by the splitters
+        count = len(positions)
+        self._splitters = []
+        flag_positions = {}
+        for slot, flags in bits.items():
+            self._splitters.append((positions[slot], bitfield_splitter(flags)))
+            for j in range(len(flags)):
+                flag_positions[(slot, j)] = count + j
+            count += len(flags)
+
+        def position(source):
+            slot, flag = source
+            return positions[slot] if flag is None else flag_positions[source]
+
+        # Index of each field in the output of the structs and splitters
+        self._layout = [
+            [[(position(source), convert) for source, convert in sample] for sample in sensor]
+            for sensor in layout
+        ]
+
+        # Sources of each field for every sample, used by decode_array()
+        self._slots = slots
+        self._bits = bits
+        self._batch_layout = []
+        for sensor, sensor_layout in zip(sensors, layout):
+            self._batch_layout.append({
+                field: ([sample[j][0] for sample in sensor_layout], spec.get('conversion_function'))
+                for j, (field, spec) in enumerate(sensor.fields.items())
+                if field not in sensor.lazy_fields
+            })
+        self._dtypes = {}
+
+    @classmethod
+    def for_samples(cls, sensor):
+        """ Return a decoder of buffers holding one sample of a sensor
+
+        Used to decode the lazy fields from the samples' bytes kept by the sensor.
+        All the fields are decoded
+
+        Parameters
+        ----------
+        sensor: GenericSensor
+
+        Returns
+        -------
+        decoder: FrameDecoder
+
+        """
+        sample = SimpleNamespace(start_position=0, sample_size=sensor.sample_size, nb_samples=1,
+                                 fields=sensor.fields, lazy_fields=())
+
+        return cls([sample])
+
+    @staticmethod
+    def _compile(slots):
+        """ Pack the slots into struct.Struct objects
+
+        Slots are sorted by offset and appended to the first group with a compatible
+        byte order that they do not overlap
+
+        Parameters
+        ----------
+        slots: dict
+            {(offset, fmt, order): slot_index}
+
+        Returns
+        -------
+        structs: list
+            list of struct.Struct objects
+        positions: dict
+            {slot_index: index of the value in the concatenated output of `structs`}
+
+        """
+        groups = []
+        for key in sorted(slots):
+            offset, fmt, order = key
+            size = struct.calcsize(fmt)
+            for group in groups:
+                same_order = None in (order, group['order']) or order == group['order']
+                if same_order and offset >= group['end']:
+                    break
+            else:
+                group = {'order': None, 'end': 0, 'slots': []}
+                groups.append(group)
+
+            if order is not None:
+                group['order'] = order
+            group['slots'].append((offset, fmt, slots[key]))
+            group['end'] = offset + size
+
+        structs = []
+        positions = {}
+        count = 0
+        for group in groups:
+            format_string = group['order'] or '<'
+            position = 0
+            for offset, fmt, slot in group['slots']:
+                if offset > position:
+                    format_string += '{}x'.format(offset - position)
+                format_string += fmt
+                position = offset + struct.calcsize(fmt)
+                positions[slot] = count
+                count += 1
+            structs.append(struct.Struct(format_string))
+
+        return structs, positions
+
+    def decode(self, frame):
+        """ Extract and convert the values of all the sensors' fields
+
+        Parameters
+        ----------
+        frame: bytes-like object
+            frame containing the sensors' values
+
+        Returns
+        -------
+        samples: list
+            one list per sensor, with one tuple of converted values per sample.
+            Values are ordered as the sensor's fields
+
+        """
+        if len(self.structs) == 1:
+            values = self.structs[0].unpack_from(frame)
+        else:
+            values = ()
+            for s in self.structs:
+                values += s.unpack_from(frame)
+
+        for i, split in self._splitters:
+            values += split(values[i])
+
+        return [
+            [tuple([values[i] if convert is None else convert(values[i]) for i, convert in sample])
+             for sample in sensor]
+            for sensor in self._layout
+        ]
+
+    def dtype(self, length):
+        """ Return the NumPy structured dtype describing frames of `length` bytes
+
+        The dtype has one field per slot and is cached for each frame length
+
+        Parameters
+        ----------
+        length: int
+            length of the frames in bytes
+
+        Returns
+        -------
+        dtype: numpy.dtype
+            structured dtype with an itemsize of `length`
+
+        """
+        if length not in self._dtypes:
+            if length < self.size:
+                raise ValueError("Frames of {} bytes are too short, {} bytes expected".format(
+                    length, self.size))
+            names, formats, offsets = [], [], []
+            for (offset, fmt, order), slot in self._slots.items():
+                names.append('s{}'.format(slot))
+                formats.append((order or '|') + DTYPES[fmt])
+                offsets.append(offset)
+            self._dtypes[length] = np.dtype({
+                'names': names,
+                'formats': formats,
+                'offsets': offsets,
+                'itemsize': length,
+            })
+
+        return self._dtypes[length]
+
+    def decode_batch(self, frames):
+        """ Extract and convert the values of all the sensors' fields from many frames
+
+        All the frames are stacked in one buffer and viewed as an array of the
+        structured dtype returned by dtype(), see decode_array()
+
+        Parameters
+        ----------
+        frames: list
+            bytes-like frames, all of the same length
+
+        Returns
+        -------
+        columns: list
+            one dict per sensor {field: numpy array}, see decode_array()
+
+        """
+        if not frames:
+            return [{field: np.empty(0) for field in layout} for layout in self._batch_layout]
+
+        length = len(frames[0])
+        array = np.frombuffer(b''.join(frames), dtype=self.dtype(length))
+
+        return self.decode_array(array)
+
+    def decode_array(self, array, fields=None):
+        """ Extract and convert the values of the sensors' fields from an array of frames
+
+        Integers are widened to int64 and floats to float64 before conversion so that
+        the values match those of decode()
+
+        The lazy fields of the sensors (see GenericSensor) are not decoded. The bytes of
+        the samples of sensors having lazy fields are returned in a 'Raw' column instead
+
+        Parameters
+        ----------
+        array: numpy array
+            contiguous array of the structured dtype returned by dtype()
+        fields: list
+            (optional) names of the only fields to decode
+
+        Returns
+        -------
+        columns: list
+            one dict per sensor {field: numpy array}. Arrays hold one value per frame
+            and per sample, ordered by frame first and sample second
+
+        """
+        raw = {}
+
+        def source_values(source, convert):
+            slot, flag = source
+            if slot not in raw:
+                values = array['s{}'.format(slot)]
+                if values.dtype.kind == 'f':
+                    raw[slot] = values.astype(np.float64)
+                elif values.dtype.kind == 'u' and values.dtype.itemsize == 8:
+                    raw[slot] = values.astype(np.uint64)
+                else:
+                    raw[slot] = values.astype(np.int64)
+
+                # All the flags of a word are split at once
+                for j, (shift, mask) in enumerate(self._bits.get(slot, [])):
+                    raw[(slot, j)] = (raw[slot] >> shift) & mask
+
+            values = raw[slot] if flag is None else raw[source]
+            return values if convert is None else convert(values)
+
+        columns = []
+        for sensor, layout in zip(self.sensors, self._batch_layout):
+            sensor_columns = {}
+            for field, (sources, convert) in layout.items():
+                if fields is not None and field not in fields:
+                    continue
+                if len(sources) == 1:
+                    column = source_values(sources[0], convert)
+                else:
+                    column = np.stack([source_values(source, convert) for source in sources], axis=1).ravel()
+                sensor_columns[field] = np.asarray(column)
+
+            if sensor.lazy_fields:
+                # One row of sample_size bytes per frame and per sample
+                start = sensor.start_position
+                stop = start + sensor.nb_samples*sensor.sample_size
+                frames = array.view(np.uint8).reshape(len(array), array.dtype.itemsize)
+                samples = np.ascontiguousarray(frames[:, start:stop])
+                sensor_columns['Raw'] = samples.view('V{}'.format(sensor.sample_size)).ravel()
+
+            columns.append(sensor_columns)
+
+        return columns
@@ -0,0 +1,124 @@
+""" On disk cache of the serial devices on which the Gateways were found
+
+The USB identity of a device (vendor id, product id and serial number, as listed by
+serial.tools.list_ports) does not change when it is plugged on another port. The
+SerialWrapper remembers the identity of the last device on which each Gateway was
+found, and tries this device first at the next start, before probing all of them
+
+The cache is a small JSON file:
+    {gateway name: {"vid": int, "pid": int, "serial_number": str, "port": str}}
+
+"""
+
+import json
+import os
+
+
+class DeviceCache:
+    """ Identity of the last device used by each Gateway
+
+    Parameters
+    ----------
+    path : path-like object
+        path to the JSON file. It is created when a device is stored
+
+    Examples
+    --------
+    >>> cache = DeviceCache("./data/devices.json")
+    >>> cache.store("Telemetry", port_info)
+    >>> cache.find("Telemetry", serial.tools.list_ports.comports())
+    ListPortInfo of the device, None if it is not connected
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """ Read the cache file
+
+        Returns
+        -------
+        devices : dict
+            {gateway name: identity}. Empty if the file does not exist or is not valid
+
+        """
+        try:
+            with open(self.path) as file:
+                devices = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print("Device cache : cannot read '{}' ({})".format(self.path, e))
+            return {}
+
+        if not isinstance(devices, dict):
+            return {}
+
+        return devices
+
+    def find(self, name, devices):
+        """ Return the last device used by a Gateway among the connected devices
+
+        The device is matched on its USB identity. The port name is only used for the
+        devices that do not have a serial number
+
+        Parameters
+        ----------
+        name : str
+            name of the Gateway
+        devices : [ListPortInfo, ]
+            connected devices, see serial.tools.list_ports.comports()
+
+        Returns
+        -------
+        device : ListPortInfo
+            None if the device is not known or not connected
+
+        """
+        identity = self.load().get(name)
+        if not isinstance(identity, dict) or identity.get('vid') is None:
+            return None
+
+        for device in devices:
+            if device.vid != identity.get('vid') or device.pid != identity.get('pid'):
+                continue
+            if identity.get('serial_number'):
+                if device.serial_number == identity['serial_number']:
+                    return device
+            elif device.device == identity.get('port'):
+                return device
+
+        return None
+
+    def store(self, name, device):
+        """ Remember the device on which a Gateway has been found
+
+        Devices without USB identity are not stored
+
+        Parameters
+        ----------
+        name : str
+            name of the Gateway
+        device : ListPortInfo
+
+        """
+        if device.vid is None:
+            return
+
+        devices = self.load()
+        devices[name] = {
+            'vid': device.vid,
+            'pid': device.pid,
+            'serial_number': device.serial_number,
+            'port': device.device,
+        }
+
+        # The file is replaced at once, so that it is never left half written
+        tmp_path = "{}.tmp".format(self.path)
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(devices, file, indent=4)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Device cache : cannot write '{}' ({})".format(self.path, e))
@@ -3,25 +3,27 @@ Class to read and write data from and to a serial connection
 
 """
 
-import datetime
 import struct
-import time
 
 import serial
 import serial.tools.list_ports
 
+from utils.clock import SYSTEM_CLOCK
+
 dlat = 0.
 dlong = 0.
 
 
 class DummySerialWrapper:
 
-    def __init__(self, name):
+    def __init__(self, name, clock=SYSTEM_CLOCK):
         self.name = name
         self.ser = serial.Serial()
         self.ser.port = 'COM'
 
-        self.start_time = datetime.datetime.now()
+        # Times the frames, see utils.clock
+        self.clock = clock
+        self.start_time = self.clock.now()
 
         self.failed = False
         self.error = ""
@@ -48,7 +50,7 @@ class DummySerialWrapper:
         # Err_msg
         frame += b'\x04\x02'
         # RTC
-        now = datetime.datetime.now()
+        now = self.clock.now()
         delay = now - self.start_time
         hour = delay.hour
         minute = delay.minute
@@ -91,7 +93,7 @@ class DummySerialWrapper:
 
     def readlines(self, decode=False):
         global dlat, dlong
-        time.sleep(0.1)
+        self.clock.sleep(0.1)
         # Frame number
         frame = b'\x02'
         # Status
@@ -99,7 +101,7 @@ class DummySerialWrapper:
         # Err_msg
         frame += b'\x01'
         # RTC
-        now = datetime.datetime.now()
+        now = self.clock.now()
         delay = now - self.start_time
         hour = delay.seconds/3600
         minute = (delay.seconds%3600)/60
@@ -0,0 +1,227 @@
+""" Registry of the frames sent by each vehicle
+
+The frames of a vehicle are described in SCHEMAS by their frame id (first byte) and
+their length. Each kind of frame lists the sensors it contains, by the name of the
+vehicle's attribute holding the sensor
+
+A FrameRegistry compiles the decoders of a vehicle once, when the vehicle is created,
+so vehicles that are not used cost nothing. Finding the decoder of a frame is then a
+dict lookup on (frame id, length)
+
+"""
+
+import numpy as np
+
+from utils.decoder import FrameDecoder
+
+
+SIGMUNDR_SENSORS = ['errmsg', 'status', 'timer', 'batteries', 'imu2', 'bmp2', 'bmp3', 'mag', 'pitot']
+
+SCHEMAS = {
+    'Sigmundr': {
+        # Sensor used to time stamp the frames. It is decoded first
+        'clock': 'rtc',
+        # {(frame id, length): names of the sensors in the frame}
+        'frames': {
+            (0x01, 96): SIGMUNDR_SENSORS,
+            (0x01, 136): SIGMUNDR_SENSORS,
+            (0x02, 96): SIGMUNDR_SENSORS,
+            (0x02, 136): SIGMUNDR_SENSORS + ['gps'],
+        },
+    },
+    'LaunchpadControl': {
+        # The frames are time stamped with the computer's clock
+        'clock': None,
+        'frames': {
+            # Frame id None matches any first byte, Launchpad Control frames have no id
+            (None, 10): ['status', 'battery', 'rssi'],
+        },
+    },
+}
+
+
+class FrameRegistry:
+    """ Decode the frames of a vehicle according to their schema
+
+    Parameters
+    ----------
+    vehicle: object
+        instance holding the sensors as attributes (eg. Sigmundr)
+    name: str
+        name of the vehicle in SCHEMAS
+
+    Attributes
+    ----------
+    clock: GenericSensor
+        sensor used to time stamp the frames, None if the frames are time stamped by
+        the caller
+    decoders: dict
+        {(frame id, length): FrameDecoder}. Frames with the same sensors share the
+        same decoder
+    max_length: int
+        length of the longest frame
+    sensors: dict
+        {name of the attribute: sensor} of all the sensors in the frames, the clock
+        first
+
+    Examples
+    --------
+    >>> frames = FrameRegistry(sigmundr, 'Sigmundr')
+    >>> frames.lookup(frame) # The FrameDecoder of the frame, None if it is unknown
+    >>> frames.update_sensors(frame)
+    >>> frames.update_sensors_batch(lines)
+
+    """
+
+    def __init__(self, vehicle, name):
+        schema = SCHEMAS[name]
+
+        self.sensors = {}
+        if schema['clock']:
+            self.clock = getattr(vehicle, schema['clock'])
+            self.sensors[schema['clock']] = self.clock
+            clock = [self.clock]
+        else:
+            self.clock = None
+            clock = []
+
+        self.decoders = {}
+        decoders = {}
+        for key, names in schema['frames'].items():
+            names = tuple(names)
+            self.sensors.update((n, getattr(vehicle, n)) for n in names)
+            if names not in decoders:
+                decoders[names] = FrameDecoder(clock + [getattr(vehicle, n) for n in names])
+            self.decoders[key] = decoders[names]
+        self.max_length = max(length for frame_id, length in self.decoders)
+
+    def lookup(self, frame):
+        """ Return the decoder of a frame
+
+        Parameters
+        ----------
+        frame: bytes-like object
+
+        Returns
+        -------
+        decoder: FrameDecoder
+            None if the frame id and length do not match any frame of the vehicle
+
+        """
+        length = len(frame)
+        if not length:
+            return None
+
+        decoder = self.decoders.get((frame[0], length))
+        if decoder is None:
+            decoder = self.decoders.get((None, length))
+
+        return decoder
+
+    def is_valid(self, frame):
+        """ Return True if the frame id and length match a frame of the vehicle
+
+        Used by the framers to find the frames in the received bytes, see utils.framing
+
+        """
+        return self.lookup(frame) is not None
+
+    def update_sensors(self, frame, frame_time=None):
+        """ Decode a frame and update the sensors it contains
+
+        Parameters
+        ----------
+        frame: bytes-like object
+            frame received from the vehicle. Unknown frames are ignored
+        frame_time: int
+            (optional) time stamp of the frame in ticks. Needed if there is no clock
+
+        """
+        decoder = self.lookup(frame)
+        if decoder is None:
+            return
+
+        samples = decoder.decode(frame)
+        sensors = decoder.sensors
+
+        if self.clock is not None:
+            self.clock.update_data(frame, samples=samples[0])
+            frame_time = self.clock.data['Time']
+            sensors = sensors[1:]
+            samples = samples[1:]
+
+        for sensor, sensor_samples in zip(sensors, samples):
+            sensor.update_data(frame, frame_time, sensor_samples)
+
+    def update_sensors_batch(self, frames):
+        """ Decode many frames and update the sensors
+
+        Gives the same result as calling update_sensors() on each frame. Frames are
+        grouped by decoder and length, and each group is decoded in one vectorized
+        pass. The sensors are then updated with the values of all the groups, in the
+        order the frames were received. The vehicle must have a clock
+
+        Parameters
+        ----------
+        frames: list
+            bytes-like frames in the order they were received. Unknown frames are ignored
+
+        """
+        groups = {}
+        for i, frame in enumerate(frames):
+            decoder = self.lookup(frame)
+            if decoder is not None:
+                groups.setdefault((decoder, len(frame)), []).append(i)
+
+        # {sensor: ([frame indexes of each group], [columns of each group])}
+        sensors = {}
+        for (decoder, length), indexes in groups.items():
+            columns = decoder.decode_batch([frames[i] for i in indexes])
+            for sensor, sensor_columns in zip(decoder.sensors, columns):
+                sensor_groups = sensors.setdefault(sensor, ([], []))
+                sensor_groups[0].append(indexes)
+                sensor_groups[1].append(sensor_columns)
+
+        if not sensors:
+            return
+
+        indexes, columns = self._merge(self.clock, *sensors.pop(self.clock))
+        frame_times = np.zeros(len(frames), dtype=np.int64)
+        frame_times[indexes] = self.clock.update_data_batch(columns)
+
+        for sensor, sensor_groups in sensors.items():
+            indexes, columns = self._merge(sensor, *sensor_groups)
+            sensor.update_data_batch(columns, frame_times[indexes])
+
+    @staticmethod
+    def _merge(sensor, indexes, columns):
+        """ Merge the columns decoded from several groups of frames
+
+        Parameters
+        ----------
+        sensor: GenericSensor
+        indexes: list
+            sorted frame indexes of each group
+        columns: list
+            {field: numpy array} of each group, see FrameDecoder.decode_batch()
+
+        Returns
+        -------
+        indexes: numpy array
+            sorted indexes of all the frames
+        columns: dict
+            {field: numpy array} with the values ordered as the frames
+
+        """
+        if len(indexes) == 1:
+            return np.array(indexes[0]), columns[0]
+
+        indexes = np.concatenate(indexes)
+        order = np.argsort(indexes, kind='stable')
+        # Each frame holds nb_samples consecutive rows
+        rows = (order[:, np.newaxis]*sensor.nb_samples + np.arange(sensor.nb_samples)).ravel()
+        columns = {
+            field: np.concatenate([c[field] for c in columns])[rows] for field in columns[0]
+        }
+
+        return indexes[order], columns
@@ -0,0 +1,486 @@
+""" Extraction of the frames from the bytes received from a Gateway
+
+A framer is fed with the received bytes and returns the complete frames. It keeps
+the incomplete frame for the next call, and counts the bytes it had to drop
+
+Two framings are supported:
+    - LineFramer: frames followed by b'\r\n', as sent by the current Gateways. The
+      payload of a binary frame may contain b'\r\n' too. When a validation function
+      is given, the pieces of a frame cut by such a false separator are joined back
+      and the pieces that do not belong to a valid frame are dropped
+    - CobsFramer: frames followed by a CRC-16 and encoded with COBS (Consistent Overhead
+      Byte Stuffing), so that they never contain the 0x00 delimiter. Corrupted frames
+      are detected by the CRC and the framer resynchronizes on the next delimiter
+
+Both scan the received bytes once, with bytes.split(). The frames are handed out as
+bytes, they stay valid once the next bytes are received
+
+"""
+
+import binascii
+
+
+def split_lines(buffer, separator=b'\r\n', start=0, end=None):
+    """ Split a buffer into lines without copying them
+
+    Parameters
+    ----------
+    buffer : bytes or bytearray
+        received data. It must not be modified while the lines are used
+    separator : bytes
+        end of line sequence
+    start, end : int, optional
+        bounds of the data to split in `buffer`. All the buffer by default
+
+    Returns
+    -------
+    lines : [memoryview, ]
+        complete lines, as views of `buffer`
+    rest : int
+        position of the data after the last separator, ie the incomplete line
+
+    """
+    if end is None:
+        end = len(buffer)
+
+    view = memoryview(buffer)
+    lines = []
+    size = len(separator)
+    find = buffer.find
+
+    position = find(separator, start, end)
+    while position >= 0:
+        lines.append(view[start:position])
+        start = position + size
+        position = find(separator, start, end)
+
+    return lines, start
+
+
+def split_bytes(buffer, separator=b'\r\n', start=0, end=None):
+    """ Split a buffer into lines copied as bytes
+
+    Same as split_lines(), but the lines are split by bytes.split(), several times
+    faster than finding each separator from Python. The lines stay valid once `buffer`
+    is modified. A bytes `buffer` is not copied first
+
+    Returns
+    -------
+    lines : [bytes, ]
+        complete lines
+    rest : int
+        position of the data after the last separator, ie the incomplete line
+
+    """
+    if end is None:
+        end = len(buffer)
+
+    if isinstance(buffer, bytes):
+        # The whole buffer is not copied by the slice
+        data = buffer[start:end]
+    else:
+        data = bytes(memoryview(buffer)[start:end])
+    lines = data.split(separator)
+    rest = end - len(lines.pop())
+
+    return lines, rest
+
+
+def crc16(data):
+    """ Return the CRC-16/CCITT-FALSE of `data` (polynomial 0x1021, initial value 0xFFFF) """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def cobs_encode(data):
+    """ Encode bytes with COBS, the result contains no 0x00 byte
+
+    Parameters
+    ----------
+    data : bytes-like object
+
+    Returns
+    -------
+    bytes
+
+    """
+    encoded = bytearray()
+    # Each 0x00 byte ends a block, encoded as its length + 1 followed by its bytes
+    for block in bytes(data).split(b'\x00'):
+        # Runs of 254 bytes without 0x00 are encoded as 0xFF followed by the run
+        while len(block) >= 254:
+            encoded.append(0xFF)
+            encoded += block[:254]
+            block = block[254:]
+        encoded.append(len(block) + 1)
+        encoded += block
+
+    return bytes(encoded)
+
+
+def cobs_decode(data):
+    """ Decode COBS encoded bytes
+
+    Parameters
+    ----------
+    data : bytes-like object
+        encoded bytes, without the 0x00 delimiter
+
+    Returns
+    -------
+    bytes or None
+        decoded bytes, None if `data` is not valid COBS
+
+    """
+    decoded = bytearray()
+    i = 0
+    length = len(data)
+    while i < length:
+        code = data[i]
+        if code == 0 or i + code > length:
+            return None
+        decoded += data[i + 1:i + code]
+        i += code
+        if code < 0xFF and i < length:
+            decoded.append(0)
+
+    return bytes(decoded)
+
+
+class LineFramer:
+    """ Split the received bytes on a separator
+
+    Parameters
+    ----------
+    separator : bytes
+        sequence sent after each frame
+    is_valid : function, optional
+        is_valid(frame) returns True if `frame` is a valid frame. Without it, every
+        line is returned as a frame
+    max_length : int, optional
+        length of the longest valid frame. Used with `is_valid` to bound the search
+        for the pieces of a cut frame
+
+    Attributes
+    ----------
+    frames : int
+        number of frames returned since the creation of the instance
+    dropped : int
+        number of bytes dropped since the creation of the instance, separators included
+
+    Examples
+    --------
+    >>> framer = LineFramer(is_valid=lambda frame: len(frame) == 4, max_length=4)
+    >>> framer.feed(b'ab\r\n\r\ncd\r\nxyz')
+    [b'ab\r\n'] # Cut by its own payload
+    >>> framer.feed(b'w\r\n')
+    [b'xyzw']
+
+    """
+
+    def __init__(self, separator=b'\r\n', is_valid=None, max_length=256):
+        self.separator = separator
+        self.is_valid = is_valid
+        self.max_length = max_length
+        self.frames = 0
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        """ Forget the incomplete frame, the counters are kept """
+        self.buffer = b''
+
+    def feed(self, data):
+        """ Extract the complete frames from the received bytes
+
+        Parameters
+        ----------
+        data : bytes-like object
+            bytes received since the last call
+
+        Returns
+        -------
+        frames : [bytes, ]
+            frames without their separators
+
+        """
+        # The new data is joined once to the incomplete frame received earlier
+        if self.buffer:
+            buffer = self.buffer + data
+        else:
+            buffer = bytes(data)
+
+        frames, rest = self.extract(buffer)
+        self.buffer = buffer[rest:]
+
+        return frames
+
+    def extract(self, buffer, start=0, end=None):
+        """ Extract the complete frames from a buffer
+
+        Unlike feed(), the incomplete frame is left in `buffer`
+
+        Parameters
+        ----------
+        buffer : bytes
+            received bytes
+        start, end : int, optional
+            bounds of the bytes not extracted yet in `buffer`. All the buffer by default
+
+        Returns
+        -------
+        frames : [bytes, ]
+            frames copied from `buffer`, the separators are removed. They stay valid
+            once `buffer` is modified
+        rest : int
+            position of the incomplete frame in `buffer`. The bytes before are
+            either extracted or dropped
+
+        """
+        if self.is_valid is None:
+            lines, rest = split_bytes(buffer, self.separator, start, end)
+            self.frames += len(lines)
+            return lines, rest
+
+        spans, rest, lines = self.__find_spans(buffer, start, end)
+        # The frames that are whole lines are already copied by the split
+        frames = [line if line is not None else buffer[first:last]
+                  for (first, last), line in zip(spans, lines)]
+
+        return frames, rest
+
+    def extract_spans(self, buffer, start=0, end=None):
+        """ Find the complete frames in a buffer
+
+        Same as extract(), but the frames are returned as their positions in `buffer`.
+        Used to index log files, see utils.logindex
+
+        Returns
+        -------
+        spans : [(int, int), ]
+            start and end of each frame in `buffer`, the separators are excluded
+        rest : int
+            position of the incomplete frame in `buffer`
+
+        """
+        spans, rest, _ = self.__find_spans(buffer, start, end)
+
+        return spans, rest
+
+    def __find_spans(self, buffer, start=0, end=None):
+        """ Same as extract_spans(), also returns for each frame its line, or None if
+        the frame is made of several lines """
+        if end is None:
+            end = len(buffer)
+
+        lines, rest = split_bytes(buffer, self.separator, start, end)
+
+        # Positions of the lines in the buffer
+        size = len(self.separator)
+        ends = []
+        position = start - size
+        for line in lines:
+            position += size + len(line)
+            ends.append(position)
+
+        if self.is_valid is None:
+            self.frames += len(lines)
+            return [(last - len(line), last) for line, last in zip(lines, ends)], rest, lines
+
+        view = memoryview(buffer)
+        is_valid = self.is_valid
+        n = len(lines)
+        spans = []
+        frame_lines = []
+
+        i = 0
+        while i < n:
+            if is_valid(lines[i]):
+                spans.append((ends[i] - len(lines[i]), ends[i]))
+                frame_lines.append(lines[i])
+                i += 1
+                continue
+
+            # The line may be the first piece of a frame cut by false separators
+            first = ends[i] - len(lines[i])
+            j = i
+            span = None
+            while j + 1 < n and ends[j + 1] - first <= self.max_length and not is_valid(lines[j + 1]):
+                j += 1
+                if is_valid(view[first:ends[j]]):
+                    span = (first, ends[j])
+                    break
+
+            if span is not None:
+                spans.append(span)
+                frame_lines.append(None)
+                i = j + 1
+            elif j + 1 == n and end - first <= self.max_length + size:
+                # The end of the frame may not be received yet
+                rest = first
+                break
+            else:
+                # Empty lines are not counted, the logs contain some
+                if lines[i]:
+                    self.dropped += len(lines[i]) + size
+                i += 1
+
+        if end - rest > self.max_length + size:
+            # No frame is that long without separator
+            self.dropped += end - rest
+            rest = end
+
+        self.frames += len(spans)
+
+        return spans, rest, frame_lines
+
+    def flush(self):
+        """ Return the frames left once all the bytes have been received
+
+        The bytes after the last separator are considered as a complete line. The
+        bytes that do not make a frame are dropped
+
+        Returns
+        -------
+        frames : [bytes, ]
+
+        """
+        frames = self.feed(self.separator)
+        self.dropped += len(self.buffer)
+        self.reset()
+
+        return frames
+
+    def encode(self, frame):
+        """ Return the bytes to send for `frame` """
+        return bytes(frame) + self.separator
+
+
+class CobsFramer:
+    """ Extract COBS encoded frames followed by a CRC-16 and a 0x00 delimiter
+
+    Parameters
+    ----------
+    is_valid : function, optional
+        is_valid(frame) returns True if `frame` is a valid frame, once decoded.
+        Frames with a valid CRC are all returned otherwise
+    max_length : int, optional
+        length of the longest frame, without the CRC
+
+    Attributes
+    ----------
+    frames : int
+        number of frames returned since the creation of the instance
+    dropped : int
+        number of bytes dropped since the creation of the instance, delimiters included
+
+    Examples
+    --------
+    >>> framer = CobsFramer()
+    >>> data = framer.encode(b'\x01\x00\x02')
+    >>> framer.feed(data)
+    [b'\x01\x00\x02']
+
+    """
+
+    def __init__(self, is_valid=None, max_length=256):
+        self.is_valid = is_valid
+        self.max_length = max_length
+        # Longest encoded frame, with the CRC
+        self.max_encoded_length = max_length + 2 + (max_length + 2)//254 + 1
+        self.frames = 0
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        """ Forget the incomplete frame, the counters are kept """
+        self.buffer = b''
+
+    def feed(self, data):
+        """ Extract the complete frames from the received bytes
+
+        Parameters
+        ----------
+        data : bytes-like object
+            bytes received since the last call
+
+        Returns
+        -------
+        frames : [bytes, ]
+            decoded frames, without their CRC
+
+        """
+        if self.buffer:
+            buffer = self.buffer + data
+        else:
+            buffer = bytes(data)
+
+        frames, rest = self.extract(buffer)
+        self.buffer = buffer[rest:]
+
+        return frames
+
+    def extract(self, buffer, start=0, end=None):
+        """ Extract the complete frames from a buffer
+
+        Unlike feed(), the incomplete frame is left in `buffer`
+
+        Parameters
+        ----------
+        buffer : bytes or bytearray
+            received bytes
+        start, end : int, optional
+            bounds of the bytes not extracted yet in `buffer`. All the buffer by default
+
+        Returns
+        -------
+        frames : [bytes, ]
+            decoded frames, without their CRC
+        rest : int
+            position of the incomplete frame in `buffer`
+
+        """
+        if end is None:
+            end = len(buffer)
+
+        packets, rest = split_lines(buffer, b'\x00', start, end)
+
+        frames = []
+        for packet in packets:
+            if not packet:
+                # Delimiters can be sent back to back to resynchronize the receiver
+                continue
+            frame = cobs_decode(packet)
+            if (frame is None or len(frame) < 2
+                    or crc16(frame[:-2]) != int.from_bytes(frame[-2:], 'big')
+                    or (self.is_valid is not None and not self.is_valid(frame[:-2]))):
+                self.dropped += len(packet) + 1
+            else:
+                frames.append(frame[:-2])
+
+        if end - rest > self.max_encoded_length:
+            self.dropped += end - rest
+            rest = end
+
+        self.frames += len(frames)
+
+        return frames, rest
+
+    def flush(self):
+        """ Drop the incomplete frame once all the bytes have been received
+
+        Returns
+        -------
+        frames : list
+            always empty, as a frame is only complete once its delimiter is received
+
+        """
+        self.dropped += len(self.buffer)
+        self.reset()
+
+        return []
+
+    def encode(self, frame):
+        """ Return the bytes to send for `frame`: COBS encoded frame and CRC, then 0x00 """
+        frame = bytes(frame)
+
+        return cobs_encode(frame + crc16(frame).to_bytes(2, 'big')) + b'\x00'
@@ -3,18 +3,41 @@ Class to read data from a Gateway device and save it on storage
 
 """
 
-import datetime
+import asyncio
 import threading
+import time
 from os import mkdir
 from os.path import isdir, join
 
+from utils.aioserial import AsyncSerial
+from utils.blockfile import SUFFIX as COMPRESSED_SUFFIX
+from utils.bus import SensorPublisher
+from utils.clock import SYSTEM_CLOCK
+from utils.logwriter import FSYNC_PERIODIC, LogWriter
+from utils.pipeline import DROP_NEWEST, DROP_OLDEST, QUEUE_SIZE, Stage
+from utils.sessionlog import SUFFIX, SessionFormat
+
+
+# States of the link to the Gateway device, see Gateway.link_state
+LINK_CLOSED = "closed"
+LINK_SEARCHING = "searching"
+LINK_FOUND = "found"
+LINK_FAILED = "failed"
+LINK_END = "end of file"
+
 
 class Gateway:
     """ Class to read data received from a Gateway device
 
     The Gateway device is connected to the computer via a serial connection
 
-    The data read from the Gateway as bytes is saved in a file
+    The data read from the Gateway as bytes is saved in a file, written in the
+    background by a LogWriter (see utils.logwriter)
+
+    The reading thread (or event loop) only drains the serial port. The frames are
+    handed over to sinks, each with a bounded queue of its own: the log writer, the
+    decoding into `sensors`, and the consumers added with add_sink(), see
+    utils.pipeline. See metrics() for the counters of each stage
 
     Parameters
     ----------
@@ -24,11 +47,47 @@ class Gateway:
         Sensors instance used to process the received data
     path : path-like object
         path to the directory to store received data
+    loop : asyncio event loop, optional
+        running event loop in which the data is read, see utils.aioserial. Several
+        Gateways can share the same loop. Without it, each Gateway reads the data in
+        its own thread
+    clock : SystemClock or SimulatedClock instance, optional
+        clock dating the log files, see utils.clock. The clock of `serial` by default
+    fsync : str, optional
+        policy to sync the log file to the disk, see utils.logwriter
+    session_log : bool, optional
+        True to save the frames in a session log, with their receive time (see
+        utils.sessionlog). The frames are separated by b'\r\n' otherwise
+    compression : str, optional
+        "zlib", "gzip" or "lzma" to compress the log in blocks, in the writing thread
+        (see utils.blockfile). The log is still replayed in FILE mode. Not compressed
+        by default
+    decode_policy : str, optional
+        policy of the decoding into `sensors` when it cannot keep up, see
+        utils.pipeline. The oldest frames are dropped by default, the sensors show the
+        latest data
+    bus : TelemetryBus instance, optional
+        bus on which the decoded frames and the values of the sensors that changed are
+        published, see utils.bus and topic()
 
     Attributes
     ----------
     is_reading : bool
         True if the instance is currently reading data from serial link
+    link : AsyncSerial instance
+        asyncio transport of the serial link while the data is read in the event loop,
+        None otherwise
+    link_state : str
+        LINK_SEARCHING while the link is being opened (eg. the device is searched for),
+        then LINK_FOUND while the data is read. LINK_FAILED if the link could not be
+        opened or failed, LINK_END once a file is replayed to its end, LINK_CLOSED once
+        stop_read() is called
+    writer : LogWriter instance
+        writes the log file while the data is read, None before start_read(). See
+        writer.metrics() for the queue depth and the write rate
+    sinks : dict
+        {name: LogWriter or Stage instance} consumers of the frames while the data is
+        read: "Log", "Sensors" and the sinks added with add_sink()
 
     Examples
     --------
@@ -40,16 +99,50 @@ class Gateway:
     ...
     >>> telemetry.stop_read() # This terminates the thread in start_read()
 
+    >>> loop = start_event_loop()
+    >>> telemetry = Gateway(serial=serial, sensors=sensors, path="./data", loop=loop)
+    >>> telemetry.start_read() # The data is read in the event loop, without a new thread
+    >>> telemetry.metrics()    # Frames processed and dropped, time spent by each stage
+
     """
 
-    def __init__(self, serial, sensors, path):
+    def __init__(self, serial, sensors, path, loop=None, clock=None, fsync=FSYNC_PERIODIC,
+                 session_log=False, compression=None, decode_policy=DROP_OLDEST, bus=None):
         self.serial = serial
         self.sensors = sensors
         self.path = path
+        self.loop = loop
+        if clock is None:
+            clock = getattr(serial, 'clock', SYSTEM_CLOCK)
+        self.clock = clock
+        self.fsync = fsync
+        self.session_log = session_log
+        self.compression = compression
+        self.link = None
+        self.writer = None
+        # {name: (consumer, queue size, policy)}, the stages are created by start_read()
+        self.sink_specs = {"Sensors": (self.__decode, QUEUE_SIZE, decode_policy)}
+        # {name: LogWriter or Stage instance} while the data is read
+        self.sinks = {}
+
+        # Counters of the reading, see metrics()
+        self.reads = 0
+        self.frames_read = 0
+        self.dispatch_time = 0.
         # This is the same as the serial for consistency
         self.name = self.serial.name
+        self.bus = bus
+        self.publisher = SensorPublisher(bus, self.name, sensors.frames) if bus is not None else None
 
         self.is_reading = False
+        self.link_state = LINK_CLOSED
+        # Incremented by start_read() and stop_read(): a reading started before only
+        # changes the state while its generation is the current one
+        self.generation = 0
+
+        # The sensors are cleared when a replayed file is moved backwards
+        if hasattr(serial, 'on_rewind'):
+            serial.on_rewind = self.__rewind
 
         # Create the folder to store the files if it does not already exist
         if not isdir(self.path):
@@ -58,25 +151,122 @@ class Gateway:
         self.reset()
     
     def reset(self):
-        self.date_created = datetime.datetime.now().replace(microsecond=0).isoformat()
+        self.date_created = self.clock.now().replace(microsecond=0).isoformat()
 
-        self.log_file = "{}_{}.log".format(
+        self.log_file = "{}_{}{}".format(
             self.date_created.replace(":", "-"),
-            self.name)
+            self.name,
+            SUFFIX if self.session_log else ".log")
+        if self.compression is not None:
+            self.log_file += COMPRESSED_SUFFIX
         self.log_path = join(self.path, self.log_file)
+        # The frames received from now on are saved in the new file
+        writer = self.writer
+        if writer is not None:
+            writer.set_path(self.log_path)
+        # The sensors may have been reset too
+        if self.publisher is not None:
+            self.publisher.publish_sensors(force=True)
 
+    def topic(self, *names):
+        """ Return the topic of the bus on which a sensor or a field of this Gateway is
+        published, eg. topic("status", "STATUS_1") is "Telemetry/status/STATUS_1" """
+        return "/".join((self.name,) + names)
 
-    def __write_frame(self, frame):
-        """ Append a line in the file located at `self.log_path`
+    def add_sink(self, name, consumer, queue_size=QUEUE_SIZE, policy=DROP_NEWEST):
+        """ Give the received frames to another consumer, from the next start_read()
 
         Parameters
         ----------
-        frame: bytearray()
-            frame to write in the file
+        name : str
+            name of the sink, see metrics()
+        consumer : callable
+            called as consumer(frames, received) in a thread of its own, with the
+            frames received at once (bytes) and their receive time in ns
+        queue_size : int, optional
+            maximum number of batches of frames waiting for the consumer
+        policy : str, optional
+            DROP_NEWEST, DROP_OLDEST or BLOCK, see utils.pipeline
 
         """
-        with open(self.log_path, 'ab+') as file:
-            file.write(frame + b'\r\n')
+        self.sink_specs[name] = (consumer, queue_size, policy)
+
+    def metrics(self):
+        """ Return the counters of the reading and of each sink, as a dict by stage """
+        metrics = {
+            'Reader': {
+                'reads': self.reads,
+                'frames_read': self.frames_read,
+                'dispatch_time': self.dispatch_time,
+            },
+        }
+        for name, sink in list(self.sinks.items()):
+            metrics[name] = sink.metrics()
+
+        return metrics
+
+    def __decode(self, frames, received):
+        """ Decode the frames received at once in one pass, in the thread of its stage """
+        self.sensors.update_sensors_batch(frames)
+        if self.publisher is not None:
+            self.publisher.publish(frames, received)
+
+    def __rewind(self):
+        """ Clear the sensors before the frames of a replay moved backwards are decoded
+
+        Called by the reading thread (or event loop) between two reads: the frames read
+        before are decoded first, the time stamps of the sensors then stay sorted
+
+        """
+        sink = self.sinks.get("Sensors")
+        if sink is not None:
+            sink.flush()
+        self.sensors.reset()
+        if self.publisher is not None:
+            self.publisher.publish_sensors(force=True)
+
+    def __process_frames(self, lines, sinks):
+        """ Hand the frames received at once over to the sinks, returns at once
+
+        Parameters
+        ----------
+        lines: [bytes-like object, ]
+        sinks: [LogWriter or Stage instance, ]
+
+        """
+        self.reads += 1
+        if not lines:
+            return
+
+        start = time.monotonic()
+        received = self.clock.monotonic_ns()
+        # The frames of the serial link are bytes already, bytes() does not copy them.
+        # The frames of a file are views of the log, copied to outlive its closing
+        frames = [bytes(line) for line in lines]
+        for sink in sinks:
+            sink.write(frames, received)
+        self.frames_read += len(frames)
+        self.dispatch_time += time.monotonic() - start
+
+    def __start_sinks(self):
+        """ Create the log writer and the stages of the sinks """
+        log_format = SessionFormat(self.name, clock=self.clock) if self.session_log else None
+        writer = LogWriter(self.log_path, fsync=self.fsync, log_format=log_format,
+                           compression=self.compression)
+        self.writer = writer
+
+        sinks = {"Log": writer}
+        for name, (consumer, queue_size, policy) in self.sink_specs.items():
+            sinks[name] = Stage("{} {}".format(self.name, name), consumer, queue_size, policy)
+        self.sinks = sinks
+
+        return list(sinks.values())
+
+    @staticmethod
+    def __close_sinks(sinks):
+        """ Process the frames left in the sinks, then stop them """
+        for sink in sinks:
+            sink.close()
 
     def send_command(self, command, *args, **kwargs):
         """ Send a command via serial link
@@ -87,31 +277,98 @@ class Gateway:
             data to send as a string
 
         """
-        if self.serial.get_status():
+        link = self.link
+        if link is not None:
+            asyncio.run_coroutine_threadsafe(link.write(command, *args, **kwargs), self.loop)
+        elif self.serial.get_status():
             self.serial.write(command, *args, **kwargs)
 
+    async def __read_async(self, link, sinks, generation):
+        """ Read and save data from Gateway device in the event loop
+
+        Does not stop until stop_read() is called or the link fails
+
+        Parameters
+        ----------
+        link : AsyncSerial instance
+            transport of the serial link, not opened yet
+        sinks : [LogWriter or Stage instance, ]
+            closed once the reading stops
+        generation : int
+            `generation` when the reading was started
+
+        """
+        if await link.open():
+            self.__set_link_state(LINK_FOUND, generation)
+            while self.__is_current(generation) and link.is_open:
+                self.__process_frames(await link.readframes(), sinks)
+
+        link.close()
+        # The remaining frames are processed without blocking the loop
+        await self.loop.run_in_executor(None, self.__close_sinks, sinks)
+        if self.link is link:
+            self.link = None
+        self.__stop_reading(generation)
+
+    def __is_current(self, generation):
+        """ Return True until stop_read() is called, or the reading is started again """
+        return self.is_reading and generation == self.generation
+
+    def __set_link_state(self, state, generation):
+        """ Publish the state of the link, unless stop_read() has been called meanwhile """
+        if self.__is_current(generation):
+            self.link_state = state
+
+    def __stop_reading(self, generation):
+        """ Update the state once the reading has stopped
+
+        A reading stopped by stop_read() leaves the state to the next start_read()
+
+        """
+        if not self.__is_current(generation):
+            return
+
+        replay = getattr(self.serial, 'replay', None)
+        if replay is not None and replay.finished:
+            # The whole file has been replayed, the link did not fail
+            self.link_state = LINK_END
+        else:
+            # The link could not be opened or failed
+            self.link_state = LINK_FAILED
+        self.is_reading = False
+
     def start_read(self):
         """ Start reading and saving data from Gateway device
 
+        Returns immediately: the link is opened in the background, which can take a few
+        seconds when the device is searched for. See `link_state` to follow its progress
+
         Does not stop until stop_read() is called
 
         """
-        def read_tread():
-            while self.is_reading:
-                if self.serial.failed:
-                    self.is_reading = False
-                else:
-                    lines = self.serial.readlines()
-                    for line in lines:
-                        self.__write_frame(line)
-                        try:
-                            self.sensors.update_sensors(line)
-                        except:
-                            pass
-
-        self.serial.open_link()
-
+        self.generation += 1
+        generation = self.generation
         self.is_reading = True
+        self.link_state = LINK_SEARCHING
+        sinks = self.__start_sinks()
+
+        if self.loop is not None:
+            # The link is created here so that stop_read() can close it at any time
+            self.link = AsyncSerial(self.serial)
+            asyncio.run_coroutine_threadsafe(
+                self.__read_async(self.link, sinks, generation), self.loop)
+            return
+
+        def read_tread():
+            if self.serial.open_link():
+                self.__set_link_state(LINK_FOUND, generation)
+                while self.__is_current(generation) and not self.serial.failed:
+                    self.__process_frames(self.serial.readlines(), sinks)
+            if not self.is_reading:
+                # stop_read() may have been called while the link was being opened
+                self.serial.close_serial()
+            self.__close_sinks(sinks)
+            self.__stop_reading(generation)
 
         t = threading.Thread(target=read_tread)
         t.start()
@@ -119,8 +376,20 @@ class Gateway:
     def stop_read(self):
         """" Call this method to terminate serial reading
 
-        Call start_read() to start the reading again
+        The search for the device is cancelled if it is not found yet. Call start_read()
+        to start the reading again
 
         """
+        self.generation += 1
         self.is_reading = False
-        self.serial.close_serial()
+        self.link_state = LINK_CLOSED
+
+        # DummySerialWrapper opens the link at once
+        if hasattr(self.serial, 'cancel_discovery'):
+            self.serial.cancel_discovery()
+
+        link = self.link
+        if link is not None:
+            self.loop.call_soon_threadsafe(link.close)
+        else:
+            self.serial.close_serial()
@@ -0,0 +1,233 @@
+""" Fixed-capacity columnar storage for the sensors' history
+
+Each column is a preallocated NumPy array twice as long as the capacity. Rows are
+appended at the end of the arrays and the live rows are always contiguous, so that
+reading a column or a time window of it is an O(1) view. When the end of the arrays
+is reached the live rows are moved back to the beginning, which costs O(1) per
+appended row on average
+
+Rows older than the capacity are evicted and can be spilled to disk
+
+Columns can be lazy: their values are not given when the rows are appended but
+computed by a loader function, for all the rows appended since the last read, the
+first time the column is read
+
+Rows can be appended by one thread (eg. the decoding of a Gateway) while another one
+reads the columns (eg. the Tk loop): appending and computing the lazy columns are
+done under a lock. The views returned before are not updated when the live rows are
+moved, they must be read again. The lock is held to read or modify several columns
+consistently
+
+"""
+
+import threading
+
+import numpy as np
+
+
+# Number of rows kept in memory by default (about 10 minutes of Sigmundr frames)
+DEFAULT_CAPACITY = 2**15
+
+
+class History:
+    """ Columnar store with one preallocated typed array per column
+
+    Parameters
+    ----------
+    columns : dict
+        {name: dtype} in the order of the values given to append()
+    capacity : int or None
+        maximum number of rows kept in memory, the oldest rows are evicted first.
+        None to keep all the rows, the arrays then grow as needed
+    spill_path : str, optional
+        evicted rows are appended to one binary file per column, named
+        "<spill_path>.<column>.bin". Columns of dtype object are not spilled
+    loaders : dict, optional
+        {name: function} of the lazy columns. function(rows) returns the values of
+        the column for the live rows selected by the slice `rows`
+
+    Attributes
+    ----------
+    total : int
+        number of rows appended since the creation of the instance
+    lock : threading.RLock instance
+        held while rows are appended, see the examples
+
+    Examples
+    --------
+    >>> history = History({'Time': 'float64', 'Pressure': 'float32'}, capacity=1000)
+    >>> history.append((0.1, 101325.))
+    >>> history.extend({'Time': times, 'Pressure': pressures})
+    >>> history['Pressure'][-10:]  # View of the last 10 values, nothing is copied
+    >>> with history.lock:         # No row is appended by another thread meanwhile
+    ...     history['Pressure'][:] = history['Pressure'] - offset
+
+    """
+
+    def __init__(self, columns, capacity=DEFAULT_CAPACITY, spill_path=None, loaders=None):
+        self.columns = list(columns.keys())
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.loaders = loaders or {}
+
+        length = 2*capacity if capacity else 1024
+        self._buffers = {name: np.zeros(length, dtype=dtype) for name, dtype in columns.items()}
+        self._buffer_list = [self._buffers[name] for name in self.columns]
+        self._start = 0
+        self._end = 0
+        self.total = 0
+        # Number of rows of each lazy column computed since the creation of the instance
+        self._loaded = {name: 0 for name in self.loaders}
+        # Reentrant, the loaders read the other columns
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, column):
+        with self.lock:
+            if column in self._loaded and self._loaded[column] < self.total:
+                self._load(column)
+            return self._buffers[column][self._start:self._end]
+
+    def __contains__(self, column):
+        return column in self._buffers
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def keys(self):
+        return list(self.columns)
+
+    def items(self):
+        return [(column, self[column]) for column in self.columns]
+
+    def _load(self, column):
+        """ Compute the values of a lazy column for the rows appended since the last read,
+        the lock must be held """
+        size = self._end - self._start
+        first = size - (self.total - self._loaded[column])
+        if first < 0:
+            # Some of these rows have already been evicted
+            first = 0
+        if first < size:
+            rows = slice(first, size)
+            self._buffers[column][self._start + first:self._end] = self.loaders[column](rows)
+        self._loaded[column] = self.total
+
+    def _spill(self, columns):
+        """ Append evicted rows to the spill files
+
+        Parameters
+        ----------
+        columns : dict
+            {name: array} rows to write
+
+        """
+        if not self.spill_path:
+            return
+
+        for name, values in columns.items():
+            if values.dtype != object and len(values):
+                with open("{}.{}.bin".format(self.spill_path, name), 'ab') as file:
+                    np.ascontiguousarray(values).tofile(file)
+
+    def _evict(self, stop):
+        """ Evict the live rows up to `stop` (excluded) """
+        if stop > self._start:
+            if self.spill_path:
+                # Lazy columns are computed before they are saved
+                for name in self._loaded:
+                    self[name]
+            self._spill({name: self._buffers[name][self._start:stop] for name in self.columns})
+            self._start = stop
+
+    def _reserve(self, n):
+        """ Make room for `n` rows at the end of the arrays, the lock must be held
+
+        With a capacity, `n` must not be greater than the capacity
+
+        """
+        length = len(self._buffer_list[0])
+        if self._end + n <= length:
+            return
+
+        size = self._end - self._start
+
+        if self.capacity is None:
+            length = max(2*length, size + n)
+            for name in self.columns:
+                buffer = np.zeros(length, dtype=self._buffers[name].dtype)
+                buffer[:size] = self._buffers[name][self._start:self._end]
+                self._buffers[name] = buffer
+            self._buffer_list = [self._buffers[name] for name in self.columns]
+
+        else:
+            # Rows that would not fit anyway are evicted before moving the others
+            size = min(size, self.capacity - n)
+            self._evict(self._end - size)
+            for buffer in self._buffer_list:
+                buffer[:size] = buffer[self._start:self._end]
+
+        self._start = 0
+        self._end = size
+
+    def append(self, row):
+        """ Append one row
+
+        Parameters
+        ----------
+        row : sequence
+            one value per column, in the order of the columns. The values of the lazy
+            columns are stored as well
+
+        """
+        with self.lock:
+            self._reserve(1)
+            end = self._end
+            for buffer, value in zip(self._buffer_list, row):
+                buffer[end] = value
+            self._end = end + 1
+            for name, loaded in self._loaded.items():
+                # The value is valid if there is no row left to compute before it
+                if loaded == self.total:
+                    self._loaded[name] = loaded + 1
+            self.total += 1
+
+            if self.capacity and self._end - self._start > self.capacity:
+                self._evict(self._end - self.capacity)
+
+    def extend(self, columns):
+        """ Append many rows at once
+
+        Parameters
+        ----------
+        columns : dict
+            {name: array-like} with the same number of values for every column. The
+            lazy columns can be omitted
+
+        """
+        columns = {name: np.asarray(columns[name]) for name in self.columns if name in columns}
+        n = len(next(iter(columns.values())))
+        if not n:
+            return
+
+        if self.capacity and n > self.capacity:
+            # The new rows alone are enough to fill the store, they are added by chunks
+            for i in range(0, n, self.capacity):
+                self.extend({name: values[i:i + self.capacity] for name, values in columns.items()})
+            return
+
+        with self.lock:
+            self._reserve(n)
+            end = self._end
+            for name, values in columns.items():
+                self._buffers[name][end:end + n] = values
+            self._end = end + n
+            for name, loaded in self._loaded.items():
+                if name in columns and loaded == self.total:
+                    self._loaded[name] = loaded + n
+            self.total += n
+
+            if self.capacity and self._end - self._start > self.capacity:
+                self._evict(self._end - self.capacity)
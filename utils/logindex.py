@@ -0,0 +1,278 @@
+""" Index of the frames of a telemetry log, read through a memory map
+
+The log is mapped in memory with mmap, it is never read as a whole. A first scan
+finds the position of each frame and reads its time stamp from the vehicle's clock.
+The frames are then returned as views of the map on demand, when they are replayed.
+Block compressed logs are read the same way, one block at a time (see utils.blockfile)
+
+The scan is vectorized: the separators are found and the frames are validated with
+NumPy, one chunk of the file at a time. Only the lines that are not valid frames go
+through the LineFramer, to join back the frames cut by a false separator
+
+The index is saved next to the log (`<log>.idx.npz`) and loaded instead of scanning
+the log again, as long as the log is not modified
+
+"""
+
+import os
+
+import numpy as np
+
+from utils.blockfile import open_log
+from utils.framing import LineFramer
+from utils.timeline import TICKS_PER_SECOND, Timeline, time_of_day_ticks
+
+
+INDEX_SUFFIX = ".idx.npz"
+INDEX_VERSION = 2  # Indexes saved by the previous versions are built again
+CHUNK_SIZE = 2**24  # Bytes of the log scanned at once
+
+
+class LogIndex:
+    """ Frames of a log file, with their time stamps
+
+    The frames of the log are separated by b'\\r\\n', as written by Gateway. The log
+    can be block compressed
+
+    Parameters
+    ----------
+    filepath : path-like object
+        path to the log
+    frames : FrameRegistry instance
+        frames of the vehicle that sent the log, see utils.frames. The vehicle must
+        have a clock
+    sidecar : bool, optional
+        False to always scan the log, without reading nor saving the index file
+
+    Attributes
+    ----------
+    offsets : numpy array of int64
+        position of each frame in the log
+    lengths : numpy array of int32
+        length of each frame
+    times : numpy array of float64
+        time of each frame in seconds since the first one, as 'Seconds_since_start'
+        of the clock sensor
+    dropped : int
+        number of bytes of the log that do not belong to a frame, empty lines excluded
+
+    Examples
+    --------
+    >>> log = LogIndex("./data/2019-12-04T11-15-39_Telemetry.log", Sigmundr().frames)
+    >>> count = log.search(10.)        # Number of frames in the first 10 seconds
+    >>> frames = log.frames(0, count)  # The frames, as views of the log
+    >>> log.close()
+
+    """
+
+    def __init__(self, filepath, frames, sidecar=True):
+        if frames.clock is None:
+            raise ValueError("The frames must have a clock to be indexed")
+
+        self.filepath = filepath
+        self.registry = frames
+        self.index_path = "{}{}".format(filepath, INDEX_SUFFIX)
+
+        self.data = open_log(filepath)
+        stat = os.stat(filepath)
+        self.signature = np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        if not (sidecar and self.__load()):
+            self.__scan()
+            self.__compute_times()
+            if sidecar:
+                self.__save()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        """ Release the map, the frames returned before must not be used anymore """
+        self.data.close()
+
+    def frame(self, index):
+        """ Return a frame as a view of the log """
+        return self.data.read(int(self.offsets[index]), int(self.lengths[index]))
+
+    def frames(self, start, stop):
+        """ Return the frames from `start` to `stop` (excluded) as views of the log """
+        read = self.data.read
+
+        return [read(offset, length) for offset, length in zip(
+            self.offsets[start:stop].tolist(), self.lengths[start:stop].tolist())]
+
+    def search(self, seconds, start=0):
+        """ Return the index of the first frame after `seconds`, searching from `start` """
+        return start + int(np.searchsorted(self.times[start:], seconds, side='right'))
+
+    def __load(self):
+        """ Load the index saved next to the log
+
+        Returns
+        -------
+        bool
+            True if the index is loaded, False if it is missing or outdated
+
+        """
+        try:
+            with np.load(self.index_path) as index:
+                if not np.array_equal(index['signature'], self.signature):
+                    return False
+                self.offsets = index['offsets']
+                self.lengths = index['lengths']
+                self.times = index['times']
+                self.dropped = int(index['dropped'])
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError) as e:
+            print("{} : cannot read the index ({})".format(self.index_path, e))
+            return False
+
+        return True
+
+    def __save(self):
+        """ Save the index next to the log, the log can be read only """
+        try:
+            with open(self.index_path, 'wb') as file:
+                np.savez(file, signature=self.signature, offsets=self.offsets,
+                         lengths=self.lengths, times=self.times, dropped=self.dropped)
+        except OSError as e:
+            print("{} : cannot save the index ({})".format(self.index_path, e))
+
+    def __valid(self, first_bytes, lengths):
+        """ Vectorized FrameRegistry.is_valid() """
+        valid = np.zeros(len(lengths), dtype=bool)
+        for frame_id, length in self.registry.decoders:
+            if frame_id is None:
+                valid |= lengths == length
+            else:
+                valid |= (lengths == length) & (first_bytes == frame_id)
+
+        return valid
+
+    def __scan(self):
+        """ Find the frames of the log, and the bytes of their clock """
+        framer = LineFramer(is_valid=self.registry.is_valid, max_length=self.registry.max_length)
+        # A chunk holds several frames at least
+        chunk_size = max(CHUNK_SIZE, 4*(self.registry.max_length + 2))
+        clock_size = self.registry.clock.decoder.size
+
+        offsets, lengths, heads = [], [], []
+        # The incomplete line at the end of a block of a compressed log is scanned
+        # with the next block
+        tail = b''
+        for offset, chunk in self.data.chunks():
+            if tail:
+                chunk = tail + chunk
+                offset -= len(tail)
+            last = offset + len(chunk) == self.data.size
+            rest = self.__scan_buffer(chunk, offset, last, framer, chunk_size, clock_size,
+                                      offsets, lengths, heads)
+            tail = chunk[rest:]
+
+        self.offsets = np.concatenate(offsets).astype(np.int64) if offsets else np.zeros(0, np.int64)
+        self.lengths = np.concatenate(lengths).astype(np.int32) if lengths else np.zeros(0, np.int32)
+        self.heads = np.concatenate(heads) if heads else np.zeros((0, clock_size), np.uint8)
+        self.dropped = framer.dropped + len(tail) + self.data.dropped
+
+    def __scan_buffer(self, buffer, base, last, framer, chunk_size, clock_size, offsets, lengths, heads):
+        """ Find the frames of a buffer holding the log from `base`
+
+        The positions of the frames in the log are appended to `offsets` and `lengths`,
+        and their first `clock_size` bytes to `heads`
+
+        Returns
+        -------
+        rest : int
+            position in `buffer` of the incomplete line at its end, if not `last`
+
+        """
+        data = np.frombuffer(buffer, dtype=np.uint8)
+
+        start = 0  # Start of the line being scanned
+        while start < len(data):
+            # The chunks overlap by one byte, for the separators on their boundary
+            chunk = data[start:start + chunk_size]
+            at_end = start + len(chunk) == len(data)
+            separators = start + np.flatnonzero((chunk[:-1] == 13) & (chunk[1:] == 10))
+            if at_end and last and (not len(separators) or separators[-1] + 2 != len(data)):
+                # The last line has no separator, it is complete anyway
+                separators = np.append(separators, len(data))
+            if not len(separators):
+                if at_end:
+                    return start
+                # No separator in the whole chunk, these bytes cannot be frames
+                framer.dropped += len(chunk) - 1
+                start += len(chunk) - 1
+                continue
+
+            line_starts = np.empty(len(separators), dtype=np.int64)
+            line_starts[0] = start
+            line_starts[1:] = separators[:-1] + 2
+            line_lengths = separators - line_starts
+            # The first byte of empty lines is not used
+            first_bytes = data[np.minimum(line_starts, len(data) - 1)]
+            valid = self.__valid(first_bytes, line_lengths)
+            next_start = min(int(separators[-1]) + 2, len(data))
+
+            # Runs of invalid lines may be pieces of frames cut by false separators. The
+            # empty lines belong to the runs: adjacent false separators leave one between
+            # two pieces
+            invalid = np.flatnonzero(~valid)
+            run_starts = invalid[np.r_[True, np.diff(invalid) > 1]] if len(invalid) else invalid
+            run_stops = invalid[np.r_[np.diff(invalid) > 1, True]] + 1 if len(invalid) else invalid
+            # Runs of empty lines only hold no frame
+            keep = np.add.reduceat((line_lengths > 0)[invalid], np.searchsorted(invalid, run_starts)) > 0 \
+                if len(invalid) else np.zeros(0, dtype=bool)
+            run_starts, run_stops = run_starts[keep], run_stops[keep]
+            if len(run_starts) and run_stops[-1] == len(separators) and not (at_end and last) \
+                    and line_starts[run_starts[-1]] > start:
+                # The last pieces may be completed by the next chunk, they are scanned again
+                # with it
+                next_start = int(line_starts[run_starts[-1]])
+                line_starts, line_lengths = line_starts[:run_starts[-1]], line_lengths[:run_starts[-1]]
+                valid = valid[:run_starts[-1]]
+                run_starts, run_stops = run_starts[:-1], run_stops[:-1]
+
+            extra_starts, extra_lengths = [], []
+            for first, stop in zip(run_starts.tolist(), run_stops.tolist()):
+                # The run is scanned with the valid line that follows, so that the
+                # framer does not wait for the end of the last piece
+                end = int(separators[stop]) + 2 if stop < len(line_starts) else next_start
+                end = min(end, len(data))
+                spans, rest = framer.extract_spans(buffer, int(line_starts[first]), end)
+                for span_start, span_stop in spans:
+                    if stop < len(line_starts) and span_start >= line_starts[stop]:
+                        break
+                    extra_starts.append(span_start)
+                    extra_lengths.append(span_stop - span_start)
+                # The pieces left are not frames
+                framer.dropped += end - rest
+
+            starts = np.concatenate([line_starts[valid], extra_starts]).astype(np.int64)
+            frame_lengths = np.concatenate([line_lengths[valid], extra_lengths]).astype(np.int64)
+            if extra_starts:
+                order = np.argsort(starts, kind='stable')
+                starts, frame_lengths = starts[order], frame_lengths[order]
+            offsets.append(base + starts)
+            lengths.append(frame_lengths)
+            # The bytes of the clock are gathered from each frame, the rest is not read
+            heads.append(data[np.minimum(starts[:, np.newaxis] + np.arange(clock_size), len(data) - 1)])
+
+            start = next_start
+
+        return len(data)
+
+    def __compute_times(self):
+        """ Read the time stamps of the frames from the clock """
+        decoder = self.registry.clock.decoder
+        if not len(self.offsets):
+            self.times = np.zeros(0)
+            return
+
+        [columns] = decoder.decode_array(np.ascontiguousarray(self.heads).view(decoder.dtype(decoder.size)).ravel())
+        del self.heads
+
+        ticks = Timeline().unwrap_batch(time_of_day_ticks(
+            columns['Hour'], columns['Minute'], columns['Second'], columns['Microsecond']))
+        self.times = (ticks - ticks[0])/TICKS_PER_SECOND
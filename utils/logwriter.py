@@ -0,0 +1,356 @@
+""" Background writer of the telemetry logs
+
+The frames received by a Gateway are saved in a log file. The reading thread (or event
+loop) only encodes the frames received at once into one block of bytes and queues it:
+the file is written by a thread of its own, so that a slow disk does not stall the
+reception
+
+The file is held open and the blocks are gathered in a buffer. The buffer is written
+once it is larger than `buffer_size`, or `flush_period` seconds after the last write.
+The data written can be synced to the disk (fsync) after each write, periodically or
+never, see FSYNC_ALWAYS, FSYNC_PERIODIC and FSYNC_NEVER
+
+The queue is bounded: when the writer cannot keep up, the new blocks are dropped and
+counted, the reception is never blocked. Neither is a change of file (set_path())
+
+The frames are written as lines (LineFormat, the legacy logs) or as the records of a
+session log (see utils.sessionlog). Either can be block compressed: each buffer written
+is then compressed into a block of its own, by the writing thread (see utils.blockfile)
+
+"""
+
+import os
+import queue
+import threading
+import time
+
+from utils.blockfile import CODECS, CompressedWriter
+
+
+# Policies to sync the log file to the disk, see LogWriter
+FSYNC_ALWAYS = "always"      # After each write, at most `flush_period` of data lost on a crash
+FSYNC_PERIODIC = "periodic"  # Every `fsync_period` seconds
+FSYNC_NEVER = "never"        # Left to the operating system
+
+BUFFER_SIZE = 2**20  # Bytes gathered before writing them
+QUEUE_SIZE = 1024    # Blocks of frames waiting to be written
+RATE_PERIOD = 1.     # Period of the measurement of the write rate in seconds
+
+# Kinds of the items of the queue
+_FRAMES = "frames"
+_PATH = "path"
+_CLOSE = "close"
+
+
+class LineFormat:
+    """ Frames separated by b'\r\n', the logs are read by utils.logindex """
+
+    suffix = ".log"
+
+    def open(self, path):
+        """ Open the file to append the frames to it """
+        return open(path, 'ab')
+
+    def start(self, file):
+        """ Write the beginning of the file opened by open() """
+
+    def encode(self, frames, received):
+        """ Encode frames received at once, called by the reading thread """
+        return b'\r\n'.join(frames) + b'\r\n'
+
+    def add(self, size, count, received):
+        """ Account for a block written after the previous ones, see encode() """
+
+    def finish(self, file):
+        """ Complete the file before it is closed """
+
+
+class LogWriter:
+    """ Append frames to a log file in a background thread
+
+    Parameters
+    ----------
+    path : path-like object
+        path to the log file, the frames are appended to it
+    buffer_size : int, optional
+        bytes gathered before writing them to the file
+    flush_period : float, optional
+        maximum time in seconds during which the frames stay in the buffer
+    fsync : str, optional
+        FSYNC_ALWAYS, FSYNC_PERIODIC or FSYNC_NEVER
+    fsync_period : float, optional
+        time between two syncs in seconds, with FSYNC_PERIODIC
+    queue_size : int, optional
+        maximum number of blocks of frames waiting to be written
+    log_format : LineFormat or SessionFormat instance, optional
+        format of the log, LineFormat by default. The path of a session log changes
+        if the file already exists, see `path`
+    compression : str, optional
+        "zlib", "gzip" or "lzma" to write a block compressed log, see utils.blockfile.
+        Not compressed by default
+
+    Attributes
+    ----------
+    path : str
+        path to the log file being written
+    frames_written : int
+    frames_dropped : int
+        frames dropped because the queue was full
+    bytes_written : int
+        bytes written before compression
+    bytes_per_second : float
+        write rate over the last second
+    max_queue_depth : int
+        largest number of blocks that waited in the queue
+
+    Examples
+    --------
+    >>> writer = LogWriter("./data/telemetry.log")
+    >>> writer.write(frames)  # Returns at once
+    >>> writer.metrics()
+    >>> writer.close()        # Writes the remaining frames
+
+    """
+
+    def __init__(self, path, buffer_size=BUFFER_SIZE, flush_period=1., fsync=FSYNC_PERIODIC,
+                 fsync_period=5., queue_size=QUEUE_SIZE, log_format=None, compression=None):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_PERIODIC, FSYNC_NEVER):
+            raise ValueError("Unknown fsync policy : {}".format(fsync))
+        if compression is not None and compression not in CODECS:
+            raise ValueError("Unknown compression : {}".format(compression))
+
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_period = flush_period
+        self.fsync = fsync
+        self.fsync_period = fsync_period
+        self.log_format = log_format if log_format is not None else LineFormat()
+        self.compression = compression
+
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self.bytes_per_second = 0.
+        self.max_queue_depth = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self.bytes_compressed = 0  # Bytes written to the file, when compressed
+
+        # Only used by the writing thread
+        self.file = None
+
+        # Path set by set_path() while the queue was full, queued before the next frames
+        self.pending_path = None
+        self.lock = threading.Lock()
+
+        self.queue = queue.Queue(queue_size)
+        self.is_open = True
+        self.thread = threading.Thread(target=self.__run, name="LogWriter", daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        """ Number of blocks of frames waiting to be written """
+        return self.queue.qsize()
+
+    def metrics(self):
+        """ Return the counters of the writer as a dict """
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'bytes_written': self.bytes_written,
+            'bytes_per_second': self.bytes_per_second,
+            'flushes': self.flushes,
+            'fsyncs': self.fsyncs,
+            'bytes_compressed': self.bytes_compressed,
+        }
+
+    def write(self, frames, received=None):
+        """ Queue frames to append them to the log, returns at once
+
+        Parameters
+        ----------
+        frames : [bytes-like object, ]
+            frames received at once. They are copied, they can be reused once the call
+            returns
+        received : int, optional
+            receive time of the frames in ns (see utils.clock), saved in session logs.
+            time.monotonic_ns() by default
+
+        """
+        if not frames:
+            return
+        if not self.is_open:
+            self.frames_dropped += len(frames)
+            return
+
+        if received is None:
+            received = time.monotonic_ns()
+        block = self.log_format.encode(frames, received)
+        with self.lock:
+            # The frames cannot be queued before a change of file
+            if self.pending_path is None or self.__queue_path():
+                try:
+                    self.queue.put_nowait((_FRAMES, (block, len(frames), received)))
+                except queue.Full:
+                    self.frames_dropped += len(frames)
+            else:
+                self.frames_dropped += len(frames)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def set_path(self, path):
+        """ Write the next frames to another file, the previous frames are written first
+
+        Returns at once: when the queue is full, the change is queued by the next
+        write(), the frames that do not fit in the queue after it are dropped
+
+        """
+        if self.is_open:
+            with self.lock:
+                self.pending_path = path
+                self.__queue_path()
+
+    def __queue_path(self):
+        """ Queue the pending change of file, returns False if the queue is full """
+        try:
+            self.queue.put_nowait((_PATH, self.pending_path))
+        except queue.Full:
+            return False
+
+        self.pending_path = None
+        return True
+
+    def close(self):
+        """ Write the queued frames, then close the file """
+        if not self.is_open:
+            return
+        self.is_open = False
+        with self.lock:
+            if self.pending_path is not None:
+                self.queue.put((_PATH, self.pending_path))
+                self.pending_path = None
+        self.queue.put((_CLOSE, None))
+        self.thread.join()
+
+        if self.frames_dropped:
+            print("{} : {} frames could not be written to the log".format(
+                self.path, self.frames_dropped))
+
+    def __flush(self, buffer, blocks):
+        """ Write the buffer to the file, returns the number of bytes written
+
+        The file is created with the first frames written to it. When the log is
+        compressed, each buffer is compressed into a block on flush()
+
+        Parameters
+        ----------
+        buffer : bytearray
+        blocks : [(int, int, int), ]
+            size, number of frames and receive time of the blocks in the buffer. They
+            are added to the index of the log once written
+
+        """
+        if not buffer:
+            return 0
+        frames = sum(count for _, count, _ in blocks)
+        try:
+            if self.file is None:
+                file = self.log_format.open(self.path)
+                self.path = file.name
+                if self.compression is not None:
+                    file = CompressedWriter(file, self.compression)
+                self.file = file
+                self.log_format.start(file)
+            self.file.write(buffer)
+            self.__flush_file()
+            if self.fsync == FSYNC_ALWAYS:
+                os.fsync(self.file.fileno())
+                self.fsyncs += 1
+        except OSError as e:
+            print("{} : cannot write the log ({})".format(self.path, e))
+            self.frames_dropped += frames
+            return 0
+
+        for size, count, received in blocks:
+            self.log_format.add(size, count, received)
+        self.flushes += 1
+        self.frames_written += frames
+
+        return len(buffer)
+
+    def __flush_file(self):
+        """ Flush the file, the bytes written are counted once compressed """
+        compressed = getattr(self.file, 'bytes_out', 0)
+        self.file.flush()
+        self.bytes_compressed += getattr(self.file, 'bytes_out', 0) - compressed
+
+    def __sync(self):
+        if self.file is not None:
+            try:
+                os.fsync(self.file.fileno())
+                self.fsyncs += 1
+            except OSError as e:
+                print("{} : cannot sync the log ({})".format(self.path, e))
+
+    def __close_file(self):
+        if self.file is not None:
+            try:
+                self.log_format.finish(self.file)
+                self.__flush_file()
+            except OSError as e:
+                print("{} : cannot complete the log ({})".format(self.path, e))
+            if self.fsync != FSYNC_NEVER:
+                self.__sync()
+            self.file.close()
+            self.file = None
+
+    def __run(self):
+        """ Write the queued frames until close() is called """
+        buffer = bytearray()
+        blocks = []  # (size, frames, receive time) of the blocks in the buffer
+
+        now = time.monotonic()
+        flush_deadline = now + self.flush_period
+        fsync_deadline = now + self.fsync_period
+        rate_start = now
+        rate_bytes = 0
+
+        closing = False
+        while not closing:
+            try:
+                kind, value = self.queue.get(timeout=max(0., flush_deadline - time.monotonic()))
+            except queue.Empty:
+                kind, value = None, None
+
+            if kind == _FRAMES:
+                block, count, received = value
+                blocks.append((len(block), count, received))
+                buffer += block
+
+            now = time.monotonic()
+            # The file is changed or closed once the buffer is written
+            if kind != _FRAMES or len(buffer) >= self.buffer_size or now >= flush_deadline:
+                written = self.__flush(buffer, blocks)
+                self.bytes_written += written
+                rate_bytes += written
+                buffer.clear()
+                blocks = []
+                flush_deadline = now + self.flush_period
+
+            if self.fsync == FSYNC_PERIODIC and now >= fsync_deadline:
+                self.__sync()
+                fsync_deadline = now + self.fsync_period
+
+            if now - rate_start >= RATE_PERIOD:
+                self.bytes_per_second = rate_bytes/(now - rate_start)
+                rate_start = now
+                rate_bytes = 0
+
+            if kind == _PATH:
+                self.__close_file()
+                self.path = value
+            elif kind == _CLOSE:
+                self.__close_file()
+                closing = True
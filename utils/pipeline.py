@@ -0,0 +1,214 @@
+""" Stages processing the frames received by a Gateway
+
+The reading thread (or event loop) of a Gateway only drains the serial port: it hands
+the frames received at once over to its sinks and reads again. The sinks are the log
+writer (see utils.logwriter), the decoding of the frames into the sensors, and any
+other consumer added with Gateway.add_sink(). A slow decoding then never delays the
+reading, the serial buffer of the operating system cannot overflow
+
+A Stage runs a consumer in a thread of its own, fed by a bounded queue. When the
+consumer cannot keep up, the queue fills up and the policy of the stage applies:
+    - DROP_NEWEST : the new frames are dropped, the frames queued first are kept
+    - DROP_OLDEST : the frames queued first are dropped, for the consumers that
+                    only need the latest data (eg. a display)
+    - BLOCK : the reader waits for the consumer (backpressure), up to `timeout`
+              seconds, then drops the new frames. Only for the replays of files,
+              where waiting loses nothing
+
+Each stage counts the frames it processed and dropped, the errors of its consumer, and
+the time spent in it, see Stage.metrics()
+
+"""
+
+import queue
+import threading
+import time
+
+
+# Policies when the queue of a stage is full, see Stage
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+QUEUE_SIZE = 256  # Batches of frames waiting to be processed
+
+
+class Stage:
+    """ Run a consumer of frames in a background thread
+
+    Has the same interface as LogWriter: write(), metrics() and close()
+
+    Parameters
+    ----------
+    name : str
+        name of the stage, used in the error messages
+    consumer : callable
+        called as consumer(frames, received) with the frames received at once, in the
+        thread of the stage. Its exceptions are counted, the first one is printed
+    queue_size : int, optional
+        maximum number of batches of frames waiting to be processed
+    policy : str, optional
+        DROP_NEWEST, DROP_OLDEST or BLOCK, applied when the queue is full
+    timeout : float, optional
+        maximum time in seconds during which write() waits, with BLOCK
+
+    Attributes
+    ----------
+    frames_processed : int
+    frames_dropped : int
+        frames dropped because the queue was full, or after close()
+    errors : int
+        batches of frames on which the consumer raised an exception
+    last_error : Exception instance or None
+    busy_time : float
+        total time spent in the consumer in seconds
+    max_latency : float
+        longest time a batch waited in the queue in seconds
+    max_queue_depth : int
+        largest number of batches that waited in the queue
+
+    Examples
+    --------
+    >>> stage = Stage("Sensors", lambda frames, received: sensors.update_sensors_batch(frames))
+    >>> stage.write(frames, time.monotonic_ns())  # Returns at once
+    >>> stage.metrics()
+    >>> stage.close()                              # Processes the remaining frames
+
+    """
+
+    def __init__(self, name, consumer, queue_size=QUEUE_SIZE, policy=DROP_NEWEST, timeout=1.):
+        if policy not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError("Unknown drop policy : {}".format(policy))
+
+        self.name = name
+        self.consumer = consumer
+        self.policy = policy
+        self.timeout = timeout
+
+        self.batches = 0
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.busy_time = 0.
+        self.max_latency = 0.
+        self.max_queue_depth = 0
+
+        self.queue = queue.Queue(queue_size)
+        self.is_open = True
+        self.thread = threading.Thread(target=self.__run, name=name, daemon=True)
+        self.thread.start()
+
+    @property
+    def queue_depth(self):
+        """ Number of batches of frames waiting to be processed """
+        return self.queue.qsize()
+
+    def metrics(self):
+        """ Return the counters of the stage as a dict """
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'batches': self.batches,
+            'frames_received': self.frames_received,
+            'frames_processed': self.frames_processed,
+            'frames_dropped': self.frames_dropped,
+            'errors': self.errors,
+            'busy_time': self.busy_time,
+            'max_latency': self.max_latency,
+        }
+
+    def write(self, frames, received=None):
+        """ Queue frames for the consumer, returns at once unless the policy is BLOCK
+
+        Parameters
+        ----------
+        frames : [bytes, ]
+            frames received at once. They are not copied, views of a file must be
+            copied first
+        received : int, optional
+            receive time of the frames in ns (see utils.clock), given to the consumer.
+            time.monotonic_ns() by default
+
+        """
+        if not frames:
+            return
+        self.frames_received += len(frames)
+        if not self.is_open:
+            self.frames_dropped += len(frames)
+            return
+
+        if received is None:
+            received = time.monotonic_ns()
+        item = (frames, received, time.monotonic())
+        try:
+            if self.policy == BLOCK:
+                self.queue.put(item, timeout=self.timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            if self.policy != DROP_OLDEST:
+                self.frames_dropped += len(frames)
+            else:
+                self.__replace_oldest(item)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def __replace_oldest(self, item):
+        """ Drop the oldest batches until `item` fits in the queue """
+        while True:
+            try:
+                frames, _, _ = self.queue.get_nowait()
+                self.queue.task_done()
+                if frames is not None:
+                    self.frames_dropped += len(frames)
+                else:
+                    # close() is waiting for the queue, nothing is written after it
+                    self.queue.put_nowait((None, None, None))
+                    self.frames_dropped += len(item[0])
+                    return
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self):
+        """ Wait until the queued frames are processed, the consumer is then idle until
+        the next write() """
+        self.queue.join()
+
+    def close(self):
+        """ Process the queued frames, then stop the thread """
+        if not self.is_open:
+            return
+        self.is_open = False
+        self.queue.put((None, None, None))
+        self.thread.join()
+
+        if self.frames_dropped:
+            print("{} : {} frames dropped".format(self.name, self.frames_dropped))
+
+    def __run(self):
+        """ Process the queued frames until close() is called """
+        while True:
+            frames, received, queued = self.queue.get()
+            if frames is None:
+                self.queue.task_done()
+                break
+
+            start = time.monotonic()
+            self.max_latency = max(self.max_latency, start - queued)
+            try:
+                self.consumer(frames, received)
+                self.frames_processed += len(frames)
+            except Exception as e:
+                if not self.errors:
+                    print("{} : cannot process the frames ({!r})".format(self.name, e))
+                self.errors += 1
+                self.last_error = e
+            self.busy_time += time.monotonic() - start
+            self.batches += 1
+            self.queue.task_done()
@@ -0,0 +1,183 @@
+""" Scheduler of the replay of a recorded log
+
+The frames of a log are replayed at the pace at which they were received, or faster.
+The scheduler keeps the replay time and tells which frames are due at each read: the
+due frames are found by bisection in the time stamps of the log, see utils.logindex,
+so a read does not depend on the length of the log
+
+The replay can be sped up or slowed down (from 0.25x to 100x, or as fast as
+possible), paused and moved to any time of the log
+
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from utils.clock import SYSTEM_CLOCK
+
+
+MIN_RATE = 0.25
+MAX_RATE = 100.
+FASTEST = math.inf  # Rate to replay the frames as fast as they can be read
+BATCH_SIZE = 1000   # Maximum number of frames due at once
+
+
+class ReplayScheduler:
+    """ Replay time of a log, and frames due at this time
+
+    The replay starts when the instance is created. The replay can be controlled from
+    another thread than the one reading the frames (eg. the GUI)
+
+    Parameters
+    ----------
+    times : numpy array of float
+        time stamp of each frame in seconds since the first one, in the order of the log
+    rate : float, optional
+        replay speed, 1 for the pace at which the frames were received. From MIN_RATE
+        to MAX_RATE, or FASTEST
+    batch_size : int, optional
+        maximum number of frames due at once. The replay catches up at the next reads
+        when more frames are due
+    clock : SystemClock or SimulatedClock instance, optional
+        clock of the replay time, see utils.clock. The computer's clock by default
+    on_rewind : callable, optional
+        called as on_rewind() by due(), in the thread reading the frames, before the
+        frames replayed again after a backward seek() are due. Eg. to clear the
+        sensors, whose time stamps must stay sorted
+
+    Attributes
+    ----------
+    index : int
+        index of the next frame to replay
+    rate : float
+    paused : bool
+
+    Examples
+    --------
+    >>> replay = ReplayScheduler(log.times, rate=10.)
+    >>> start, stop = replay.due()    # Frames due since the start of the replay
+    >>> replay.seek(120.)             # Go to the frames received after 2 minutes
+    >>> replay.set_rate(FASTEST)
+
+    """
+
+    def __init__(self, times, rate=1., batch_size=BATCH_SIZE, clock=SYSTEM_CLOCK, on_rewind=None):
+        # Frames received out of order are due with the frame before them, the time
+        # stamps to bisect must be sorted
+        self.times = np.maximum.accumulate(times) if len(times) else np.zeros(0)
+        self.batch_size = batch_size
+        self.clock = clock
+        self.on_rewind = on_rewind
+        self.index = 0
+        self.paused = False
+        # True once seek() moved back to frames already replayed, until the next due()
+        self.rewound = False
+        self.lock = threading.Lock()
+
+        # The replay time is `anchor_position` at `anchor_time`
+        self.anchor_position = 0.
+        self.anchor_time = self.clock.monotonic()
+        self.rate = 1.
+        self.set_rate(rate)
+
+    @property
+    def duration(self):
+        """ Time of the last frame in seconds """
+        return float(self.times[-1]) if len(self.times) else 0.
+
+    @property
+    def finished(self):
+        """ True once all the frames have been replayed """
+        return self.index >= len(self.times)
+
+    @property
+    def throttled(self):
+        """ False when the next frames are due at once, the reads do not need to wait """
+        return self.paused or self.finished or self.rate != FASTEST
+
+    @property
+    def position(self):
+        """ Replay time in seconds since the first frame """
+        if self.paused or self.rate == FASTEST:
+            return self.anchor_position
+
+        return self.anchor_position + (self.clock.monotonic() - self.anchor_time)*self.rate
+
+    def due(self):
+        """ Return the frames due since the last call
+
+        Returns
+        -------
+        start, stop : int
+            index of the first frame due, and of the frame after the last one
+
+        """
+        with self.lock:
+            rewound = self.rewound
+            self.rewound = False
+            start = self.index
+            if self.paused or self.finished:
+                stop = start
+            elif self.rate == FASTEST:
+                stop = min(start + self.batch_size, len(self.times))
+                # The replay time follows the frames
+                self.anchor_position = float(self.times[stop - 1])
+            else:
+                stop = start + int(np.searchsorted(self.times[start:], self.position, side='right'))
+                stop = min(stop, start + self.batch_size)
+            self.index = stop
+
+        if rewound and self.on_rewind is not None:
+            # The frames due before the seek have been read already
+            self.on_rewind()
+
+        return start, stop
+
+    def set_rate(self, rate):
+        """ Change the replay speed, from MIN_RATE to MAX_RATE or FASTEST """
+        if rate != FASTEST and not MIN_RATE <= rate <= MAX_RATE:
+            raise ValueError("The replay rate must be from {} to {}, or FASTEST : {}".format(
+                MIN_RATE, MAX_RATE, rate))
+
+        with self.lock:
+            self.anchor_position = self.position
+            self.anchor_time = self.clock.monotonic()
+            self.rate = rate
+
+    def pause(self):
+        """ Stop the replay time, no frame is due until resume() is called """
+        with self.lock:
+            if not self.paused:
+                self.anchor_position = self.position
+                self.paused = True
+
+    def resume(self):
+        with self.lock:
+            if self.paused:
+                self.anchor_time = self.clock.monotonic()
+                self.paused = False
+
+    def seek(self, seconds):
+        """ Move the replay to a time of the log
+
+        The next frame due is the first one received at `seconds` or later. Frames
+        already replayed are replayed again when seeking backwards: `on_rewind` is then
+        called before they are due, the sensors already hold them with the time stamps
+        that follow
+
+        Parameters
+        ----------
+        seconds : float
+            time since the first frame, limited to the duration of the log
+
+        """
+        seconds = min(max(seconds, 0.), self.duration)
+        with self.lock:
+            index = int(np.searchsorted(self.times, seconds, side='left'))
+            if index < self.index:
+                self.rewound = True
+            self.index = index
+            self.anchor_position = seconds
+            self.anchor_time = self.clock.monotonic()
@@ -9,9 +9,17 @@ to add a specific processing in 'update_data()' if necessary
 
 """
 
-import datetime
 import math
-import struct
+from os import mkdir
+from os.path import isdir, join
+
+import numpy as np
+
+from utils.clock import SYSTEM_CLOCK
+from utils.decoder import FrameDecoder
+from utils.frames import FrameRegistry
+from utils.history import DEFAULT_CAPACITY, History
+from utils.timeline import TICKS_PER_SECOND, Timeline, time_of_day_ticks
 
 
 class GenericSensor:
@@ -26,9 +34,22 @@ class GenericSensor:
             {'Name_of_the_field': {
                 'start': #Position of the first byte in the field,
                 'size': #Size of the field in bytes,
+                'type': #'int', 'float' or 'bitfield',
                 'conversion_function': #lamdba fonction to convert the values,
                 'byte_order': #'big' or 'little,
                 'signed': #True or False,
+                'dtype': #(optional) numpy dtype of the stored values, 'float64' by default,
+                },
+            {'Name_of_a_flag': {
+                'start': #Position of the first byte of the word holding the flag,
+                'size': #Size of the word in bytes,
+                'type': 'bitfield',
+                'bit': #Position of the lowest bit of the flag in the word,
+                'nb_bits': #(optional) number of bits of the flag, 1 by default,
+                'conversion_function': #(optional) lamdba fonction to convert the flag,
+                'byte_order': #'big' or 'little,
+                'signed': False,
+                'dtype': #(optional) numpy dtype of the stored values, 'float64' by default,
                 },
             {'Name_of_an_other_field'}: {...},
             }
@@ -40,127 +61,174 @@ class GenericSensor:
         (optional) frequency of data acquisition in Hz. Required if nb_samples != 1
     is_rtc: bool
         True if the sensor is a Real Time Clock
+    capacity: int
+        (optional) number of samples kept in memory, see History. None to keep all
+    spill_path: str
+        (optional) path prefix of the files where the evicted samples are saved
+
+    Attributes
+    ----------
+    lazy_fields: tuple
+        fields that are only decoded when they are read from 'raw_data'. The bytes of
+        the samples are kept in the 'Raw' column of 'raw_data' to decode them later.
+        Child classes list the fields that are not used to update 'data'
 
     """
+    lazy_fields = ()
 
-    def __init__(self, start_position, fields, sample_size, nb_samples=1, sample_rate=0, is_rtc=False):
+    def __init__(self, start_position, fields, sample_size, nb_samples=1, sample_rate=0, is_rtc=False,
+                 capacity=DEFAULT_CAPACITY, spill_path=None):
         self.start_position = start_position
         self.fields = fields
         self.sample_size = sample_size  # Byte
         self.nb_samples = nb_samples
         self.sample_rate = sample_rate  # Hz
         self.is_rtc = is_rtc
+        self.capacity = capacity
+        self.spill_path = spill_path
+
+        # The fields specification is compiled once, see FrameDecoder
+        self.decoder = FrameDecoder([self])
+        if self.lazy_fields:
+            self.sample_decoder = FrameDecoder.for_samples(self)
 
         self.set_default_values()
 
     def set_default_values(self):
-        fields = ['Time'] + ['Seconds_since_start'] + list(self.fields.keys())
-        self.raw_data = {key: [] for key in fields}
-
-    def _extract_samples(self, frame):
-        """ Read a frame and return a view of it with only the relevant bytes
-
-        The relevant bytes are those located between self.start_position and
-        self.sample_size. If multiple samples are present (ie. self.nb_samples
-        is greater that 1) all samples are returned as elements of a list
+        columns = {'Time': 'int64', 'Seconds_since_start': 'float64'}
+        for field, spec in self.fields.items():
+            columns[field] = spec.get('dtype', 'float64')
+        loaders = {}
+        if self.lazy_fields:
+            columns['Raw'] = 'V{}'.format(self.sample_size)
+            loaders = {field: self._lazy_loader(field) for field in self.lazy_fields}
+        self.raw_data = History(columns, self.capacity, self.spill_path, loaders)
+        # Ticks of the first sample, kept apart as it may be evicted from raw_data
+        self.start_time = None
+        if self.is_rtc:
+            self.timeline = Timeline()
+
+    def _lazy_loader(self, field):
+        """ Return the function that decodes a lazy field from the samples' bytes
 
         Parameters
         ----------
-        frame: bytearray
-            array containing all the sensors values
+        field: str
+            name of the field
 
         Returns
         -------
-        samples: list
-            list of the samples related to the sensor
+        load: function
+            loader of the 'raw_data' column of the field, see History
 
         """
-        start = self.start_position
-        size = self.sample_size*self.nb_samples
-        frame = frame[start: start + size]
-
-        samples = []
-        for i in range(0, len(frame), self.sample_size):
-            sample = frame[i: i + self.sample_size]
-            samples.append(sample)
-   
-        return samples
+        def load(rows):
+            samples = self.raw_data['Raw'][rows]
+            array = samples.view(self.sample_decoder.dtype(self.sample_size))
+            [columns] = self.sample_decoder.decode_array(array, [field])
+            return columns[field]
+
+        return load
 
-    def _extract_field_values(self, sample, field):
-        """ Use self.field data to extract and convert the field values
+    def _extract_samples(self, frame):
+        """ Extract and convert the values of all the samples of the sensor
 
         Parameters
         ----------
-        sample: bytearray
-        
+        frame: bytearray
+            array containing all the sensors values
+
         Returns
         -------
-        value: int or float or bool
-            converted value of the field
+        samples: list
+            one tuple of converted values per sample, ordered as self.fields
 
         """
-        start = self.fields[field]['start']
-        size = self.fields[field]['size']
-        field_type = self.fields[field]['type']
-        convert = self.fields[field]['conversion_function']
-        byte_order = self.fields[field]['byte_order']
-        signed = self.fields[field]['signed']
-
-        field_bytes = sample[start: start + size]
-
-        if field_type == 'int':
-            value = int.from_bytes(field_bytes, byte_order, signed=signed)
-        elif field_type == 'float':
-            if byte_order == 'big':
-                [value] = struct.unpack('>f', field_bytes)
-            else:
-                [value] = struct.unpack('<f', field_bytes)
+        [samples] = self.decoder.decode(frame)
 
-        value = convert(value)
-
-        return value
+        return samples
 
-    def update_raw_data(self, frame, frame_time=None):
+    def update_raw_data(self, frame, frame_time=None, samples=None):
         """ Read values from the telemetry frame and update the sensor's values
 
         Parameters
         ----------
         frame: bytearray
             telemetry frame
-        frame_time: datetime.time object
-            (optional) timestamp of the frame. Not need when reading the RTC
+        frame_time: int
+            (optional) timestamp of the frame in ticks, see utils.timeline. Not need
+            when reading the RTC
+        samples: list
+            (optional) values already decoded from the frame by a FrameDecoder.
+            The frame is not read again when they are given
 
         """
-        samples = self._extract_samples(frame)
+        if samples is None:
+            samples = self._extract_samples(frame)
 
         for i, sample in enumerate(samples):
 
-            for field in self.fields.keys():
-                value = self._extract_field_values(sample, field)
-                self.raw_data[field].append(value)
-
             # frame_time is None when updating the RTC values
             if self.is_rtc:
-                hour = self.raw_data['Hour'][-1]
-                minute = self.raw_data['Minute'][-1]
-                second = self.raw_data['Second'][-1]
-                microsecond = int(self.raw_data['Microsecond'][-1])
-                frame_time = datetime.time(hour, minute, second, microsecond)
-
-            if self.raw_data['Time']:
-                start_time = datetime.datetime.combine(datetime.date.today(), self.raw_data['Time'][0])
-                    
-                now = datetime.datetime.combine(datetime.date.today(), frame_time)
-                delta = now - start_time
-                delta = delta.total_seconds()
-            else:
-                delta = 0.
-            
-            self.raw_data['Time'].append(frame_time)
+                frame_time = self.timeline.unwrap(time_of_day_ticks(*sample))
+
+            if self.start_time is None:
+                self.start_time = frame_time
+            delta = (frame_time - self.start_time)/TICKS_PER_SECOND
+
+            # The last sample is the newest, it is acquired at the time of the frame
             if self.sample_rate:
-                self.raw_data['Seconds_since_start'].append(delta-(self.nb_samples-i+1)/self.sample_rate)
-            else:
-                self.raw_data['Seconds_since_start'].append(delta)
+                delta = delta-(self.nb_samples-1-i)/self.sample_rate
+
+            if self.lazy_fields:
+                offset = self.start_position + i*self.sample_size
+                sample = sample + (bytes(frame[offset:offset + self.sample_size]),)
+
+            self.raw_data.append((frame_time, delta) + sample)
+
+    def update_raw_data_batch(self, columns, frame_times=None):
+        """ Update the sensor's values with the content of many frames at once
+
+        Batch counterpart of update_raw_data()
+
+        Parameters
+        ----------
+        columns: dict
+            {field: numpy array} as returned by FrameDecoder.decode_batch(), with
+            self.nb_samples values per frame
+        frame_times: numpy array
+            (optional) timestamps of the frames in ticks, one per frame. Not need when
+            reading the RTC
+
+        Returns
+        -------
+        frame_times: numpy array
+            timestamps of the frames, read from the frames when the sensor is a RTC
+
+        """
+        if self.is_rtc:
+            frame_times = self.timeline.unwrap_batch(time_of_day_ticks(
+                columns['Hour'], columns['Minute'], columns['Second'], columns['Microsecond']))
+
+        if frame_times is None or not len(frame_times):
+            return frame_times
+
+        frame_times = np.asarray(frame_times, dtype=np.int64)
+        if self.start_time is None:
+            self.start_time = int(frame_times[0])
+        delta = (frame_times - self.start_time)/TICKS_PER_SECOND
+
+        delta = np.repeat(delta, self.nb_samples)
+        if self.sample_rate:
+            i = np.tile(np.arange(self.nb_samples), len(frame_times))
+            delta = delta - (self.nb_samples-1-i)/self.sample_rate
+
+        columns = dict(columns)
+        columns['Time'] = np.repeat(frame_times, self.nb_samples)
+        columns['Seconds_since_start'] = delta
+        self.raw_data.extend(columns)
+
+        return frame_times
 
 
 # ############################### #
@@ -173,18 +241,22 @@ class Status(GenericSensor):
         'STATUS_1': {
             'start': 0,
             'size': 2,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 0xFF00) >> 8,
+            'type': 'bitfield',
+            'bit': 8,
+            'nb_bits': 8,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
         'STATUS_2': {
             'start': 0,
             'size': 2,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 0x00FF) >> 0,
+            'type': 'bitfield',
+            'bit': 0,
+            'nb_bits': 8,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         }
     }
     sample_size = 2
@@ -198,8 +270,13 @@ class Status(GenericSensor):
         self.data = {field: 0 for field in self.fields.keys()}
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+        for field in self.fields.keys():
+            self.data[field] = self.raw_data[field][-1]
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
         for field in self.fields.keys():
             self.data[field] = self.raw_data[field][-1]
 
@@ -209,42 +286,47 @@ class ErrMsg(GenericSensor):
         'ERR_LOOP_TIME': {
             'start': 0,
             'size': 1,
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<0) >> 0,
+            'type': 'bitfield',
+            'bit': 0,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'ERR_WRITE_SD': {
             'start': 0,
             'size': 1,
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<1) >> 1,
+            'type': 'bitfield',
+            'bit': 1,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'ERR_SYNC_SD': {
             'start': 0,
             'size': 1,
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<2) >> 2,
+            'type': 'bitfield',
+            'bit': 2,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'ERR_SEND_TM': {
             'start': 0,
             'size': 1,
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<3) >> 3,
+            'type': 'bitfield',
+            'bit': 3,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'ERR_READ_IMU': {
             'start': 0,
             'size': 1,
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<4) >> 4,
+            'type': 'bitfield',
+            'bit': 4,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
     }
     sample_size = 1
@@ -258,8 +340,13 @@ class ErrMsg(GenericSensor):
         self.data = {field: None for field in self.fields.keys()}
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+        for field in self.fields.keys():
+            self.data[field] = self.raw_data[field][-1]
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
         for field in self.fields.keys():
             self.data[field] = self.raw_data[field][-1]
 
@@ -276,6 +363,7 @@ class RTC(GenericSensor):
             'conversion_function': lambda x: x,  # h
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
         'Minute': {
             'start': 1,
@@ -284,6 +372,7 @@ class RTC(GenericSensor):
             'conversion_function': lambda x: x,  # min
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
         'Second': {
             'start': 2,
@@ -292,6 +381,7 @@ class RTC(GenericSensor):
             'conversion_function': lambda x: x,  # s
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
         'Microsecond': {
             'start': 3,
@@ -311,7 +401,7 @@ class RTC(GenericSensor):
     
     def reset(self):
         self.data = {
-            'Time': datetime.time(0, 0, 0, 0),
+            'Time': 0,
             'Hour': 0,
             'Minute': 0,
             'Second': 0,
@@ -319,14 +409,23 @@ class RTC(GenericSensor):
         }
         self.set_default_values()
     
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
         self.data['Time'] = self.raw_data['Time'][-1]
         self.data['Hour'] = self.raw_data['Hour'][-1]
         self.data['Minute'] = self.raw_data['Minute'][-1]
         self.data['Second'] = self.raw_data['Second'][-1]
         self.data['Microsecond'] = self.raw_data['Microsecond'][-1]
 
+    def update_data_batch(self, columns, frame_times=None):
+        frame_times = self.update_raw_data_batch(columns, frame_times)
+        self.data['Time'] = self.raw_data['Time'][-1]
+        self.data['Hour'] = self.raw_data['Hour'][-1]
+        self.data['Minute'] = self.raw_data['Minute'][-1]
+        self.data['Second'] = self.raw_data['Second'][-1]
+        self.data['Microsecond'] = self.raw_data['Microsecond'][-1]
+        return frame_times
+
 
 class Timer(GenericSensor):
     """ Time elapsed since the rocket was launched
@@ -353,8 +452,12 @@ class Timer(GenericSensor):
         self.data = {'Timer': 0}
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+        self.data['Timer'] = self.raw_data['Timer'][-1]
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
         self.data['Timer'] = self.raw_data['Timer'][-1]
 
 
@@ -391,8 +494,13 @@ class Batteries(GenericSensor):
         self.data = {field: 0 for field in self.fields.keys()}
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+        for field in self.fields.keys():
+            self.data[field] = self.raw_data[field][-1]
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
         for field in self.fields.keys():
             self.data[field] = self.raw_data[field][-1]
 
@@ -412,6 +520,7 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/2048.,  # g
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Acc_Y': {
             'start': 2,
@@ -420,6 +529,7 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/2048.,  # g
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Acc_Z': {
             'start': 4,
@@ -428,6 +538,7 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/2048.,  # g
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Temp': {
             'start': 6,
@@ -436,6 +547,7 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/326.8 + 25,  # °C
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Gyro_X': {
             'start': 8,
@@ -444,6 +556,7 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/32.8,  # dps
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Gyro_Y': {
             'start': 10,
@@ -452,6 +565,7 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/32.8,  # dps
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Gyro_Z': {
             'start': 12,
@@ -460,9 +574,12 @@ class ICM20602(GenericSensor):
             'conversion_function': lambda x: x/32.8,  # dps
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
     }
     sample_size = 14
+    # Only read by the graphs, when they are displayed
+    lazy_fields = tuple(fields)
 
     def __init__(self, start_position, **kwargs):
         super().__init__(start_position, self.fields, self.sample_size, **kwargs)
@@ -475,8 +592,11 @@ class ICM20602(GenericSensor):
         self.is_acc_graph_init = False
         self.is_gyro_graph_init = False
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
 
 
 class BMP280(GenericSensor):
@@ -511,18 +631,28 @@ class BMP280(GenericSensor):
         self.reset()
     
     def reset(self):
-        self.data = {}
-        self.data['Pressure hPa'] = []
-        self.data['Altitude'] = []
+        self.data = History({'Pressure hPa': 'float64', 'Altitude': 'float64'}, self.capacity)
         self.set_default_values()
         self.reference_pressure = None
         self.is_pressure_graph_init = False
         self.is_altitude_graph_init = False
     
     def set_reference(self):
-        if len(self.raw_data['Pressure']) > 1:
-            self.reference_pressure = self.raw_data['Pressure'][-1]
-            print('BMP reference set')
+        # The samples are decoded in another thread: they are not appended meanwhile. The
+        # locks are taken in the same order as in update_data()
+        with self.data.lock, self.raw_data.lock:
+            if len(self.raw_data['Pressure']) > 1:
+                self.reference_pressure = self.raw_data['Pressure'][-1]
+                # The altitudes of all the samples in memory are computed again. The last
+                # samples may not have their altitude yet, it is computed with the new
+                # reference once they are decoded
+                missing = self.raw_data.total - self.data.total
+                n = min(len(self.data), len(self.raw_data) - missing)
+                rows = slice(len(self.raw_data) - missing - n, len(self.raw_data) - missing)
+                self.data['Altitude'][len(self.data) - n:] = self.altitude_batch(
+                    self.raw_data['Temperature'][rows], self.raw_data['Pressure'][rows],
+                    self.reference_pressure)
+                print('BMP reference set')
     
     def altitude(self, T, p, p0):
         # Hypsometric formula
@@ -532,18 +662,40 @@ class BMP280(GenericSensor):
             h = 0
         return h
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
-        self.data['Pressure hPa'].append(self.raw_data['Pressure'][-1]/100.)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+        pressure_hpa = self.raw_data['Pressure'][-1]/100.
 
-        if self.reference_pressure is None:
-            self.data['Altitude'].append(0)
-        else:
-            T = self.raw_data['Temperature'][-1]
-            p = self.raw_data['Pressure'][-1]
-            p0 = self.reference_pressure
-            h = self.altitude(T, p, p0)
-            self.data['Altitude'].append(h)
+        # The reference does not change until the altitude is appended, see set_reference()
+        with self.data.lock:
+            if self.reference_pressure is None:
+                h = 0
+            else:
+                T = self.raw_data['Temperature'][-1]
+                p = self.raw_data['Pressure'][-1]
+                p0 = self.reference_pressure
+                h = self.altitude(T, p, p0)
+
+            self.data.append((pressure_hpa, h))
+
+    def altitude_batch(self, T, p, p0):
+        # Hypsometric formula, see altitude()
+        h = np.zeros(len(p))
+        valid = p > 0.
+        h[valid] = (np.power(p0/p[valid], 1/5.257) - 1) * (T[valid] + 273.15) / 0.0065
+        return h
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
+
+        # The reference does not change until the altitudes are appended, see set_reference()
+        with self.data.lock:
+            if self.reference_pressure is None:
+                h = np.zeros(len(columns['Pressure']))
+            else:
+                h = self.altitude_batch(columns['Temperature'], columns['Pressure'], self.reference_pressure)
+
+            self.data.extend({'Pressure hPa': columns['Pressure']/100., 'Altitude': h})
 
 
 class LIS3MDLTR(GenericSensor):
@@ -558,6 +710,7 @@ class LIS3MDLTR(GenericSensor):
             'conversion_function': lambda x: x/6842.,  # Gauss
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Mag_Y': {
             'start': 2,
@@ -566,6 +719,7 @@ class LIS3MDLTR(GenericSensor):
             'conversion_function': lambda x: x/6842.,  # Gauss
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
         'Mag_Z': {
             'start': 4,
@@ -574,9 +728,12 @@ class LIS3MDLTR(GenericSensor):
             'conversion_function': lambda x: x/6842.,  # Gauss
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'float32',
         },
     }
     sample_size = 6
+    # Not displayed on the dashboard
+    lazy_fields = tuple(fields)
 
     def __init__(self, start_position, **kwargs):
         super().__init__(start_position, self.fields, self.sample_size, **kwargs)
@@ -587,8 +744,11 @@ class LIS3MDLTR(GenericSensor):
         self.data = {}
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
 
 
 class ABP(GenericSensor):
@@ -615,9 +775,7 @@ class ABP(GenericSensor):
         self.reset()
     
     def reset(self):
-        self.data = {}
-        self.data['Pressure hPa'] = []
-        self.data['Air speed'] = []
+        self.data = History({'Pressure hPa': 'float64', 'Air speed': 'float64'}, self.capacity)
         self.set_default_values()
         self.is_pressure_graph_init = False
         self.is_speed_graph_init = False
@@ -633,12 +791,23 @@ class ABP(GenericSensor):
             u = 0
         return u
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
-        self.data['Pressure hPa'].append(self.raw_data['Pressure'][-1]/100.)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
         pressure = self.raw_data['Pressure'][-1]
         air_speed = self.flow_velocity(pressure)
-        self.data['Air speed'].append(air_speed)
+        self.data.append((pressure/100., air_speed))
+
+    def flow_velocity_batch(self, pressure):
+        rho = 1.2754 #  kg/m^3, IUPAC  0°C 100kPa
+        u = np.zeros(len(pressure))
+        valid = pressure > 0
+        u[valid] = np.sqrt(2*(pressure[valid])/rho)
+        return u
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
+        air_speed = self.flow_velocity_batch(columns['Pressure'])
+        self.data.extend({'Pressure hPa': columns['Pressure']/100., 'Air speed': air_speed})
 
 
 class GPS(GenericSensor):
@@ -715,26 +884,31 @@ class GPS(GenericSensor):
         'Fix_Validity': {
             'start': 32,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: x & 1,
+            'type': 'bitfield',
+            'bit': 0,
             'byte_order': 'little',
-            'signed': True,
+            'signed': False,
+            'dtype': 'int8',
         },
         'Fix_Quality': {
             'start': 32,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 0x06) >> 1,
+            'type': 'bitfield',
+            'bit': 1,
+            'nb_bits': 2,
             'byte_order': 'little',
-            'signed': True,
+            'signed': False,
+            'dtype': 'int8',
         },
         'Fix_Status': {
             'start': 32,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 0x18) >> 3,
+            'type': 'bitfield',
+            'bit': 3,
+            'nb_bits': 2,
             'byte_order': 'big',
-            'signed': True,
+            'signed': False,
+            'dtype': 'int8',
         },
     }
     sample_size = 33
@@ -745,23 +919,44 @@ class GPS(GenericSensor):
         self.reset()
 
     def reset(self):
-        self.data = {field: [0] for field in self.fields.keys()}
-        self.data['Distance'] = [0]
-        self.data['Bearing'] = [0]
-        self.data['Bearing_rad'] = [0]
+        columns = {field: spec.get('dtype', 'float64') for field, spec in self.fields.items()}
+        columns.update({'Distance': 'float64', 'Bearing': 'float64', 'Bearing_rad': 'float64'})
+        self.data = History(columns, self.capacity)
+        # Start with zeros so that the latest values can always be displayed
+        self.data.append([0]*len(columns))
         self.reference_coord = None
         self.set_default_values()
         self.is_graph_init = False
     
     def set_reference(self):
-        if len(self.data['Latitude']) > 1 and len(self.data['Longitude']) > 1:
-            self.reference_coord = (self.data['Latitude'][-1], self.data['Longitude'][-1])
-            print('GPS reference set')
+        # The positions are decoded in another thread: they are not appended meanwhile
+        with self.data.lock:
+            if len(self.data['Latitude']) > 1 and len(self.data['Longitude']) > 1:
+                self.reference_coord = (self.data['Latitude'][-1], self.data['Longitude'][-1])
+                self.update_distances()
+                print('GPS reference set')
+
+    def update_distances(self):
+        """ Compute again the distance and bearing of all the positions in memory
+
+        Used when the reference coordinates change. No position is appended meanwhile
+
+        """
+        with self.data.lock:
+            current_coord = (self.data['Latitude'], self.data['Longitude'])
+            bearing = self.bearing(self.reference_coord, current_coord)
+
+            # The first row is only a placeholder, as long as it is in memory
+            first = 1 if self.data.total == len(self.data) else 0
+            self.data['Distance'][first:] = self.distance_haversine(self.reference_coord, current_coord)[first:]
+            self.data['Bearing'][first:] = bearing[first:]
+            self.data['Bearing_rad'][first:] = np.radians(bearing[first:])
     
     def distance_haversine(self, coord1, coord2):
         """ Compute the distance between two GPS points
 
-        Coordinates must be in decimal degrees format
+        Coordinates must be in decimal degrees format. They can also be numpy
+        arrays to compute many distances at once
 
         Parameters
         ----------
@@ -772,7 +967,7 @@ class GPS(GenericSensor):
 
         Returns
         -------
-        d : float
+        d : float or numpy array
             distance between the two points
 
         """
@@ -780,15 +975,15 @@ class GPS(GenericSensor):
         lat1, lon1 = coord1
         lat2, lon2 = coord2
         
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2) 
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
+        phi1 = np.radians(lat1)
+        phi2 = np.radians(lat2) 
+        dphi = np.radians(lat2 - lat1)
+        dlambda = np.radians(lon2 - lon1)
         
-        a = math.sin(dphi/2)**2 + \
-            math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+        a = np.sin(dphi/2)**2 + \
+            np.cos(phi1)*np.cos(phi2)*np.sin(dlambda/2)**2
 
-        c = 2*math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        c = 2*np.arctan2(np.sqrt(a), np.sqrt(1 - a))
 
         d = R*c
         
@@ -807,111 +1002,178 @@ class GPS(GenericSensor):
             Latitude and longitude must be in decimal degrees
         coord2: (float, float) 
             tuple representing the latitude/longitude for the second point
-            Latitude and longitude must be in decimal degrees
+            Latitude and longitude must be in decimal degrees. They can also be
+            numpy arrays to compute many bearings at once
         
         Returns
         -------
-        compass_bearing : float
+        compass_bearing : float or numpy array
             bearing in degrees
 
         """
         lat1, lon1 = coord1
         lat2, lon2 = coord2
 
-        lat1 = math.radians(lat1)
-        lat2 = math.radians(lat2)
+        lat1 = np.radians(lat1)
+        lat2 = np.radians(lat2)
 
-        diffLong = math.radians(lon2 - lon1)
+        diffLong = np.radians(lon2 - lon1)
 
-        x = math.sin(diffLong) * math.cos(lat2)
-        y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1)
-                * math.cos(lat2) * math.cos(diffLong))
+        x = np.sin(diffLong) * np.cos(lat2)
+        y = np.cos(lat1) * np.sin(lat2) - (np.sin(lat1)
+                * np.cos(lat2) * np.cos(diffLong))
 
-        initial_bearing = math.atan2(x, y)
+        initial_bearing = np.arctan2(x, y)
 
-        # Now we have the initial bearing but math.atan2 return values
+        # Now we have the initial bearing but np.arctan2 return values
         # from -180° to + 180° which is not what we want for a compass bearing
         # The solution is to normalize the initial bearing as shown below
-        initial_bearing = math.degrees(initial_bearing)
+        initial_bearing = np.degrees(initial_bearing)
         compass_bearing = (initial_bearing + 360) % 360
 
         return compass_bearing
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
 
-        for field in self.fields.keys():
-            self.data[field].append(self.raw_data[field][-1])
+        row = {field: self.raw_data[field][-1] for field in self.fields.keys()}
         
-        lat = self.data['Latitude'][-1]
+        lat = row['Latitude']
         try:
-            self.data['Latitude'][-1] = (lat-int(lat/100.)*100)/60. + int(lat/100.) # Decimal degrees
+            row['Latitude'] = (lat-int(lat/100.)*100)/60. + int(lat/100.) # Decimal degrees
         except:
-            self.data['Latitude'][-1] = float('nan')
+            row['Latitude'] = float('nan')
         
-        lon = self.data['Longitude'][-1]
+        lon = row['Longitude']
         try:
-            self.data['Longitude'][-1] = (lon-int(lon/100.)*100)/60. + int(lon/100.) # Decimal degrees
+            row['Longitude'] = (lon-int(lon/100.)*100)/60. + int(lon/100.) # Decimal degrees
         except:
-            self.data['Latitude'][-1] = float('nan')
+            row['Longitude'] = float('nan')
+
+        # The reference does not change until the position is appended, see set_reference()
+        with self.data.lock:
+            # Just add 0 if the reference coordinates are not set
+            if self.reference_coord is None:
+                row['Distance'] = 0
+                row['Bearing'] = 0
+                row['Bearing_rad'] = 0
+            else:
+                current_coord = (row['Latitude'], row['Longitude'])
 
-        # Just add 0 if the reference coordinates are not set
-        if self.reference_coord is None:
-            self.data['Distance'].append(0)
-            self.data['Bearing'].append(0)
-            self.data['Bearing_rad'].append(0)
-        else:
-            current_coord = (self.data['Latitude'][-1], self.data['Longitude'][-1])
+                distance = self.distance_haversine(self.reference_coord, current_coord)
+                bearing = self.bearing(self.reference_coord, current_coord)
 
-            distance = self.distance_haversine(self.reference_coord, current_coord)
-            bearing = self.bearing(self.reference_coord, current_coord)
-            
-            self.data['Distance'].append(distance)
-            self.data['Bearing'].append(bearing)
-            # Used in the polar plot
-            self.data['Bearing_rad'].append(math.radians(bearing))
+                row['Distance'] = distance
+                row['Bearing'] = bearing
+                # Used in the polar plot
+                row['Bearing_rad'] = math.radians(bearing)
+
+            self.data.append([row[column] for column in self.data.columns])
+
+    def decimal_degrees(self, value):
+        """ Convert coordinates from DDMM.MMMM to decimal degrees
+
+        Parameters
+        ----------
+        value : numpy array
+            coordinates as sent by the GPS receiver
+
+        Returns
+        -------
+        numpy array
+            coordinates in decimal degrees
+
+        """
+        with np.errstate(invalid='ignore'):
+            degrees = np.trunc(value/100.)
+            return (value - degrees*100)/60. + degrees
+
+    def update_data_batch(self, columns, frame_times=None):
+        self.update_raw_data_batch(columns, frame_times)
+
+        columns = dict(columns)
+        columns['Latitude'] = self.decimal_degrees(columns['Latitude'])
+        columns['Longitude'] = self.decimal_degrees(columns['Longitude'])
+
+        # The reference does not change until the positions are appended, see set_reference()
+        with self.data.lock:
+            # Just add 0 if the reference coordinates are not set
+            if self.reference_coord is None:
+                zeros = np.zeros(len(columns['Latitude']))
+                columns['Distance'] = zeros
+                columns['Bearing'] = zeros
+                columns['Bearing_rad'] = zeros
+            else:
+                current_coord = (columns['Latitude'], columns['Longitude'])
+
+                distance = self.distance_haversine(self.reference_coord, current_coord)
+                bearing = self.bearing(self.reference_coord, current_coord)
+
+                columns['Distance'] = distance
+                columns['Bearing'] = bearing
+                # Used in the polar plot
+                columns['Bearing_rad'] = np.radians(bearing)
+
+            self.data.extend(columns)
 
 
 class Sigmundr:
     """ Extract data from a Telemetry frame received from Sigmundr
 
+    Parameters
+    ----------
+    capacity: int
+        (optional) number of samples kept in memory for each sensor. None to keep all
+    spill_dir: path-like object
+        (optional) directory where the samples evicted from memory are saved
+
     """
 
-    def __init__(self):
-        self.status = Status(1)
-        self.errmsg = ErrMsg(3)
-        self.rtc = RTC(4, is_rtc=True)
-        self.timer = Timer(8)
-        self.batteries = Batteries(12)
-        self.imu2 = ICM20602(16)
-        self.bmp2 = BMP280(72)
-        self.bmp3 = BMP280(80)
-        self.mag = LIS3MDLTR(88)
-        self.pitot = ABP(92)
-        self.gps = GPS(100)
+    def __init__(self, capacity=DEFAULT_CAPACITY, spill_dir=None):
+        # Create the folder to store the evicted samples if it does not already exist
+        if spill_dir and not isdir(spill_dir):
+            mkdir(spill_dir)
+
+        def history(name):
+            spill_path = join(spill_dir, name) if spill_dir else None
+            return {'capacity': capacity, 'spill_path': spill_path}
+
+        self.status = Status(1, **history('status'))
+        self.errmsg = ErrMsg(3, **history('errmsg'))
+        self.rtc = RTC(4, is_rtc=True, **history('rtc'))
+        self.timer = Timer(8, **history('timer'))
+        self.batteries = Batteries(12, **history('batteries'))
+        # 4 samples per frame, the frames are sent every 5/256 s
+        self.imu2 = ICM20602(16, nb_samples=4, sample_rate=4*256/5., **history('imu2'))
+        self.bmp2 = BMP280(72, **history('bmp2'))
+        self.bmp3 = BMP280(80, **history('bmp3'))
+        self.mag = LIS3MDLTR(88, **history('mag'))
+        self.pitot = ABP(92, **history('pitot'))
+        self.gps = GPS(100, **history('gps'))
+
+        # Decoders of the frames, the RTC time stamps the other sensors
+        self.frames = FrameRegistry(self, 'Sigmundr')
 
         self.time_interval = 30 #s
         self.update_plot = True
 
     def update_sensors(self, frame):
-        if len(frame) > 0:
-            if frame[0] == 0x01 or frame[0] == 0x02:
-                if len(frame) == 96 or len(frame) == 136:
-                    self.rtc.update_data(frame)
-                    frame_time = self.rtc.data['Time']
-                    self.errmsg.update_data(frame, frame_time)
-                    self.status.update_data(frame, frame_time)
-                    self.timer.update_data(frame, frame_time)
-                    self.batteries.update_data(frame, frame_time)
-                    self.imu2.update_data(frame, frame_time)
-                    self.bmp2.update_data(frame, frame_time)
-                    self.bmp3.update_data(frame, frame_time)
-                    self.mag.update_data(frame, frame_time)
-                    self.pitot.update_data(frame, frame_time)
-
-            if frame[0] == 0x02:
-                if len(frame) == 136:
-                    self.gps.update_data(frame, frame_time)
+        self.frames.update_sensors(frame)
+
+    def update_sensors_batch(self, frames):
+        """ Update the sensors with many frames at once
+
+        Gives the same result as calling update_sensors() on each frame, but the
+        frames are decoded in vectorized passes, see FrameRegistry
+
+        Parameters
+        ----------
+        frames: list
+            bytes-like frames (eg. memoryviews) in the order they were received.
+            Invalid frames are ignored
+
+        """
+        self.frames.update_sensors_batch(frames)
     
     def reset(self):
         self.errmsg.reset()
@@ -942,34 +1204,38 @@ class LaunchpadStatus(GenericSensor):
         'IS_OUTPUT1_EN': {
             'start': 0,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<1) >> 1,
+            'type': 'bitfield',
+            'bit': 1,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'IS_OUTPUT2_EN': {
             'start': 0,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<2) >> 2,
+            'type': 'bitfield',
+            'bit': 2,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'IS_OUTPUT3_EN': {
             'start': 0,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<3) >> 3,
+            'type': 'bitfield',
+            'bit': 3,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'IS_OUTPUT4_EN': {
             'start': 0,
             'size': 1,  # Byte
-            'type': 'int',
-            'conversion_function': lambda x: (x & 1<<4) >> 4,
+            'type': 'bitfield',
+            'bit': 4,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'int8',
         },
         'SERVO1_ANGLE': {
             'start': 1,
@@ -978,6 +1244,7 @@ class LaunchpadStatus(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
         'SERVO2_ANGLE': {
             'start': 2,
@@ -986,6 +1253,7 @@ class LaunchpadStatus(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
         'SERVO3_ANGLE': {
             'start': 3,
@@ -994,6 +1262,7 @@ class LaunchpadStatus(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': False,
+            'dtype': 'uint8',
         },
     }
     sample_size = 4
@@ -1008,8 +1277,8 @@ class LaunchpadStatus(GenericSensor):
         self.data['IS_TM_ENABLED'] = 1
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
         for field in self.fields.keys():
             self.data[field] = self.raw_data[field][-1]
 
@@ -1023,6 +1292,7 @@ class RSSI(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'int8',
         },
         'LOCAL_RSSI': {
             'start': 1,
@@ -1031,6 +1301,7 @@ class RSSI(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'int8',
         },
     }
     sample_size = 2
@@ -1044,8 +1315,8 @@ class RSSI(GenericSensor):
         self.data = {field: 0 for field in self.fields.keys()}
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
         for field in self.fields.keys():
             self.data[field] = self.raw_data[field][-1]
 
@@ -1059,6 +1330,7 @@ class Battery(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'int16',
         },
         'BAT2_RAW': {
             'start': 2,
@@ -1067,6 +1339,7 @@ class Battery(GenericSensor):
             'conversion_function': lambda x: x,
             'byte_order': 'big',
             'signed': True,
+            'dtype': 'int16',
         },
     }
     sample_size = 4
@@ -1082,30 +1355,38 @@ class Battery(GenericSensor):
         self.data['BAT2_VOLTAGE'] = 0
         self.set_default_values()
 
-    def update_data(self, frame, frame_time=None):
-        self.update_raw_data(frame, frame_time)
+    def update_data(self, frame, frame_time=None, samples=None):
+        self.update_raw_data(frame, frame_time, samples)
         for field in self.fields.keys():
             self.data[field] = self.raw_data[field][-1]
-        bat1_raw = self.data['BAT1_RAW']
+        bat1_raw = float(self.data['BAT1_RAW'])
         self.data['BAT1_VOLTAGE'] = 2.555e-5 * bat1_raw ** 2 - 0.0835 * bat1_raw + 81.83 # Hardcoded calibration Updated: 20/9-2020
-        bat2_raw = self.data['BAT2_RAW']
+        bat2_raw = float(self.data['BAT2_RAW'])
         self.data['BAT2_VOLTAGE'] = 8.885e-6 * bat2_raw ** 2 - 0.0316 * bat2_raw + 34.780# Hardcoded calibration Updated: 20/9-2020
 
 
 class LaunchpadControl:
-    def __init__(self):
+    def __init__(self, clock=SYSTEM_CLOCK):
         self.status = LaunchpadStatus(0)
         self.battery = Battery(4)
         self.rssi = RSSI(8)
+
+        # The frames have no RTC, they are stamped with the clock, see utils.clock
+        self.clock = clock
+        self.timeline = Timeline()
+        self.frames = FrameRegistry(self, 'LaunchpadControl')
     
     def update_sensors(self, frame):
-        if len(frame) == 10:
-            time = datetime.datetime.now().time()
-            self.status.update_data(frame, frame_time=time)
-            self.battery.update_data(frame, frame_time=time)
-            self.rssi.update_data(frame, frame_time=time)
+        if self.frames.lookup(frame) is not None:
+            self.frames.update_sensors(frame, self.timeline.now(self.clock))
+
+    def update_sensors_batch(self, frames):
+        # Launchpad frames are short and rare, no need for vectorized decoding
+        for frame in frames:
+            self.update_sensors(frame)
     
     def reset(self):
         self.status.reset()
         self.battery.reset()
         self.rssi.reset()
+        self.timeline.reset()
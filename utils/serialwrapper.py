@@ -3,13 +3,26 @@ Class to read and write data from and to a serial connection
 
 """
 
-import datetime
+import concurrent.futures
 import os
+import select
+import threading
 import time
 
 import serial
 import serial.tools.list_ports
 
+from utils.clock import SYSTEM_CLOCK
+from utils.devicecache import DeviceCache
+from utils.framing import LineFramer, split_lines
+from utils.logindex import LogIndex
+from utils.sessionlog import SessionLog, is_session_log
+from utils.replay import ReplayScheduler
+
+
+READ_SIZE = 2048  # Maximum number of bytes read from the serial link at once
+VERIFY_TIMEOUT = 0.5  # Time to wait for a frame on the device used last time in seconds
+
 
 class SerialWrapper:
     """ Class to read and write data through a serial connection
@@ -23,7 +36,11 @@ class SerialWrapper:
     If `port` is provided, the serial connection will be opened on port `port`
 
     If `filepath` is provided, the data will be read from the file. `sensors` must
-    be given to read data from a file
+    be given to read data from a file. The file is memory mapped and indexed, see
+    utils.logindex, its frames are replayed at the pace at which they were received
+    or faster, see `replay`. Session logs (see utils.sessionlog) are replayed from
+    the receive times of their frames. Block compressed logs (see utils.blockfile) are
+    decompressed block by block, as they are replayed
 
     The priority order for optional parameters is `bonjour` > `rfd900` > `port` > `filepath`
     If more than one of them is given, the one with the highest priority will be used
@@ -43,7 +60,29 @@ class SerialWrapper:
     filepath : string, optional
         path to the file to read
     sensors : Sensors() instance, optional
-        Sensors() instance to compute the time stamps from the file
+        Sensors() instance whose frames are read from the file. The frames of the
+        file are not decoded when it is loaded
+    framer : LineFramer or CobsFramer instance, optional
+        extracts the frames from the received bytes, see utils.framing. By default
+        the received bytes are split on b'\r\n', and the frames that are cut by a
+        b'\r\n' in their payload are joined back when `sensors` is given
+    event_driven : bool, optional
+        True to wait for the data with poll() on the file descriptor of the port, and
+        read all the received bytes as soon as they arrive. Only available on Linux
+        and other POSIX systems, the reads wait for the timeout otherwise
+    max_wakeups : float, optional
+        maximum number of times per second the reading thread wakes up to read the
+        data in event driven mode. The bytes received in between are read at once
+    device_cache : path-like object, optional
+        path to the file remembering the device on which the Gateway was found, see
+        utils.devicecache. In `bonjour` and `rfd900` modes, this device is tried first
+        and the other devices are probed only if it is not the Gateway anymore
+    replay_rate : float, optional
+        replay speed of the file, see utils.replay. 1 to replay the frames at the pace at
+        which they were received, FASTEST to replay them as fast as they are read
+    clock : SystemClock or SimulatedClock instance, optional
+        clock timing the replay of the file, see utils.clock. The reads from the
+        serial devices always use the computer's clock
 
     Attributes
     ----------
@@ -53,6 +92,12 @@ class SerialWrapper:
         String with the content of the last error
     is_ready : bool
         True if the device is ready to use (ie boot have been completed)
+    replay : ReplayScheduler instance
+        controls the replay of the file in FILE mode once opened (rate, pause, seek),
+        None otherwise
+    on_rewind : callable or None
+        called by the reads of the file before the frames replayed again after a
+        backward seek, see utils.replay. Set by the Gateway to clear its sensors
 
     Examples
     --------
@@ -73,7 +118,9 @@ class SerialWrapper:
     # Use lower case
     serial_desc_substrings = ("usb", "ch340", "arduino")
 
-    def __init__(self, baudrate, name, bonjour="", rfd900=False, port="", filepath="", sensors=None):
+    def __init__(self, baudrate, name, bonjour="", rfd900=False, port="", filepath="", sensors=None,
+                 framer=None, event_driven=False, max_wakeups=200,
+                 device_cache="", replay_rate=1., clock=SYSTEM_CLOCK):
         self.name = name
 
         self.failed = False
@@ -101,12 +148,35 @@ class SerialWrapper:
         self.ser = serial.Serial()
         self.ser.baudrate = baudrate
         self.ser.timeout = 0.1
-        self.buffer = bytearray()
+
+        if framer is None:
+            if sensors is not None:
+                framer = LineFramer(is_valid=sensors.frames.is_valid, max_length=sensors.frames.max_length)
+            else:
+                framer = LineFramer()
+        self.framer = framer
+
+        if event_driven and not hasattr(select, 'poll'):
+            print("{} : event driven reading is not available on this system".format(self.name))
+            event_driven = False
+        self.event_driven = event_driven
+        self.wakeup_period = 1/max_wakeups
+        self.last_wakeup = 0
+        # select.poll object watching the port, when it is open in event driven mode
+        self.poller = None
+        # threading.Event set to stop the current search of the Gateway
+        self.discovery = None
+        self.discovery_cancelled = False
+        self.device_cache = DeviceCache(device_cache) if device_cache else None
 
         self.time_start_computer = 0
         self.time_start_obc = 0
-        self.lines_from_file = []
-        self.current_index = 0
+        # LogIndex of the file in FILE mode, once loaded
+        self.log = None
+        self.replay = None
+        self.replay_rate = replay_rate
+        self.on_rewind = None
+        self.clock = clock
 
         self.is_device_found = False
 
@@ -146,14 +216,8 @@ class SerialWrapper:
             True if the device is found
 
         """
-        # Change the timeout value to 2 seconds and save the old value
-        # The timeout should be long enough to that the Gateway device can reset and send BONJOUR before the reading ends
-        timeout = self.ser.timeout
-        self.ser.timeout = 2
         self.ser.port = None
 
-        found_device = False
-
         print("{} : Searching for available serial devices...".format(self.name))
 
         # Check only devices that are expected to be Arduinos or alike
@@ -170,51 +234,49 @@ class SerialWrapper:
 
         if self.mode == "RFD900":
             print("Searching for a RFD900 modem")
-            # Insert logic to identify RFD900 module here
-            for d in safe_devices:
-                self.ser.port = d.device
-                print("Testing : {}...".format(self.ser.port))
-
-                if self.__open_serial_port():  # If the connection cannot be oppened, no need to read from it
-                    # Dirty but the RFD900 needs 1s with no data input before the "+++" to enter AT command mode
-                    # In practice the port is unused before we open it so this pause is not really needed
-                    # But just to be sure...
-                    time.sleep(1)
-                    # Try to enter AT command mode
-                    self.write('+++', encode=True)
-                    # Wait one second and see the "OK" has been sent by the device
-                    time.sleep(1)
-                    lines = self.readlines()
-                    # Exit AT command mode
-                    self.write('ATO\r', encode=True)
-
-                    if b'OK' in lines:
-                        found_device = True
-                        break
-
-                    else:
-                        self.close_serial()
-
         elif self.mode == "BONJOUR":
             print("Searching for a Gateway using the bonjour string : {}".format(
                 self.bonjour))
 
-            for d in safe_devices:
-                self.ser.port = d.device
-                print("Testing : {}...".format(self.ser.port))
-
-                if self.__open_serial_port():  # If the connection cannot be oppened, no need to read from it
-                    self.write('&gB0', encode=True)
-                    line = self.readline(decode=True)
-
-                    if line == self.bonjour:
-                        found_device = True
-                        break
-
+        self.discovery = cancel = threading.Event()
+        self.discovery_cancelled = False
+        found = None
+
+        # The device used last time is tried first
+        if self.device_cache is not None:
+            device = self.device_cache.find(self.name, safe_devices)
+            if device is not None:
+                print("{} : Trying the last device used : {}".format(self.name, device.device))
+                found = self.__verify_device(device.device, cancel)
+                if found is None:
+                    print("{} : The Gateway is not on {} anymore".format(self.name, device.device))
+
+        # All the devices are probed at the same time. The first one to answer is kept
+        # and the other probes are cancelled
+        if found is None and not self.discovery_cancelled:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(safe_devices)) as executor:
+                probes = [executor.submit(self.__probe_device, d.device, cancel) for d in safe_devices]
+                for probe in concurrent.futures.as_completed(probes):
+                    ser = probe.result()
+                    if ser is None:
+                        continue
+                    if found is None and not self.discovery_cancelled:
+                        found = ser
+                        cancel.set()
                     else:
-                        self.close_serial()
+                        ser.close()
+
+        found_device = found is not None
+        if found_device:
+            # The port opened by the probe is kept, the Gateway is not reset again
+            found.timeout = self.ser.timeout
+            self.ser = found
+            found_device = self.__open_serial_port()
 
-        self.ser.timeout = timeout  # Restore the previous value
+        if found_device and self.device_cache is not None:
+            for device in safe_devices:
+                if device.device == self.ser.port:
+                    self.device_cache.store(self.name, device)
 
         if found_device:
             self.__safe_mode()
@@ -235,6 +297,160 @@ class SerialWrapper:
             
             return False
 
+    def __probe_device(self, device, cancel):
+        """ Check if the Gateway is connected to a serial device
+
+        Run in a thread for each device by __auto_find_gateway()
+
+        Parameters
+        ----------
+        device : str
+            port of the serial device
+        cancel : threading.Event
+            set to stop the probe, when the Gateway has been found on another device
+
+        Returns
+        -------
+        ser : serial.Serial instance
+            the opened port if the Gateway answered, None otherwise
+
+        """
+        print("Testing : {}...".format(device))
+
+        ser = serial.Serial()
+        ser.port = device
+        ser.baudrate = self.ser.baudrate
+        # Short reads, to check `cancel` often
+        ser.timeout = 0.1
+
+        found = False
+        try:
+            ser.open()
+            ser.reset_input_buffer()
+
+            if self.mode == "RFD900":
+                # Dirty but the RFD900 needs 1s with no data input before the "+++" to enter AT command mode
+                # In practice the port is unused before we open it so this pause is not really needed
+                # But just to be sure...
+                if not cancel.wait(1):
+                    # Try to enter AT command mode, the device should answer "OK" within one second
+                    # The answer is not a frame, it does not go through the framer
+                    ser.write(b'+++')
+                    found = self.__wait_answer(ser, cancel, 1, lambda lines: b'OK' in lines)
+                    # Exit AT command mode
+                    ser.write(b'ATO\r')
+
+            elif self.mode == "BONJOUR":
+                # The timeout should be long enough to that the Gateway device can reset and send BONJOUR
+                ser.write(b'&gB0')
+                bonjour = self.bonjour.encode('utf-8')
+                found = self.__wait_answer(ser, cancel, 2, lambda lines: bonjour in lines)
+
+        # The device cannot be opened or has been disconnected, no need to read from it
+        except (serial.SerialException, OSError) as e:
+            print("{} : {}".format(device, e))
+
+        if found:
+            return ser
+
+        ser.close()
+        return None
+
+    def __verify_device(self, device, cancel):
+        """ Check quickly if the Gateway is still connected to the device used last time
+
+        The device has already been matched on its USB identity, see utils.devicecache.
+        A RFD900 modem is accepted if it receives a valid frame (see `sensors`) within
+        VERIFY_TIMEOUT, the AT command handshake, which takes 2 seconds, is skipped. It
+        is still run when no frame is received. A Gateway must answer the bonjour request
+
+        Parameters
+        ----------
+        device : str
+            port of the serial device
+        cancel : threading.Event
+            set to stop the verification
+
+        Returns
+        -------
+        ser : serial.Serial instance
+            the opened port if the Gateway is connected, None otherwise
+
+        """
+        if self.mode == "BONJOUR" or self.sensors is None:
+            return self.__probe_device(device, cancel)
+
+        ser = serial.Serial()
+        ser.port = device
+        ser.baudrate = self.ser.baudrate
+        # Short reads, to check `cancel` often
+        ser.timeout = 0.1
+
+        found = False
+        try:
+            ser.open()
+            ser.reset_input_buffer()
+            # The bytes of the frame cut by the opening are dropped by the framer
+            frames = self.sensors.frames
+            framer = LineFramer(is_valid=frames.is_valid, max_length=frames.max_length)
+            deadline = time.monotonic() + VERIFY_TIMEOUT
+            while not found and not cancel.is_set() and time.monotonic() < deadline:
+                found = bool(framer.feed(ser.read(max(1, ser.in_waiting))))
+        except (serial.SerialException, OSError) as e:
+            print("{} : {}".format(device, e))
+            ser.close()
+            return None
+
+        if found:
+            return ser
+
+        # The telemetry may not be sent yet, the modem itself is checked
+        ser.close()
+        return self.__probe_device(device, cancel)
+
+    @staticmethod
+    def __wait_answer(ser, cancel, timeout, is_answer):
+        """ Read the lines sent by a device until the expected answer is received
+
+        Parameters
+        ----------
+        ser : serial.Serial instance
+            opened port, with a short timeout
+        cancel : threading.Event
+            set to stop waiting
+        timeout : float
+            maximum time to wait for the answer in seconds
+        is_answer : function
+            is_answer(lines) returns True if the answer is in the list of lines
+
+        Returns
+        -------
+        bool
+            True if the answer has been received
+
+        """
+        buffer = b''
+        deadline = time.monotonic() + timeout
+
+        while not cancel.is_set() and time.monotonic() < deadline:
+            buffer += ser.read(max(1, ser.in_waiting))
+            lines, rest = split_lines(buffer)
+            if is_answer(lines):
+                return True
+
+        return False
+
+    def cancel_discovery(self):
+        """ Stop the search of the Gateway among the serial devices, see open_link()
+
+        Can be called from any thread. open_link() then fails
+
+        """
+        self.discovery_cancelled = True
+        discovery = self.discovery
+        if discovery is not None:
+            discovery.set()
+
     def __fail_mode(self, error):
         """ Set the right value to Instance attributes in case a fatal error occured
 
@@ -249,29 +465,43 @@ class SerialWrapper:
         self.failed = True
         self.is_ready = False
 
-    def __read_serial_buffer(self):
+    def __read_serial_buffer(self, wait=True):
         """ Read the last received bytes from the serial buffer
 
+        Parameters
+        ----------
+        wait : bool
+            False to read only the bytes already received, without waiting for more
+
         Returns
         -------
         error_code : int
             0 if no error occured
         error_msg : string
             python string describing the error if one occured
-        buffer : bytearray
+        buffer : bytes
             bytes read from the serial buffer
 
         """
         error_code = 0
         error_msg = ""
-        buffer = bytearray()
+        buffer = b''
 
-        # Get the number of bytes in the buffer
-        i = max(1, min(2048, self.ser.in_waiting))
+        # The port may be closed by another thread meanwhile
+        poller = self.poller
 
-        # Read the buffer
         try:
-            buffer = self.ser.read(i)
+            if poller is not None and wait:
+                if not self.__wait_serial_data(poller):
+                    return error_code, error_msg, buffer
+            if wait:
+                # Read the buffer, at least 1 byte to wait for the data until the timeout
+                buffer = self.ser.read(max(1, min(READ_SIZE, self.ser.in_waiting)))
+            else:
+                # The read never blocks, eg. the event loop on a spurious readable event
+                size = min(READ_SIZE, self.ser.in_waiting)
+                if size:
+                    buffer = self.ser.read(size)
         # This mostly means that the device is disconnected
         except serial.SerialException as e:
             error_code = 1
@@ -288,60 +518,96 @@ class SerialWrapper:
 
         return error_code, error_msg, buffer
 
-    def __read_file_buffer(self):
-        """ Read lines in "real time" from file
+    def __wait_serial_data(self, poller):
+        """ Wait for data on the serial port in event driven mode
 
-        Lines are returned only when their time stamp is equal (roughly) to the time delay since
-        the reading has started
+        The wake ups are spaced by `wakeup_period` at least: when data arrives sooner,
+        it is left in the serial buffer and read with the data received meanwhile
+
+        Parameters
+        ----------
+        poller : select.poll
+            poll object watching the port
 
         Returns
         -------
-        buffer : bytearray
-            all the relevant lines in a bytearray
+        bool
+            True if data can be read, False if the timeout expired first
+
+        Raises
+        ------
+        serial.SerialException
+            if the device is disconnected
+        TypeError
+            if the port has been closed by another thread
 
         """
-        time.sleep(0.1) # This reduces the CPU load
+        delay = self.last_wakeup + self.wakeup_period - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
-        if(self.current_index < len(self.lines_from_file)):
-            now = datetime.datetime.now()
-            delta = now - self.time_start_computer
-            
-            count = 0
-            # Time stamps are previously computed using a dummy Sensors() instance
-            for i, e in enumerate(self.sensors.imu2.raw_data['Seconds_since_start'][self.current_index:]):
-                if e < delta.total_seconds():
-                    count += 1
-                else:
-                    break
-            
-            lines = self.lines_from_file[self.current_index:self.current_index+count]
-            self.current_index += count
+        events = poller.poll(self.ser.timeout*1000)
+        self.last_wakeup = time.monotonic()
+
+        for fd, event in events:
+            if event & select.POLLNVAL:
+                # The file descriptor has been closed
+                raise TypeError("Port closed")
+            if event & (select.POLLERR | select.POLLHUP) and not event & select.POLLIN:
+                raise serial.SerialException("Device disconnected")
+
+        return bool(events)
+
+    def __read_file_buffer(self, wait=True):
+        """ Read the frames of the file that are due since the last read, see `replay`
+
+        Parameters
+        ----------
+        wait : bool
+            False to return the frames without waiting first
+
+        Returns
+        -------
+        frames : [memoryview, ]
+            the frames that are due, as views of the file
+
+        """
+        if wait and self.replay.throttled:
+            self.clock.sleep(0.1) # This reduces the CPU load
+
+        if not self.replay.finished:
+            # The frames are found by bisection in the time stamps of the index
+            start, stop = self.replay.due()
+            frames = self.log.frames(start, stop)
 
             error_code = 0
             error_msg = ""
-            buffer = b'\r\n' + b'\r\n'.join(lines)
-        
+
         else:
             error_code = 4
             error_msg = "End of file"
-            buffer = b''
-        
-        return error_code, error_msg, buffer
+            frames = []
 
-    def __read_file_line(self):
-        """ Read the next line in the file
+        return error_code, error_msg, frames
+
+    def __rewind(self):
+        """ Called by the replay before the frames are replayed again after a seek """
+        if self.on_rewind is not None:
+            self.on_rewind()
 
-        Lines are separated by b'\r\n'
+    def __read_file_line(self):
+        """ Read the next frame in the file
 
         Returns
         -------
-        line : bytearray
-            line from the file as bytes
+        line : memoryview
+            frame from the file, as a view of the file
 
         """
-        if self.current_index < len(self.lines_from_file):
-            line = self.lines_from_file[self.current_index]
-            self.current_index += 1
+        if not self.replay.finished:
+            # Lines are read one by one, regardless of their time stamps
+            line = self.log.frame(self.replay.index)
+            self.replay.index += 1
             error_code = 0
             error_msg = ""
         else:
@@ -409,11 +675,16 @@ class SerialWrapper:
         """
         error_msg = ""
         try:
-            self.ser.open()
+            # The port is already open when found by __auto_find_gateway()
+            if not self.ser.is_open:
+                self.ser.open()
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
             self.failed = False
-            self.buffer = bytearray()
+            self.framer.reset()
+            if self.event_driven:
+                self.poller = select.poll()
+                self.poller.register(self.ser.fileno(), select.POLLIN)
             self.__safe_mode()
             if self.mode == "RFD900":
                 self.is_ready = True
@@ -438,7 +709,7 @@ class SerialWrapper:
                 return False
     
     def __load_file(self):
-        """ Read Telemetry data from a file and store each line in memory
+        """ Map the Telemetry file in memory and index its frames
 
         Returns
         -------
@@ -449,15 +720,22 @@ class SerialWrapper:
         error_msg = ""
 
         try:
-            with open(self.filepath, 'rb') as file:
-                file_buffer = file.read()
-            lines = file_buffer.split(b'\r\n')
-            # Remove incomplete lines
-            self.lines_from_file = [l for l in lines if len(l) == 96 or len(l) == 136]  # /!\ Hardcoded lengths for Sigmundr /!\
-            # Feed the Sensors() instance with all lines to compute the time stamps
-            for line in self.lines_from_file:
-                self.sensors.update_sensors(line)
-        
+            if self.log is not None:
+                self.log.close()
+            if is_session_log(self.filepath):
+                # The frames are delimited and time stamped by their records
+                self.log = SessionLog(self.filepath, scan=True)
+            else:
+                # The index is saved next to the file, the file is scanned once only
+                self.log = LogIndex(self.filepath, self.sensors.frames)
+            # The replay starts now, at the speed chosen last if the file is opened again
+            if self.replay is not None:
+                self.replay_rate = self.replay.rate
+            self.replay = ReplayScheduler(self.log.times, self.replay_rate, clock=self.clock,
+                                          on_rewind=self.__rewind)
+            if self.log.dropped:
+                print("{} : {} bytes dropped from the file".format(self.name, self.log.dropped))
+
         except Exception as e:
             error_msg = "{} : {}".format(
                 self.bonjour, e)
@@ -503,7 +781,7 @@ class SerialWrapper:
                 success = self.__load_file()
                 if success:
                     self.is_ready = True
-                    self.time_start_computer = datetime.datetime.now()
+                    self.time_start_computer = self.clock.now()
 
             return success
 
@@ -511,6 +789,8 @@ class SerialWrapper:
         """ Close the serial connection
 
         """
+        self.poller = None
+
         if self.ser.port:
             if self.ser.is_open:
                 try:
@@ -596,7 +876,7 @@ class SerialWrapper:
 
         return line
 
-    def readlines(self, decode=False):
+    def readlines(self, decode=False, wait=True):
         """ Read the last received lines from the serial buffer
 
         The lines are decoded to utf-8 and the newline character is removed
@@ -606,21 +886,29 @@ class SerialWrapper:
         ----------
         decode : bool
             True if the line is to be decoded using utf-8
+        wait : bool
+            False to read without waiting, when the port is known to be readable (see
+            utils.aioserial). Only the bytes already received are read, the call never
+            blocks
 
         Returns
         -------
-        lines : [string, ]
-            the processed lines read from the serial buffer. Empty if an error occured or
-            if the buffer is empty
+        lines : [string, ] or [bytes-like object, ]
+            the processed lines read from the serial buffer, see `framer`. Empty if an
+            error occured or if the buffer is empty. In FILE mode, the lines are views of
+            the file when they are not decoded, they are not copied. These views are only
+            valid until the next call
 
         """
         if self.failed:
             return []
 
-        if self.mode in ["RFD900", "BONJOUR"]:
-            error_code, error_msg, buffer = self.__read_serial_buffer()
+        if self.mode in ["RFD900", "BONJOUR", "PORT"]:
+            error_code, error_msg, buffer = self.__read_serial_buffer(wait)
+            count = len(buffer)
         elif self.mode == "FILE":
-            error_code, error_msg, buffer = self.__read_file_buffer()
+            error_code, error_msg, frames = self.__read_file_buffer(wait)
+            count = len(frames)
 
         if error_code:
             error = "{} : {}".format(self.name, error_msg)
@@ -628,18 +916,17 @@ class SerialWrapper:
             self.close_serial()
             return []
 
-        self.buffer.extend(buffer)
-
         # Not run if no new data has been retrieved
-        if self.buffer:
-            # Convert the buffer into a list of bytearray (one bytearray for each line)
-            r = self.buffer.split(b'\r\n')
-            # Data after the last \n is an incomplete line, save for later
-            self.buffer = r[-1]
-            # This is the complete lines
-            lines = r[:-1]
+        if count or self.framer.buffer:
+            # Extract the complete frames
+            if self.mode == "FILE":
+                # The frames of the file are delimited by the index
+                lines = frames
+            else:
+                # The incomplete frame is saved for later by the framer
+                lines = self.framer.feed(buffer)
             if decode:
-                lines = [l.decode('utf-8', 'backslashreplace') for l in lines]
+                lines = [str(l, 'utf-8', 'backslashreplace') for l in lines]
             if self.bonjour in lines or bytearray(map(ord, self.bonjour)) in lines:
                 self.is_ready = True
             return lines
@@ -0,0 +1,469 @@
+""" Indexed binary log of a reception session
+
+The legacy logs are frames separated by b'\r\n' (see utils.logindex): they tell neither
+when the frames were received, nor where a frame ends when its payload holds b'\r\n'.
+A session log stores each frame in a record instead:
+
+    header  : magic, version, monotonic and UNIX times of the creation in ns
+    records : length of the frame (uint32), receive time (int64, monotonic ns),
+              gateway id (uint16), frame
+    footer  : sparse time index, metadata (JSON), trailer
+
+The time index has one entry (receive time, offset, record number) per second of
+reception. Any time range is then read with one seek, without scanning the log. The
+metadata maps the gateway ids to the names of the Gateways. The trailer, at the very
+end of the file, gives the position of the index and of the metadata
+
+The footer is written when the log is closed. A log without footer (eg. after a crash)
+is still read, the index is then rebuilt by walking the records
+
+A session log can be block compressed (see utils.blockfile), the offsets are then
+positions in the uncompressed log
+
+All the integers are little endian
+
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from utils.blockfile import BLOCK_SIZE, CompressedWriter, open_log
+from utils.clock import SYSTEM_CLOCK
+
+
+MAGIC = b'SIGSLOG\x00'
+VERSION = 1
+SUFFIX = ".slog"
+
+HEADER = struct.Struct('<8sHqq')   # Magic, version, monotonic ns, UNIX ns
+RECORD = struct.Struct('<IqH')     # Length of the frame, receive time in ns, gateway id
+TRAILER = struct.Struct('<QQI8s')  # Index offset, index entries, metadata size, magic
+INDEX_DTYPE = np.dtype([('time', '<i8'), ('offset', '<u8'), ('record', '<u8')])
+
+INDEX_PERIOD = 10**9  # Time between two entries of the index in ns
+
+
+def encode_records(frames, times, gateway_id=0):
+    """ Encode frames into records
+
+    Parameters
+    ----------
+    frames : [bytes-like object, ]
+    times : int or [int, ]
+        receive time of the frames in ns, one for all of them or one per frame
+    gateway_id : int
+
+    Returns
+    -------
+    block : bytes
+
+    """
+    if isinstance(times, int):
+        times = [times]*len(frames)
+
+    pack = RECORD.pack
+    parts = []
+    for frame, time_ns in zip(frames, times):
+        parts.append(pack(len(frame), time_ns, gateway_id))
+        parts.append(frame)
+
+    return b''.join(parts)
+
+
+class SessionFormat:
+    """ Session log format, used by LogWriter to write the records of a Gateway
+
+    Parameters
+    ----------
+    name : str
+        name of the Gateway, saved in the metadata
+    gateway_id : int, optional
+        id of the Gateway in the records
+    clock : SystemClock or SimulatedClock instance, optional
+        clock of the receive times, see utils.clock. Used to date the log
+
+    Examples
+    --------
+    >>> writer = LogWriter("./data/telemetry.slog", log_format=SessionFormat("Telemetry"))
+    >>> writer.write(frames, clock.monotonic_ns())
+
+    """
+
+    suffix = SUFFIX
+
+    def __init__(self, name, gateway_id=0, clock=SYSTEM_CLOCK):
+        self.gateways = {gateway_id: name}
+        self.gateway_id = gateway_id
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        """ Start a new file """
+        self.position = HEADER.size  # Offset of the next record
+        self.records = 0
+        self.index = []
+        self.first_time = None
+        self.last_time = None
+
+    def open(self, path):
+        """ Create the file, see start()
+
+        An existing file is never appended to, a number is added to the name instead
+
+        Returns
+        -------
+        file : file object
+            opened for writing, its name is the path of the log
+
+        """
+        root, ext = os.path.splitext(path)
+        candidate = path
+        number = 0
+        while True:
+            try:
+                file = open(candidate, 'xb')
+                break
+            except FileExistsError:
+                number += 1
+                candidate = "{}-{}{}".format(root, number, ext)
+
+        return file
+
+    def start(self, file):
+        """ Write the header to the file opened by open() """
+        file.write(HEADER.pack(MAGIC, VERSION, self.clock.monotonic_ns(),
+                               int(self.clock.now().timestamp()*10**9)))
+
+    def encode(self, frames, received):
+        """ Encode frames received at once, called by the reading thread
+
+        Parameters
+        ----------
+        frames : [bytes-like object, ]
+        received : int
+            receive time of the frames in ns, see utils.clock
+
+        """
+        return encode_records(frames, received, self.gateway_id)
+
+    def add(self, size, count, received):
+        """ Account for a block written after the previous ones, see encode() """
+        if self.last_time is None or received >= self.index[-1][0] + INDEX_PERIOD:
+            self.index.append((received, self.position, self.records))
+        if self.first_time is None:
+            self.first_time = received
+        self.last_time = received
+        self.position += size
+        self.records += count
+
+    def finish(self, file):
+        """ Write the footer, the file can then be closed """
+        metadata = json.dumps({
+            'gateways': {str(gateway_id): name for gateway_id, name in self.gateways.items()},
+            'records': self.records,
+            'first_time': self.first_time,
+            'last_time': self.last_time,
+        }).encode('utf-8')
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+
+        file.write(index.tobytes())
+        file.write(metadata)
+        file.write(TRAILER.pack(self.position, len(index), len(metadata), MAGIC))
+        self.reset()
+
+
+def is_session_log(path):
+    """ Return True if the file at `path` is a session log, compressed or not """
+    try:
+        data = open_log(path)
+    except OSError:
+        return False
+    try:
+        return bytes(data.read(0, len(MAGIC))) == MAGIC
+    finally:
+        data.close()
+
+
+class SessionLog:
+    """ Read a session log through a memory map, or block by block if compressed
+
+    Parameters
+    ----------
+    filepath : path-like object
+    scan : bool, optional
+        True to walk all the records when the log is opened, to replay it as a LogIndex
+        (see `offsets`, `lengths`, `times`). Time ranges are read with read() without
+        scanning the log
+
+    Attributes
+    ----------
+    gateways : dict
+        {gateway id: name of the Gateway}
+    index : numpy structured array
+        sparse time index, fields 'time' (ns), 'offset' and 'record'
+    complete : bool
+        False if the log has no footer, eg. its writer crashed
+    start_monotonic, start_unix : int
+        monotonic and UNIX times in ns when the log was created. A receive time t was
+        at the UNIX time t - start_monotonic + start_unix
+    offsets, lengths : numpy array of int64
+        position and length of the frame of each record, once scanned
+    times : numpy array of float64
+        receive time of each record in seconds since the first one, once scanned
+    gateway_ids : numpy array of uint16
+        gateway of each record, once scanned
+    dropped : int
+        bytes of an incomplete record at the end of a log without footer
+
+    Examples
+    --------
+    >>> log = SessionLog("./data/2019-12-04T11-15-39_Telemetry.slog")
+    >>> times, gateway_ids, frames = log.read(60., 70.)  # Frames received from 60 s to 70 s
+    >>> log.close()
+
+    """
+
+    def __init__(self, filepath, scan=False):
+        self.filepath = filepath
+        self.data = open_log(filepath)
+        size = self.data.size
+        if size < HEADER.size:
+            self.data.close()
+            raise ValueError("{} is not a session log".format(filepath))
+
+        magic, version, self.start_monotonic, self.start_unix = HEADER.unpack(self.data.read(0, HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("{} is not a session log of version {}".format(filepath, VERSION))
+
+        self.dropped = self.data.dropped
+        self.gateways = {}
+        self.records = 0
+        self.complete = self.__read_footer(size)
+        if not self.complete:
+            self.__rebuild_index(size)
+
+        self.offsets = self.lengths = self.times = self.gateway_ids = None
+        if scan:
+            self.__scan()
+
+    def __len__(self):
+        return self.records
+
+    def close(self):
+        """ Release the map, the frames returned before must not be used anymore """
+        self.data.close()
+
+    def __read_footer(self, size):
+        """ Read the index and the metadata, returns False if the footer is missing """
+        if size < HEADER.size + TRAILER.size:
+            return False
+        index_offset, entries, metadata_size, magic = TRAILER.unpack(
+            self.data.read(size - TRAILER.size, TRAILER.size))
+        index_size = entries*INDEX_DTYPE.itemsize
+        if magic != MAGIC or index_offset + index_size + metadata_size + TRAILER.size != size:
+            return False
+
+        try:
+            metadata = json.loads(bytes(self.data.read(index_offset + index_size, metadata_size)))
+        except ValueError:
+            return False
+
+        self.index = np.frombuffer(self.data.read(index_offset, index_size), INDEX_DTYPE).copy()
+        self.gateways = {int(gateway_id): name for gateway_id, name in metadata['gateways'].items()}
+        self.records = metadata['records']
+        self.end = index_offset
+
+        return True
+
+    def __walk(self, offset, end):
+        """ Yield (offset of the record, length of the frame, time, gateway id) """
+        unpack = RECORD.unpack
+        read = self.data.read
+        while offset + RECORD.size <= end:
+            length, time_ns, gateway_id = unpack(read(offset, RECORD.size))
+            if offset + RECORD.size + length > end:
+                break
+            yield offset, length, time_ns, gateway_id
+            offset += RECORD.size + length
+
+    def __rebuild_index(self, size):
+        """ Walk the records of a log without footer """
+        index = []
+        records = 0
+        end = HEADER.size
+        for offset, length, time_ns, _ in self.__walk(HEADER.size, size):
+            if not index or time_ns >= index[-1][0] + INDEX_PERIOD:
+                index.append((time_ns, offset, records))
+            records += 1
+            end = offset + RECORD.size + length
+
+        self.index = np.array(index, dtype=INDEX_DTYPE)
+        self.records = records
+        self.end = end
+        # The last record was being written
+        self.dropped += size - end
+
+    def __scan(self):
+        """ Read the position and the time of every record """
+        offsets = np.empty(self.records, dtype=np.int64)
+        lengths = np.empty(self.records, dtype=np.int64)
+        times = np.empty(self.records, dtype=np.int64)
+        gateway_ids = np.empty(self.records, dtype=np.uint16)
+        count = 0
+        for offset, length, time_ns, gateway_id in self.__walk(HEADER.size, self.end):
+            if count == self.records:
+                break
+            offsets[count] = offset + RECORD.size
+            lengths[count] = length
+            times[count] = time_ns
+            gateway_ids[count] = gateway_id
+            count += 1
+        offsets, lengths = offsets[:count], lengths[:count]
+        times, gateway_ids = times[:count], gateway_ids[:count]
+        self.records = count
+
+        self.offsets = offsets
+        self.lengths = lengths
+        self.times = (times - times[0])/10**9 if len(times) else np.zeros(0)
+        self.gateway_ids = gateway_ids
+
+    @property
+    def first_time(self):
+        """ Receive time of the first record in ns, None if the log is empty """
+        return int(self.index['time'][0]) if len(self.index) else None
+
+    def read(self, start, stop):
+        """ Read the frames received in a time range
+
+        The records are read from the last entry of the index before `start`
+
+        Parameters
+        ----------
+        start, stop : float
+            seconds since the first record, `stop` excluded
+
+        Returns
+        -------
+        times : numpy array of int64
+            receive time of the frames in ns
+        gateway_ids : numpy array of uint16
+        frames : [memoryview, ]
+            views of the log
+
+        """
+        times, gateway_ids, frames = [], [], []
+        if self.first_time is not None:
+            start_ns = self.first_time + int(start*10**9)
+            stop_ns = self.first_time + int(stop*10**9)
+            entry = max(0, int(np.searchsorted(self.index['time'], start_ns, side='right')) - 1)
+
+            for offset, length, time_ns, gateway_id in self.__walk(int(self.index['offset'][entry]), self.end):
+                if time_ns >= stop_ns:
+                    break
+                if time_ns >= start_ns:
+                    times.append(time_ns)
+                    gateway_ids.append(gateway_id)
+                    frames.append(self.data.read(offset + RECORD.size, length))
+
+        return np.array(times, dtype=np.int64), np.array(gateway_ids, dtype=np.uint16), frames
+
+    # Same interface as LogIndex, once scanned
+
+    def frame(self, index):
+        """ Return a frame as a view of the log """
+        return self.data.read(int(self.offsets[index]), int(self.lengths[index]))
+
+    def frames(self, start, stop):
+        """ Return the frames from `start` to `stop` (excluded) as views of the log """
+        read = self.data.read
+
+        return [read(offset, length) for offset, length in zip(
+            self.offsets[start:stop].tolist(), self.lengths[start:stop].tolist())]
+
+    def search(self, seconds, start=0):
+        """ Return the index of the first frame after `seconds`, searching from `start` """
+        return start + int(np.searchsorted(self.times[start:], seconds, side='right'))
+
+
+def convert_log(source, destination, frames, name, compression=None):
+    """ Convert a legacy log into a session log
+
+    The frames of legacy logs have no receive time. When the vehicle has a clock, the
+    receive times are taken from it (counted from 0), otherwise all the frames are
+    stamped with 0
+
+    Parameters
+    ----------
+    source : path-like object
+        legacy log, see utils.logindex
+    destination : path-like object
+        session log to create. A number is added to its name if it already exists
+    frames : FrameRegistry instance
+        frames of the vehicle that sent the log, see utils.frames
+    name : str
+        name of the Gateway that received the log
+    compression : str, optional
+        "zlib", "gzip" or "lzma" to compress the session log, see utils.blockfile
+
+    Returns
+    -------
+    path : str
+        path of the session log
+    count : int
+        number of frames converted
+
+    """
+    # Imported here, utils.logindex is only needed to convert the legacy logs
+    from utils.framing import LineFramer
+    from utils.logindex import LogIndex
+
+    log_format = SessionFormat(name)
+    if frames.clock is not None:
+        log = LogIndex(source, frames, sidecar=False)
+        views = log.frames(0, len(log))
+        # Receive times never go backwards
+        times = np.round(np.maximum.accumulate(log.times)*10**9).astype(np.int64).tolist()
+    else:
+        log = None
+        legacy = open_log(source)
+        try:
+            data = bytes(legacy.read(0, legacy.size))
+        finally:
+            legacy.close()
+        framer = LineFramer(is_valid=frames.is_valid, max_length=frames.max_length)
+        views = framer.feed(data) + framer.flush()
+        times = [0]*len(views)
+
+    file = log_format.open(destination)
+    if compression is not None:
+        file = CompressedWriter(file, compression)
+    with file:
+        path = file.name
+        log_format.start(file)
+        # One block per second of flight, for the time index
+        start = 0
+        pending = 0  # Bytes written since the last compressed block
+        while start < len(views):
+            stop = start + 1
+            while stop < len(views) and times[stop] < times[start] + INDEX_PERIOD:
+                stop += 1
+            block = encode_records(views[start:stop], times[start:stop], log_format.gateway_id)
+            file.write(block)
+            log_format.add(len(block), stop - start, times[start])
+            start = stop
+            pending += len(block)
+            if pending >= BLOCK_SIZE:
+                file.flush()
+                pending = 0
+        log_format.finish(file)
+
+    count = len(views)
+    del views
+    if log is not None:
+        log.close()
+
+    return path, count
@@ -0,0 +1,129 @@
+""" Numeric time stamps of the frames
+
+Frames are time stamped with integer ticks (microseconds) counted from the midnight
+before the first frame. Ticks are derived once per frame from the RTC fields, or from
+the computer's clock, and shared by all the sensors of the frame. Comparing and
+subtracting them is much cheaper than building datetime objects
+
+The RTC only gives the time of day. A timeline keeps track of the midnight rollovers
+so that the ticks keep increasing when the clock goes from 23:59:59 to 00:00:00
+
+"""
+
+import numpy as np
+
+from utils.clock import SYSTEM_CLOCK
+
+
+TICKS_PER_SECOND = 10**6
+TICKS_PER_DAY = 24*60*60*TICKS_PER_SECOND
+
+
+def time_of_day_ticks(hour, minute, second, microsecond):
+    """ Convert a time of day into ticks since midnight
+
+    Parameters
+    ----------
+    hour, minute, second: int or numpy array
+    microsecond: float or numpy array
+        truncated to an integer, as done by datetime.time
+
+    Returns
+    -------
+    ticks: int or numpy array of int64
+
+    """
+    if isinstance(hour, np.ndarray):
+        hour = hour.astype(np.int64)
+        minute = np.asarray(minute).astype(np.int64)
+        second = np.asarray(second).astype(np.int64)
+        microsecond = np.asarray(microsecond).astype(np.int64)
+    else:
+        microsecond = int(microsecond)
+
+    return ((hour*60 + minute)*60 + second)*TICKS_PER_SECOND + microsecond
+
+
+class Timeline:
+    """ Turn times of day into ticks that keep increasing across midnight
+
+    A time of day earlier than the previous one by more than half a day is considered
+    to be on the next day. Smaller steps backwards (eg. a frame received out of order)
+    are kept as they are
+
+    Examples
+    --------
+    >>> timeline = Timeline()
+    >>> timeline.unwrap(time_of_day_ticks(23, 59, 59, 0)) # 86399000000
+    >>> timeline.unwrap(time_of_day_ticks(0, 0, 1, 0))    # 86401000000
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.days = 0
+        self.last = None
+
+    def unwrap(self, ticks):
+        """ Return the ticks of a time of day, counted from the first midnight
+
+        Parameters
+        ----------
+        ticks: int
+            ticks since the last midnight, see time_of_day_ticks()
+
+        Returns
+        -------
+        ticks: int
+
+        """
+        if self.last is not None and self.last - ticks > TICKS_PER_DAY//2:
+            self.days += 1
+        self.last = ticks
+
+        return ticks + self.days*TICKS_PER_DAY
+
+    def unwrap_batch(self, ticks):
+        """ Vectorized counterpart of unwrap()
+
+        Parameters
+        ----------
+        ticks: numpy array of int64
+            ticks since the last midnight, in the order the frames were received
+
+        Returns
+        -------
+        ticks: numpy array of int64
+
+        """
+        if not len(ticks):
+            return ticks
+
+        previous = np.empty_like(ticks)
+        previous[1:] = ticks[:-1]
+        previous[0] = ticks[0] if self.last is None else self.last
+
+        days = self.days + np.cumsum(previous - ticks > TICKS_PER_DAY//2)
+        self.days = int(days[-1])
+        self.last = int(ticks[-1])
+
+        return ticks + days*TICKS_PER_DAY
+
+    def now(self, clock=SYSTEM_CLOCK):
+        """ Return the ticks of the current time
+
+        Parameters
+        ----------
+        clock: SystemClock or SimulatedClock instance, optional
+            see utils.clock, the computer's clock by default
+
+        Returns
+        -------
+        ticks: int
+
+        """
+        now = clock.now()
+
+        return self.unwrap(time_of_day_ticks(now.hour, now.minute, now.second, now.microsecond))